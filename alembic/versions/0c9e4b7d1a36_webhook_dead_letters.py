@@ -0,0 +1,35 @@
+"""Add webhook_dead_letters for queued payments that could not be written
+
+Revision ID: 0c9e4b7d1a36
+Revises: f5a0b7c3d912
+Create Date: 2026-10-18 21:04:51.382907
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0c9e4b7d1a36'
+down_revision: Union[str, None] = 'f5a0b7c3d912'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade():
+    op.create_table(
+        'webhook_dead_letters',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('transaction_id', sa.String, nullable=False, unique=True),
+        sa.Column('user_id', sa.Integer, nullable=False),
+        sa.Column('account_id', sa.Integer, nullable=False),
+        sa.Column('amount', sa.BigInteger, nullable=False),
+        sa.Column('error', sa.String, nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+    )
+
+
+def downgrade():
+    op.drop_table('webhook_dead_letters')
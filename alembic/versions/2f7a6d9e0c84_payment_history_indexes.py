@@ -0,0 +1,32 @@
+"""Add payment timestamps and payment history indexes
+
+Revision ID: 2f7a6d9e0c84
+Revises: 8c41d0e2b975
+Create Date: 2026-10-18 10:40:52.207319
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '2f7a6d9e0c84'
+down_revision: Union[str, None] = '8c41d0e2b975'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade():
+    op.add_column('payments', sa.Column('created_at', sa.DateTime(timezone=True),
+                                        server_default=sa.func.now(), nullable=False))
+    # Payment history is read per owner: accounts by owner_id, then payments by account in id order.
+    op.create_index('ix_payments_account_id_id', 'payments', ['account_id', 'id'])
+    op.create_index('ix_accounts_owner_id', 'accounts', ['owner_id'])
+
+
+def downgrade():
+    op.drop_index('ix_accounts_owner_id', table_name='accounts')
+    op.drop_index('ix_payments_account_id_id', table_name='payments')
+    op.drop_column('payments', 'created_at')
@@ -0,0 +1,38 @@
+"""Add payments table
+
+Revision ID: 5b2e9c4a7f13
+Revises: 1d817c73eef9
+Create Date: 2026-10-18 09:12:40.118203
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b2e9c4a7f13'
+down_revision: Union[str, None] = '1d817c73eef9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade():
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+
+    # The webhook ingestion path relies on the unique constraint on transaction_id
+    # instead of checking for an existing payment before inserting.
+    if 'payments' not in inspector.get_table_names():
+        op.create_table(
+            'payments',
+            sa.Column('id', sa.Integer, primary_key=True, index=True),
+            sa.Column('transaction_id', sa.String, unique=True, index=True),
+            sa.Column('amount', sa.Float),
+            sa.Column('account_id', sa.Integer, sa.ForeignKey('accounts.id', ondelete="CASCADE")),
+        )
+
+
+def downgrade():
+    op.drop_table('payments')
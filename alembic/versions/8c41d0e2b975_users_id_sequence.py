@@ -0,0 +1,30 @@
+"""Generate user IDs from a sequence
+
+Revision ID: 8c41d0e2b975
+Revises: 5b2e9c4a7f13
+Create Date: 2026-10-18 10:02:11.534870
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8c41d0e2b975'
+down_revision: Union[str, None] = '5b2e9c4a7f13'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade():
+    # The initial migration seeds users with explicit IDs, which leaves the serial sequence behind
+    # the data. Make sure the column draws from a sequence and move it past the existing rows.
+    op.execute("CREATE SEQUENCE IF NOT EXISTS users_id_seq OWNED BY users.id")
+    op.execute("ALTER TABLE users ALTER COLUMN id SET DEFAULT nextval('users_id_seq')")
+    op.execute("SELECT setval('users_id_seq', COALESCE((SELECT MAX(id) FROM users), 0) + 1, false)")
+
+
+def downgrade():
+    # The sequence is what a serial column would own anyway, so it is left in place.
+    pass
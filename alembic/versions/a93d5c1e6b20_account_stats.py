@@ -0,0 +1,42 @@
+"""Add account_stats aggregate table
+
+Revision ID: a93d5c1e6b20
+Revises: 2f7a6d9e0c84
+Create Date: 2026-10-18 11:25:06.871544
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a93d5c1e6b20'
+down_revision: Union[str, None] = '2f7a6d9e0c84'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade():
+    op.create_table(
+        'account_stats',
+        sa.Column('account_id', sa.Integer, sa.ForeignKey('accounts.id', ondelete="CASCADE"), primary_key=True),
+        sa.Column('payment_count', sa.BigInteger, nullable=False, server_default='0'),
+        sa.Column('last_payment_id', sa.Integer),
+        sa.Column('last_payment_amount', sa.Float),
+        sa.Column('last_payment_at', sa.DateTime(timezone=True)),
+    )
+
+    # Backfill from the existing ledger.
+    op.execute("""
+        INSERT INTO account_stats (account_id, payment_count, last_payment_id, last_payment_amount, last_payment_at)
+        SELECT counts.account_id, counts.payment_count, last.id, last.amount, last.created_at
+        FROM (SELECT account_id, count(*) AS payment_count, max(id) AS last_payment_id
+              FROM payments GROUP BY account_id) AS counts
+        JOIN payments AS last ON last.id = counts.last_payment_id
+    """)
+
+
+def downgrade():
+    op.drop_table('account_stats')
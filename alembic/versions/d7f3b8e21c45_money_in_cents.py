@@ -0,0 +1,39 @@
+"""Store amounts and balances as BIGINT cents
+
+Revision ID: d7f3b8e21c45
+Revises: a93d5c1e6b20
+Create Date: 2026-10-18 16:02:44.317905
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd7f3b8e21c45'
+down_revision: Union[str, None] = 'a93d5c1e6b20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (table, column) pairs holding money, converted between float currency units and integer cents.
+MONEY_COLUMNS = (
+    ('accounts', 'balance'),
+    ('payments', 'amount'),
+    ('account_stats', 'last_payment_amount'),
+)
+
+
+def upgrade():
+    # Each ALTER rewrites its table under an exclusive lock; on a large ledger run it in a maintenance window.
+    # Float drift already accumulated in balances is rounded to the nearest cent.
+    for table, column in MONEY_COLUMNS:
+        op.alter_column(table, column, type_=sa.BigInteger, existing_type=sa.Float,
+                        postgresql_using=f'round({column} * 100)::bigint')
+
+
+def downgrade():
+    for table, column in MONEY_COLUMNS:
+        op.alter_column(table, column, type_=sa.Float, existing_type=sa.BigInteger,
+                        postgresql_using=f'{column} / 100.0')
@@ -0,0 +1,56 @@
+"""Add account_balance_shards for hot accounts
+
+Revision ID: e41c6a9d2f70
+Revises: d7f3b8e21c45
+Create Date: 2026-10-18 17:40:12.508311
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e41c6a9d2f70'
+down_revision: Union[str, None] = 'd7f3b8e21c45'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade():
+    op.create_table(
+        'account_balance_shards',
+        sa.Column('account_id', sa.Integer, sa.ForeignKey('accounts.id', ondelete="CASCADE"), primary_key=True),
+        sa.Column('shard', sa.SmallInteger, primary_key=True),
+        sa.Column('delta', sa.BigInteger, nullable=False, server_default='0'),
+        sa.Column('payment_count', sa.BigInteger, nullable=False, server_default='0'),
+        sa.Column('last_payment_id', sa.Integer),
+        sa.Column('last_payment_amount', sa.BigInteger),
+        sa.Column('last_payment_at', sa.DateTime(timezone=True)),
+    )
+
+
+def downgrade():
+    # Fold pending deltas and payment aggregates back into the accounts before dropping the shards.
+    op.execute("""
+        UPDATE accounts SET balance = accounts.balance + pending.delta
+        FROM (SELECT account_id, sum(delta) AS delta FROM account_balance_shards GROUP BY account_id) AS pending
+        WHERE accounts.id = pending.account_id
+    """)
+    op.execute("""
+        INSERT INTO account_stats (account_id, payment_count, last_payment_id, last_payment_amount, last_payment_at)
+        SELECT DISTINCT ON (account_id) account_id, sum(payment_count) OVER (PARTITION BY account_id),
+               last_payment_id, last_payment_amount, last_payment_at
+        FROM account_balance_shards
+        WHERE payment_count > 0
+        ORDER BY account_id, last_payment_id DESC NULLS LAST
+        ON CONFLICT (account_id) DO UPDATE SET
+            payment_count = account_stats.payment_count + excluded.payment_count,
+            last_payment_id = greatest(account_stats.last_payment_id, excluded.last_payment_id),
+            last_payment_amount = CASE WHEN excluded.last_payment_id > coalesce(account_stats.last_payment_id, 0)
+                                       THEN excluded.last_payment_amount ELSE account_stats.last_payment_amount END,
+            last_payment_at = CASE WHEN excluded.last_payment_id > coalesce(account_stats.last_payment_id, 0)
+                                   THEN excluded.last_payment_at ELSE account_stats.last_payment_at END
+    """)
+    op.drop_table('account_balance_shards')
@@ -0,0 +1,31 @@
+"""Add job_checkpoints for resumable background jobs
+
+Revision ID: f5a0b7c3d912
+Revises: e41c6a9d2f70
+Create Date: 2026-10-18 19:12:37.640218
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f5a0b7c3d912'
+down_revision: Union[str, None] = 'e41c6a9d2f70'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade():
+    op.create_table(
+        'job_checkpoints',
+        sa.Column('name', sa.String, primary_key=True),
+        sa.Column('last_id', sa.Integer),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+    )
+
+
+def downgrade():
+    op.drop_table('job_checkpoints')
@@ -0,0 +1,101 @@
+import asyncio
+import time
+
+from loguru import logger
+
+from config import (BALANCE_COMPACTION_INTERVAL_SECONDS,
+                    BALANCE_COMPACTION_CHECK_SECONDS,
+                    BALANCE_COMPACTION_MAX_PENDING)
+from database.crud import compact_account_balances, get_pending_balance_shards
+from database.postgre_db import async_session
+from metrics import Counter, Gauge, Histogram
+
+compactions_total = Counter("balance_compactions_total", "Hot account shard compactions", ("trigger",))
+compaction_failures_total = Counter("balance_compaction_failures_total", "Failed hot account shard compactions")
+folded_accounts_total = Counter("balance_compaction_folded_accounts_total",
+                                "Accounts whose pending shards were folded into the balance")
+pending_payments = Gauge("balance_shards_pending_payments", "Payments in hot account shards not yet compacted")
+compaction_seconds = Histogram("balance_compaction_seconds", "Duration of one hot account shard compaction")
+for trigger in ("interval", "size", "shutdown"):
+    compactions_total.labels(trigger)
+
+
+class BalanceCompactor:
+    """
+    Фоновая свертка шардов баланса горячих счетов.
+
+    Каждые `check_interval` секунд проверяет, сколько платежей накопилось в шардах. Счета, у которых их не меньше
+    `max_pending`, сворачиваются сразу, остальные - не реже раза в `interval` секунд. При остановке сворачивает
+    все, что осталось. Свертка безопасна при нескольких процессах: параллельные свертки одного счета
+    упорядочиваются блокировками строк шардов.
+    """
+
+    def __init__(self, interval: float, check_interval: float, max_pending: int):
+        self.interval = interval
+        self.check_interval = check_interval
+        self.max_pending = max_pending
+        self._task = None
+        self._stopping = None
+
+    async def start(self):
+        logger.info("Starting balance compaction: every {} s or at {} pending payments",
+                    self.interval, self.max_pending)
+        self._stopping = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._stopping.set()
+        await self._task
+        self._task = None
+        await self.compact("shutdown")
+        logger.info("Balance compaction stopped")
+
+    async def compact(self, trigger: str, account_ids: list = None):
+        started = time.perf_counter()
+        try:
+            async with async_session() as session:
+                if account_ids is None:
+                    account_ids = list(await get_pending_balance_shards(session))
+                if not account_ids:
+                    return
+                folded = await compact_account_balances(session, account_ids)
+        except Exception as e:
+            compaction_failures_total.inc()
+            logger.error("Balance compaction failed: {}", e)
+            return
+        compaction_seconds.observe(time.perf_counter() - started)
+        compactions_total.labels(trigger).inc()
+        folded_accounts_total.inc(len(folded))
+        logger.info("Compacted pending balances of {} accounts ({})", len(folded), trigger)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        next_compaction = loop.time() + self.interval
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.check_interval)
+                break
+            except asyncio.TimeoutError:
+                pass
+            if loop.time() >= next_compaction:
+                await self.compact("interval")
+                next_compaction = loop.time() + self.interval
+                continue
+            try:
+                async with async_session() as session:
+                    pending = await get_pending_balance_shards(session)
+            except Exception as e:
+                compaction_failures_total.inc()
+                logger.error("Checking pending balance shards failed: {}", e)
+                continue
+            pending_payments.set(sum(pending.values()))
+            due = sorted(account_id for account_id, count in pending.items() if count >= self.max_pending)
+            if due:
+                await self.compact("size", due)
+
+
+balance_compactor = BalanceCompactor(interval=BALANCE_COMPACTION_INTERVAL_SECONDS,
+                                     check_interval=BALANCE_COMPACTION_CHECK_SECONDS,
+                                     max_pending=BALANCE_COMPACTION_MAX_PENDING)
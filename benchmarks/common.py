@@ -0,0 +1,56 @@
+import json
+import statistics
+import time
+import uuid
+
+import httpx
+
+from money import parse_amount
+from rate_limit import admission_control
+from signing import webhook_signer
+
+
+def percentile(samples: list, q: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def latency_report(samples: list) -> dict:
+    """Сводка задержек в миллисекундах по списку замеров в секундах."""
+    ms = [sample * 1000 for sample in samples]
+    return {
+        "count": len(ms),
+        "mean_ms": round(statistics.fmean(ms), 3),
+        "p50_ms": round(percentile(ms, 50), 3),
+        "p95_ms": round(percentile(ms, 95), 3),
+        "p99_ms": round(percentile(ms, 99), 3),
+        "max_ms": round(max(ms), 3),
+    }
+
+
+def print_report(report: dict):
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+def signed_webhook_payload(user_id: int, account_id: int, amount: float, transaction_id: str = None) -> dict:
+    transaction_id = transaction_id or uuid.uuid4().hex
+    return {
+        "transaction_id": transaction_id,
+        "user_id": user_id,
+        "account_id": account_id,
+        "amount": amount,
+        "signature": webhook_signer.sign(transaction_id, user_id, account_id, parse_amount(amount)),
+    }
+
+
+def asgi_client(app, rate_limits: bool = False) -> httpx.AsyncClient:
+    # All benchmark traffic comes from one client, so per-client rate limits are off unless asked for.
+    admission_control.enabled = rate_limits
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench")
+
+
+async def timed_request(client: httpx.AsyncClient, method: str, url: str, **kwargs):
+    started = time.perf_counter()
+    response = await client.request(method, url, **kwargs)
+    return time.perf_counter() - started, response
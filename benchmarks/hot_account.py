@@ -0,0 +1,89 @@
+"""
+Конкуренция за строку баланса горячего счета: `--requests` одновременных вебхуков `/webhook` (по умолчанию 200)
+на один счет.
+
+Замер выполняется в двух режимах: `row_lock` - прежняя запись, при которой каждый платеж обновляет строку
+`accounts` и ждет ее блокировки, и `sharded` - счет в `HOT_ACCOUNT_IDS`, платеж добавляется в один из
+`HOT_ACCOUNT_SHARDS` шардов баланса. Приложение получает пул из `--connections` соединений, чтобы одновременно
+выполнялось много транзакций. После каждого раунда проверяется, что `get_account_by_id` возвращает точный
+баланс до свертки шардов и после нее. Нужен Postgres: запись платежа в `/webhook` построена на CTE с INSERT.
+
+    python -m benchmarks.hot_account --requests 200 --rounds 5
+"""
+import argparse
+import asyncio
+import random
+import time
+
+import database.postgre_db as postgre_db
+from benchmarks.common import asgi_client, latency_report, print_report, signed_webhook_payload, timed_request
+from config import DATABASE_URL, HOT_ACCOUNT_IDS, HOT_ACCOUNT_SHARDS
+from database.crud import compact_account_balances, get_account_by_id
+from database.postgre_db import async_session, create_engine
+from main import app
+from money import parse_amount
+
+
+async def balance(account_id: int):
+    async with async_session() as session:
+        account = await get_account_by_id(session, account_id)
+        return 0 if account is None else account.balance
+
+
+async def run(mode: str, requests: int, rounds: int, user_id: int, account_id: int) -> dict:
+    if mode == "sharded":
+        HOT_ACCOUNT_IDS.add(account_id)
+    else:
+        HOT_ACCOUNT_IDS.discard(account_id)
+    samples = []
+    elapsed = 0.0
+    errors = 0
+    exact = True
+    async with asgi_client(app) as client:
+        for _ in range(rounds):
+            before = await balance(account_id)
+            payloads = [signed_webhook_payload(user_id, account_id, round(random.uniform(1, 500), 2))
+                        for _ in range(requests)]
+            started = time.perf_counter()
+            results = await asyncio.gather(*(timed_request(client, "POST", "/webhook", json=payload, timeout=None)
+                                             for payload in payloads))
+            elapsed += time.perf_counter() - started
+            samples += [seconds for seconds, _ in results]
+            errors += sum(1 for _, response in results if response.status_code >= 400)
+
+            expected = before + sum(parse_amount(payload["amount"]) for payload in payloads)
+            exact = exact and await balance(account_id) == expected
+            async with async_session() as session:
+                await compact_account_balances(session, [account_id])
+            exact = exact and await balance(account_id) == expected
+    return {
+        "mode": mode,
+        "webhooks": requests * rounds,
+        "errors": errors,
+        "webhooks_per_sec": round(requests * rounds / elapsed, 1),
+        "latency": latency_report(samples),
+        "balance_exact": exact,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200, help="одновременных вебхуков в раунде")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--connections", type=int, default=50, help="размер пула соединений приложения")
+    parser.add_argument("--user-id", type=int, default=2)
+    parser.add_argument("--account-id", type=int, default=300_000)
+    args = parser.parse_args()
+
+    engine = create_engine(DATABASE_URL, "primary", pool_size=args.connections, max_overflow=0)
+    postgre_db.engine = engine
+    async_session.configure(bind=engine)
+    report = {"requests": args.requests, "connections": args.connections, "shards": HOT_ACCOUNT_SHARDS,
+              "results": [await run(mode, args.requests, args.rounds, args.user_id, args.account_id)
+                          for mode in ("row_lock", "sharded")]}
+    await engine.dispose()
+    print_report(report)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,75 @@
+"""
+Микробенчмарк сериализации списка платежей, как в ответе `/user/me/payments`: время кодирования `--payments`
+платежей в JSON для прежнего пути (ORM-объекты через `jsonable_encoder` и стандартный `json`), для пути через
+`response_model` и для строк проекции столбцов, как в `rows_response`, со стандартным `json` и с orjson, если он
+установлен. База данных не нужна: строки собираются из тех же столбцов `PAYMENT_COLUMNS`, что и в запросе.
+
+    python -m benchmarks.json_serialization --payments 10000
+"""
+import argparse
+import json
+import time
+from datetime import datetime, timedelta, timezone
+from typing import List
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+from sqlalchemy.engine.result import SimpleResultMetaData
+from sqlalchemy.engine.row import Row
+
+from benchmarks.common import print_report
+from database.crud import PAYMENT_COLUMNS
+from database.models import Payment
+from database.schemas import PaymentResponse
+import json_response
+from money import Money
+
+
+def payment_fields(count: int) -> list:
+    started = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    return [(number, f"bench-json-{number}", Money(100 + number % 50_000), 300_000 + number % 100,
+             started + timedelta(seconds=number)) for number in range(1, count + 1)]
+
+
+def measure(name: str, function, repeat: int) -> dict:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body = function()
+        timings.append(time.perf_counter() - started)
+    return {"implementation": name, "best_ms": round(min(timings) * 1000, 3), "bytes": len(body)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--payments", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    fields = payment_fields(args.payments)
+    keys = [column.key for column in PAYMENT_COLUMNS]
+    metadata = SimpleResultMetaData(keys)
+    rows = [Row(metadata, metadata._processors, metadata._key_to_index, values) for values in fields]
+    payments = [Payment(**dict(zip(keys, values))) for values in fields]
+    adapter = TypeAdapter(List[PaymentResponse])
+
+    def stdlib_json(content) -> bytes:
+        return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode()
+
+    report = [
+        measure("orm_jsonable_encoder_json",
+                lambda: stdlib_json(jsonable_encoder(payments)), args.repeat),
+        # What FastAPI does with response_model: validate from attributes, dump to JSON types, encode.
+        measure("orm_response_model", lambda: stdlib_json(adapter.dump_python(
+            adapter.validate_python(payments, from_attributes=True), mode="json")), args.repeat),
+        measure("rows_stdlib_json",
+                lambda: json_response.stdlib_dumps([row._asdict() for row in rows]), args.repeat),
+    ]
+    if json_response.orjson is not None:
+        report.append(measure("rows_orjson",
+                              lambda: json_response.orjson_dumps([row._asdict() for row in rows]), args.repeat))
+    print_report({"payments": args.payments, "results": report})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+"""
+Нагрузочный тест всего API. Приложение `main.app` запускается в процессе вместе с lifespan и вызывается через
+ASGI, база - из `.env` или из `--database-url`: Postgres с примененными миграциями либо файл SQLite, схема
+которого создается по моделям.
+
+С флагом `--seed` в базу добавляются администратор и `--users` пользователей с `--accounts-per-user` счетами
+и `--payments-per-account` платежами на счет (повторный запуск с `--seed` переиспользует эти данные).
+Затем в течение `--duration` секунд одновременно работают сценарии:
+
+- `login` - шторм входов через `/login`;
+- `webhook` - пачки одновременных вебхуков `/webhook` по `--webhook-burst` штук или, с `--webhook-mode batch`,
+  такие же пачки одним запросом `/webhook/batch`. На SQLite по умолчанию используется `batch`: запись платежа
+  в `/webhook` построена на CTE с INSERT, которые есть только в Postgres;
+- `polling` - опрос `/user/me`, `/user/me/accounts`, `/user/me/payments` и `/user/me/summary` с `If-None-Match`;
+- `admin` - постраничный обход `/users/all` и `/users/{user_id}/accounts`.
+
+Отчет в формате JSON содержит для каждого маршрута число запросов, ошибок и ответов по кодам, запросов в секунду
+и перцентили задержки. С `--output` отчет сохраняется в файл, а с `--baseline` сравнивается с сохраненным ранее:
+если p50, p95 или p99 выросли либо запросов в секунду стало меньше больше чем на `--max-regression`, скрипт
+завершается с кодом 1.
+
+    python -m benchmarks.load_test --database-url sqlite+aiosqlite:////tmp/bench.db --seed --output base.json
+    python -m benchmarks.load_test --database-url sqlite+aiosqlite:////tmp/bench.db --baseline base.json
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import insert, select
+
+import database.postgre_db as postgre_db
+from benchmarks.common import asgi_client, latency_report, print_report, signed_webhook_payload
+from config import DATABASE_URL
+from database.models import User, Account, Payment, AccountStats
+from database.postgre_db import Base, async_session, create_engine
+from main import app
+from security import create_access_token, hash_password
+
+EMAIL_PREFIX = "bench-load-"
+ADMIN_EMAIL = "bench-load-admin@example.com"
+PASSWORD = "bench-password"
+WORKLOADS = ("login", "webhook", "polling", "admin")
+# Users the workloads pick from; a sample is enough and keeps start-up fast on large seeds.
+SAMPLE_USERS = 10_000
+
+
+def bind_database(url: str):
+    # Points the application's engine and session factory at another database, e.g. a SQLite file.
+    engine = create_engine(url, "primary")
+    postgre_db.engine = engine
+    async_session.configure(bind=engine)
+    return engine
+
+
+async def seed(session, users: int, accounts_per_user: int, payments_per_account: int, chunk_size: int) -> bool:
+    if await session.scalar(select(User.id).where(User.email == ADMIN_EMAIL)) is not None:
+        return False
+    hashed_password = await hash_password(PASSWORD)
+    await session.execute(insert(User), [{"email": ADMIN_EMAIL, "hashed_password": hashed_password,
+                                          "full_name": "Bench Admin", "role": "admin"}])
+    rng = random.Random(0)
+    started = datetime.now(timezone.utc) - timedelta(days=365)
+    for first in range(0, users, chunk_size):
+        user_ids = (await session.execute(insert(User).returning(User.id, sort_by_parameter_order=True), [
+            {"email": f"{EMAIL_PREFIX}{number}@example.com", "hashed_password": hashed_password,
+             "full_name": f"Bench User {number}", "role": "user"}
+            for number in range(first, min(users, first + chunk_size))
+        ])).scalars().all()
+
+        amounts = [[rng.randint(100, 50_000) for _ in range(payments_per_account)]
+                   for _ in range(len(user_ids) * accounts_per_user)]
+        account_ids = (await session.execute(insert(Account).returning(Account.id, sort_by_parameter_order=True), [
+            {"owner_id": user_id, "balance": sum(amounts[number * accounts_per_user + index])}
+            for number, user_id in enumerate(user_ids) for index in range(accounts_per_user)
+        ])).scalars().all()
+
+        payment_rows = [{"transaction_id": f"{EMAIL_PREFIX}{account_id}-{index}", "account_id": account_id,
+                         "amount": amount, "created_at": started + timedelta(minutes=index)}
+                        for account_id, account_amounts in zip(account_ids, amounts)
+                        for index, amount in enumerate(account_amounts)]
+        if payment_rows:
+            payments = (await session.execute(
+                insert(Payment).returning(Payment.id, Payment.account_id, Payment.amount, Payment.created_at),
+                payment_rows)).all()
+            last_payments = {}
+            for payment in payments:
+                last_payment = last_payments.get(payment.account_id)
+                if last_payment is None or payment.id > last_payment.id:
+                    last_payments[payment.account_id] = payment
+            await session.execute(insert(AccountStats), [
+                {"account_id": account_id, "payment_count": payments_per_account, "last_payment_id": payment.id,
+                 "last_payment_amount": payment.amount, "last_payment_at": payment.created_at}
+                for account_id, payment in last_payments.items()
+            ])
+        await session.commit()
+    return True
+
+
+async def load_users(session) -> tuple:
+    admin = (await session.execute(select(User.id, User.email, User.role)
+                                   .where(User.email == ADMIN_EMAIL))).one_or_none()
+    if admin is None:
+        raise SystemExit("No benchmark data in the database; run with --seed first")
+    users = (await session.execute(select(User.id, User.email, User.role)
+                                   .where(User.email.like(f"{EMAIL_PREFIX}%"), User.role == "user")
+                                   .order_by(User.id)
+                                   .limit(SAMPLE_USERS))).all()
+    accounts = {}
+    for account_id, owner_id in await session.execute(select(Account.id, Account.owner_id)
+                                                      .where(Account.owner_id.in_([user.id for user in users]))):
+        accounts.setdefault(owner_id, []).append(account_id)
+    return admin, [user for user in users if user.id in accounts], accounts
+
+
+def bearer(user) -> dict:
+    token = create_access_token(data={"sub": user.email, "id": user.id, "role": user.role},
+                                expires_delta=timedelta(hours=1))
+    return {"Authorization": f"Bearer {token}"}
+
+
+class Recorder:
+    """
+    Собирает задержки и коды ответов по маршрутам. Запросы, начатые до конца прогрева, не учитываются.
+    """
+
+    def __init__(self, measure_from: float):
+        self.measure_from = measure_from
+        self.samples = {}
+        self.statuses = {}
+
+    async def request(self, client, endpoint: str, method: str, url: str, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+            status_code = response.status_code
+        except Exception:
+            response = None
+            status_code = "exception"
+        if started >= self.measure_from:
+            self.samples.setdefault(endpoint, []).append(time.perf_counter() - started)
+            statuses = self.statuses.setdefault(endpoint, {})
+            statuses[status_code] = statuses.get(status_code, 0) + 1
+        return response
+
+    def report(self, seconds: float) -> dict:
+        endpoints = {}
+        for endpoint in sorted(self.samples):
+            statuses = self.statuses[endpoint]
+            endpoints[endpoint] = {
+                **latency_report(self.samples[endpoint]),
+                "rps": round(len(self.samples[endpoint]) / seconds, 1),
+                "errors": sum(count for status_code, count in statuses.items()
+                              if status_code == "exception" or status_code >= 400),
+                "statuses": {str(status_code): count for status_code, count in sorted(statuses.items(), key=str)},
+            }
+        return endpoints
+
+
+async def login_worker(client, recorder: Recorder, users: list, deadline: float):
+    while time.perf_counter() < deadline:
+        user = random.choice(users)
+        await recorder.request(client, "POST /login", "POST", "/login",
+                               json={"email": user.email, "password": PASSWORD})
+
+
+async def webhook_worker(client, recorder: Recorder, users: list, accounts: dict, deadline: float,
+                         burst: int, interval: float, mode: str):
+    def payload():
+        user = random.choice(users)
+        return signed_webhook_payload(user.id, random.choice(accounts[user.id]), round(random.uniform(1, 500), 2))
+
+    async def send():
+        await recorder.request(client, "POST /webhook", "POST", "/webhook", json=payload())
+
+    while time.perf_counter() < deadline:
+        if mode == "batch":
+            await recorder.request(client, "POST /webhook/batch", "POST", "/webhook/batch",
+                                   json=[payload() for _ in range(burst)])
+        else:
+            await asyncio.gather(*(send() for _ in range(burst)))
+        await asyncio.sleep(interval)
+
+
+async def polling_worker(client, recorder: Recorder, user, deadline: float, interval: float):
+    headers = bearer(user)
+    etags = {}
+    routes = (("GET /user/me", "/user/me"),
+              ("GET /user/me/accounts", "/user/me/accounts"),
+              ("GET /user/me/payments", "/user/me/payments?limit=50"),
+              ("GET /user/me/summary", "/user/me/summary"))
+    while time.perf_counter() < deadline:
+        for endpoint, url in routes:
+            request_headers = {**headers, "If-None-Match": etags[url]} if url in etags else headers
+            response = await recorder.request(client, endpoint, "GET", url, headers=request_headers)
+            if response is not None and "etag" in response.headers:
+                etags[url] = response.headers["etag"]
+        await asyncio.sleep(interval)
+
+
+async def admin_worker(client, recorder: Recorder, admin, users: list, deadline: float, page_size: int):
+    headers = bearer(admin)
+    after_id = 0
+    while time.perf_counter() < deadline:
+        response = await recorder.request(client, "GET /users/all", "GET", f"/users/all?after_id={after_id}"
+                                          f"&limit={page_size}", headers=headers)
+        next_after_id = response.headers.get("x-next-after-id") if response is not None else None
+        after_id = int(next_after_id) if next_after_id else 0
+        await recorder.request(client, "GET /users/{user_id}/accounts", "GET",
+                               f"/users/{random.choice(users).id}/accounts", headers=headers)
+
+
+def regressions(report: dict, baseline: dict, threshold: float) -> list:
+    failures = []
+    for endpoint, current in report["endpoints"].items():
+        previous = baseline.get("endpoints", {}).get(endpoint)
+        if previous is None:
+            continue
+        for metric in ("p50_ms", "p95_ms", "p99_ms"):
+            if current[metric] > previous[metric] * (1 + threshold):
+                failures.append(f"{endpoint}: {metric} {previous[metric]} -> {current[metric]}")
+        if current["rps"] < previous["rps"] * (1 - threshold):
+            failures.append(f"{endpoint}: rps {previous['rps']} -> {current['rps']}")
+    return failures
+
+
+async def run(args) -> dict:
+    engine = bind_database(args.database_url) if args.database_url else postgre_db.engine
+    if engine.dialect.name == "sqlite":
+        async with engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+
+    seeded = False
+    async with async_session() as session:
+        if args.seed:
+            seeded = await seed(session, args.users, args.accounts_per_user, args.payments_per_account,
+                                args.chunk_size)
+        admin, users, accounts = await load_users(session)
+
+    workloads = set(args.workloads.split(","))
+    webhook_mode = args.webhook_mode or ("batch" if engine.dialect.name == "sqlite" else "single")
+    async with app.router.lifespan_context(app), asgi_client(app) as client:
+        started = time.perf_counter()
+        recorder = Recorder(started + args.warmup)
+        deadline = started + args.warmup + args.duration
+        tasks = []
+        if "login" in workloads:
+            tasks += [login_worker(client, recorder, users, deadline) for _ in range(args.login_users)]
+        if "webhook" in workloads:
+            tasks += [webhook_worker(client, recorder, users, accounts, deadline, args.webhook_burst,
+                                     args.webhook_interval, webhook_mode) for _ in range(args.webhook_users)]
+        if "polling" in workloads:
+            tasks += [polling_worker(client, recorder, random.choice(users), deadline, args.poll_interval)
+                      for _ in range(args.polling_users)]
+        if "admin" in workloads:
+            tasks += [admin_worker(client, recorder, admin, users, deadline, args.admin_page_size)
+                      for _ in range(args.admin_users)]
+        await asyncio.gather(*tasks)
+        seconds = time.perf_counter() - recorder.measure_from
+
+    await engine.dispose()
+    return {
+        "database": engine.dialect.name,
+        "seeded": seeded,
+        "users": len(users),
+        "duration_seconds": round(seconds, 1),
+        "workloads": sorted(workloads),
+        "webhook_mode": webhook_mode,
+        "endpoints": recorder.report(seconds),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help=f"по умолчанию база из настроек ({DATABASE_URL.split('@')[-1]})")
+    parser.add_argument("--seed", action="store_true")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--accounts-per-user", type=int, default=2)
+    parser.add_argument("--payments-per-account", type=int, default=50)
+    parser.add_argument("--chunk-size", type=int, default=1000, help="пользователей на одну транзакцию при заполнении")
+    parser.add_argument("--workloads", default=",".join(WORKLOADS), help="сценарии через запятую")
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--warmup", type=float, default=3, help="секунды в начале прогона, которые не учитываются")
+    parser.add_argument("--login-users", type=int, default=2)
+    parser.add_argument("--webhook-users", type=int, default=2)
+    parser.add_argument("--webhook-burst", type=int, default=20)
+    parser.add_argument("--webhook-interval", type=float, default=0.5)
+    parser.add_argument("--webhook-mode", choices=("single", "batch"))
+    parser.add_argument("--polling-users", type=int, default=50)
+    parser.add_argument("--poll-interval", type=float, default=0.0)
+    parser.add_argument("--admin-users", type=int, default=2)
+    parser.add_argument("--admin-page-size", type=int, default=100)
+    parser.add_argument("--output", help="сохранить отчет в файл, чтобы использовать его как --baseline")
+    parser.add_argument("--baseline", help="отчет предыдущего прогона для сравнения")
+    parser.add_argument("--max-regression", type=float, default=0.10,
+                        help="допустимое ухудшение задержки и запросов в секунду, доля от базового значения")
+    args = parser.parse_args()
+    unknown = set(args.workloads.split(",")) - set(WORKLOADS)
+    if unknown:
+        parser.error(f"unknown workloads: {', '.join(sorted(unknown))}")
+
+    report = await run(args)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as baseline:
+            report["regressions"] = regressions(report, json.load(baseline), args.max_regression)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(report, output, indent=2, ensure_ascii=False)
+    print_report(report)
+    sys.exit(1 if report.get("regressions") else 0)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
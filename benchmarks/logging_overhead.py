@@ -0,0 +1,69 @@
+"""
+Пропускная способность `/user/me` при прежнем и новом режиме логирования.
+
+`info` - синхронный обработчик loguru по умолчанию с текстовым форматом и уровнем INFO для всех модулей,
+`structured` - обработчик из `logging_config.setup_logging` с настройками из `config.py` (фоновая запись,
+JSON, уровни по модулям, выборка и ограничение частоты). В обоих режимах лог пишется в `--log-file`.
+Для каждого режима `--concurrency` конкурентных клиентов в течение `--seconds` секунд запрашивают `/user/me`.
+
+    python -m benchmarks.logging_overhead --concurrency 20 --seconds 10
+"""
+import argparse
+import asyncio
+import time
+
+from loguru import logger
+
+from benchmarks.common import asgi_client, latency_report, print_report
+from logging_config import setup_logging
+from main import app
+
+
+def configure(mode: str, log_file):
+    if mode == "info":
+        logger.remove()
+        logger.add(log_file, level="INFO")
+    else:
+        setup_logging(sink=log_file)
+
+
+async def worker(client, headers: dict, deadline: float, samples: list):
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        response = await client.get("/user/me", headers=headers)
+        response.raise_for_status()
+        samples.append(time.perf_counter() - started)
+
+
+async def run(mode: str, client, headers: dict, concurrency: int, seconds: float, log_file) -> dict:
+    configure(mode, log_file)
+    samples = []
+    deadline = time.perf_counter() + seconds
+    await asyncio.gather(*[worker(client, headers, deadline, samples) for _ in range(concurrency)])
+    await logger.complete()
+    return {"mode": mode, "requests_per_sec": round(len(samples) / seconds, 1), "latency": latency_report(samples)}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--email", default="user@example.com")
+    parser.add_argument("--password", default="456")
+    parser.add_argument("--log-file", default="bench-logging.log")
+    args = parser.parse_args()
+
+    report = []
+    with open(args.log_file, "a") as log_file:
+        async with asgi_client(app) as client:
+            response = await client.post("/login", json={"email": args.email, "password": args.password})
+            response.raise_for_status()
+            headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+            for mode in ("info", "structured"):
+                report.append(await run(mode, client, headers, args.concurrency, args.seconds, log_file))
+        logger.remove()
+    print_report(report)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
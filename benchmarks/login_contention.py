@@ -0,0 +1,67 @@
+"""
+Задержка `/webhook` при насыщенном `/login`.
+
+Параллельно с `--logins` одновременными циклами входа отправляются вебхуки, и для них считаются
+перцентили задержки. Флаг `--inline-bcrypt` возвращает прежнее поведение, когда bcrypt выполнялся прямо
+в цикле событий, что дает замер "до".
+
+    python -m benchmarks.login_contention --logins 32 --webhooks 300
+    python -m benchmarks.login_contention --logins 32 --webhooks 300 --inline-bcrypt
+"""
+import argparse
+import asyncio
+import random
+
+import security
+from benchmarks.common import asgi_client, latency_report, print_report, signed_webhook_payload, timed_request
+from main import app
+
+
+async def run_inline(function, *args):
+    return function(*args)
+
+
+async def login_storm(client, email: str, password: str, stop: asyncio.Event, statuses: dict):
+    while not stop.is_set():
+        response = await client.post("/login", json={"email": email, "password": password})
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=32, help="число одновременных циклов входа")
+    parser.add_argument("--webhooks", type=int, default=300)
+    parser.add_argument("--email", default="user@example.com")
+    parser.add_argument("--password", default="456")
+    parser.add_argument("--user-id", type=int, default=2)
+    parser.add_argument("--account-id", type=int, default=300_000)
+    parser.add_argument("--inline-bcrypt", action="store_true")
+    args = parser.parse_args()
+
+    if args.inline_bcrypt:
+        security.run_password_task = run_inline
+
+    stop = asyncio.Event()
+    statuses = {}
+    samples = []
+    async with asgi_client(app) as client:
+        storm = [asyncio.create_task(login_storm(client, args.email, args.password, stop, statuses))
+                 for _ in range(args.logins)]
+        await asyncio.sleep(1)
+        for _ in range(args.webhooks):
+            payload = signed_webhook_payload(args.user_id, args.account_id, round(random.uniform(1, 500), 2))
+            elapsed, response = await timed_request(client, "POST", "/webhook", json=payload)
+            response.raise_for_status()
+            samples.append(elapsed)
+        stop.set()
+        await asyncio.gather(*storm)
+
+    print_report({
+        "mode": "inline" if args.inline_bcrypt else "executor",
+        "webhook": latency_report(samples),
+        "login_statuses": statuses,
+    })
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
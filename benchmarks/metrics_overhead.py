@@ -0,0 +1,84 @@
+"""
+Накладные расходы метрик запросов на `/user/me`.
+
+Скрипт по очереди запускает себя в дочерних процессах с `REQUEST_METRICS_ENABLED=false` и `true`
+(`--rounds` раз каждый режим, вперемешку). В каждом процессе `--concurrency` конкурентных клиентов в течение
+`--seconds` секунд запрашивают `/user/me`. Для каждого режима берется медиана запросов в секунду, и если
+метрики снижают ее больше чем на `--max-overhead` процентов, скрипт завершается с кодом 1.
+
+    python -m benchmarks.metrics_overhead --rounds 3 --seconds 10
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks.common import print_report
+
+
+async def measure(concurrency: int, seconds: float, email: str, password: str) -> dict:
+    from benchmarks.common import asgi_client, latency_report
+    from main import app
+
+    async def worker(client, headers: dict, deadline: float, samples: list):
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            response = await client.get("/user/me", headers=headers)
+            response.raise_for_status()
+            samples.append(time.perf_counter() - started)
+
+    async with asgi_client(app) as client:
+        response = await client.post("/login", json={"email": email, "password": password})
+        response.raise_for_status()
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        # Warm up the principal cache, the connection pool and the statement cache.
+        for _ in range(50):
+            await client.get("/user/me", headers=headers)
+        samples = []
+        deadline = time.perf_counter() + seconds
+        await asyncio.gather(*[worker(client, headers, deadline, samples) for _ in range(concurrency)])
+    return {"requests_per_sec": round(len(samples) / seconds, 1), "latency": latency_report(samples)}
+
+
+def run_child(enabled: bool, args) -> dict:
+    env = dict(os.environ, REQUEST_METRICS_ENABLED=str(enabled).lower(), LOG_LEVEL=args.log_level)
+    output = subprocess.run([sys.executable, "-m", "benchmarks.metrics_overhead", "--child",
+                             "--concurrency", str(args.concurrency), "--seconds", str(args.seconds),
+                             "--email", args.email, "--password", args.password],
+                            env=env, check=True, capture_output=True, text=True).stdout
+    return json.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--email", default="user@example.com")
+    parser.add_argument("--password", default="456")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--max-overhead", type=float, default=2.0, help="допустимое снижение пропускной способности, %%")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(asyncio.run(measure(args.concurrency, args.seconds, args.email, args.password))))
+        return
+
+    runs = {"disabled": [], "enabled": []}
+    for _ in range(args.rounds):
+        for enabled in (False, True):
+            runs["enabled" if enabled else "disabled"].append(run_child(enabled, args))
+    throughput = {mode: statistics.median(run["requests_per_sec"] for run in mode_runs)
+                  for mode, mode_runs in runs.items()}
+    overhead = (throughput["disabled"] - throughput["enabled"]) / throughput["disabled"] * 100
+    print_report({"requests_per_sec": throughput, "overhead_percent": round(overhead, 2), "runs": runs})
+    sys.exit(1 if overhead > args.max_overhead else 0)
+
+
+if __name__ == "__main__":
+    main()
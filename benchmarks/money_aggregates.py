@@ -0,0 +1,91 @@
+"""
+Скорость агрегатов по платежам при хранении сумм в `double precision` (прежний `Float`), в `numeric(18, 2)` и
+в `bigint` копейках (текущая схема).
+
+Создаются временные таблицы `bench_money_<тип>` с `--rows` платежами (по умолчанию 10 млн) по `--accounts`
+счетам с одинаковыми суммами, выполняется ANALYZE. Затем для каждого типа `--repeat` раз замеряются общая сумма
+и суммы по счетам с `GROUP BY`, как в отчетах. В отчете лучшее время каждого запроса и расхождение общей суммы
+с точным значением в копейках. Таблицы удаляются в конце, если не указан `--keep`. Нужен Postgres.
+
+    python -m benchmarks.money_aggregates --rows 10000000
+"""
+import argparse
+import asyncio
+import time
+from decimal import Decimal
+
+from sqlalchemy import text
+
+from benchmarks.common import print_report
+from database.postgre_db import async_session
+
+# Column type and the expression turning the integer cents of the seed into a value of that type.
+TYPES = {
+    "float": ("double precision", "cents / 100.0"),
+    "numeric": ("numeric(18, 2)", "cents / 100.0"),
+    "bigint_cents": ("bigint", "cents"),
+}
+QUERIES = {
+    "total": "SELECT sum(amount) FROM {table}",
+    "by_account": "SELECT account_id, sum(amount) FROM {table} GROUP BY account_id",
+}
+
+
+async def create_table(session, name: str, column_type: str, expression: str, rows: int, accounts: int):
+    table = f"bench_money_{name}"
+    await session.execute(text(f"DROP TABLE IF EXISTS {table}"))
+    await session.execute(text(f"CREATE TABLE {table} (id bigint PRIMARY KEY, account_id integer, amount {column_type})"))
+    # Deterministic amounts from 1.00 to 500.00 with arbitrary cents, the same in every table.
+    await session.execute(text(
+        f"INSERT INTO {table} (id, account_id, amount) "
+        f"SELECT g, g % :accounts, {expression} "
+        f"FROM (SELECT g, 100 + (g * 7919) % 49901 AS cents FROM generate_series(1, :rows) AS g) AS seed"
+    ), {"rows": rows, "accounts": accounts})
+    await session.commit()
+    await session.execute(text(f"ANALYZE {table}"))
+    return table
+
+
+async def best_time(session, query: str, repeat: int) -> tuple:
+    timings = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = (await session.execute(text(query))).all()
+        timings.append(time.perf_counter() - started)
+    return round(min(timings) * 1000, 1), result
+
+
+def exact_total_cents(rows: int) -> int:
+    return sum(100 + (g * 7919) % 49901 for g in range(1, rows + 1))
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--accounts", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--keep", action="store_true", help="не удалять таблицы после замера")
+    args = parser.parse_args()
+
+    exact_cents = exact_total_cents(args.rows)
+    report = {"rows": args.rows, "exact_total": str(Decimal(exact_cents) / 100), "results": []}
+    async with async_session() as session:
+        for name, (column_type, expression) in TYPES.items():
+            table = await create_table(session, name, column_type, expression, args.rows, args.accounts)
+            result = {"type": name}
+            for query_name, query in QUERIES.items():
+                result[f"{query_name}_ms"], rows = await best_time(session, query.format(table=table), args.repeat)
+                if query_name == "total":
+                    total = rows[0][0]
+                    total_cents = total if name == "bigint_cents" else Decimal(str(total)) * 100
+                    result["total_error_cents"] = str(total_cents - exact_cents)
+            report["results"].append(result)
+            if not args.keep:
+                await session.execute(text(f"DROP TABLE {table}"))
+                await session.commit()
+    print_report(report)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
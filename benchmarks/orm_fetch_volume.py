@@ -0,0 +1,172 @@
+"""
+Сколько строк и байт читается из базы на запрос до и после перехода на выборку отдельных колонок.
+
+Для каждого сценария выполняется прежний вариант запросов, загружающий сущности ORM целиком, и текущий вариант
+из `database.crud`:
+
+- `auth` - пользователь для `get_current_user` при промахе кэша;
+- `login` - проверка пароля при входе;
+- `user_me` - `/user/me` и `/users/{user_id}`;
+- `update` - `PATCH /users/{user_id}`: раньше пользователь загружался и записывался целиком;
+- `delete` - удаление пользователя с `--accounts` счетами по `--payments` платежей: каскад ORM, которому нужно
+  загрузить все дочерние строки, против `ON DELETE CASCADE` в базе.
+
+Строки и байты значений колонок считаются по результатам каждого выражения на уровне драйвера. База берется
+из `.env` или из `--database-url`; для файла SQLite схема создается по моделям.
+
+    python -m benchmarks.orm_fetch_volume --accounts 10 --payments 100
+    python -m benchmarks.orm_fetch_volume --database-url sqlite+aiosqlite:////tmp/bench.db
+"""
+import argparse
+import asyncio
+from datetime import date, datetime, time
+from decimal import Decimal
+
+from sqlalchemy import event, insert, update, delete, select
+from sqlalchemy.orm import selectinload
+
+import database.postgre_db as postgre_db
+from benchmarks.common import print_report
+from config import DATABASE_URL
+from database.crud import (get_principal_by_email,
+                           get_user_credentials,
+                           get_user_by_id,
+                           update_user,
+                           delete_user)
+from database.models import User, Account, Payment, AccountStats
+from database.postgre_db import Base, async_session, create_engine
+
+EMAIL_PREFIX = "bench-fetch-"
+
+
+def value_size(value) -> int:
+    if value is None:
+        return 0
+    if isinstance(value, str):
+        return len(value.encode())
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, (Decimal, date, datetime, time)):
+        return len(str(value))
+    return 8
+
+
+class FetchCounter:
+    # Counts the rows and column bytes every statement returns, peeking at the rows the async
+    # driver adapters have already buffered on the cursor.
+
+    def __init__(self, engine):
+        self.statements = self.rows = self.bytes = 0
+        event.listen(engine.sync_engine, "after_cursor_execute", self.after_cursor_execute)
+
+    def reset(self):
+        self.statements = self.rows = self.bytes = 0
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements += 1
+        rows = list(getattr(cursor, "_rows", None) or ())
+        self.rows += len(rows)
+        self.bytes += sum(value_size(value) for row in rows for value in row)
+
+    def snapshot(self) -> dict:
+        return {"statements": self.statements, "rows": self.rows, "bytes": self.bytes}
+
+
+async def legacy_user_by_email(session, email: str):
+    return (await session.execute(select(User).where(User.email == email))).scalar_one_or_none()
+
+
+async def legacy_update(session, user_id: int, updates: dict):
+    user = (await session.execute(select(User).where(User.id == user_id))).scalar_one_or_none()
+    for field, value in updates.items():
+        setattr(user, field, value)
+    values = {column.key: getattr(user, column.key) for column in User.__table__.columns}
+    await session.execute(update(User).where(User.id == user_id).values(**values))
+    await session.commit()
+
+
+async def legacy_delete(session, user_id: int):
+    user = (await session.execute(
+        select(User).where(User.id == user_id)
+        .options(selectinload(User.accounts).selectinload(Account.payments),
+                 selectinload(User.accounts).selectinload(Account.stats),
+                 selectinload(User.accounts).selectinload(Account.balance_shards))
+    )).scalar_one()
+    await session.delete(user)
+    await session.commit()
+
+
+async def create_user(session, name: str, accounts: int, payments: int) -> tuple:
+    email = f"{EMAIL_PREFIX}{name}@example.com"
+    user_id = (await session.execute(insert(User).returning(User.id), [{
+        "email": email, "hashed_password": "$2b$12$" + "x" * 53, "full_name": f"Bench {name}", "role": "user"
+    }])).scalar_one()
+    if accounts:
+        account_ids = (await session.execute(insert(Account).returning(Account.id, sort_by_parameter_order=True),
+                                             [{"owner_id": user_id, "balance": 0}] * accounts)).scalars().all()
+        if payments:
+            await session.execute(insert(Payment), [{"transaction_id": f"{EMAIL_PREFIX}{name}-{account_id}-{number}",
+                                                     "account_id": account_id, "amount": 100}
+                                                    for account_id in account_ids for number in range(payments)])
+        await session.execute(insert(AccountStats), [{"account_id": account_id, "payment_count": payments}
+                                                     for account_id in account_ids])
+    await session.commit()
+    return user_id, email
+
+
+async def measure(counter: FetchCounter, scenario) -> dict:
+    counter.reset()
+    async with async_session() as session:
+        await scenario(session)
+    return counter.snapshot()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default=DATABASE_URL)
+    parser.add_argument("--accounts", type=int, default=10)
+    parser.add_argument("--payments", type=int, default=100, help="платежей на счет")
+    args = parser.parse_args()
+
+    engine = create_engine(args.database_url, "primary")
+    postgre_db.engine = engine
+    async_session.configure(bind=engine)
+    if engine.dialect.name == "sqlite":
+        event.listen(engine.sync_engine, "connect",
+                     lambda connection, record: connection.execute("PRAGMA foreign_keys=ON"))
+        async with engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+
+    async with async_session() as session:
+        await session.execute(delete(User).where(User.email.like(f"{EMAIL_PREFIX}%")))
+        await session.commit()
+        user_id, email = await create_user(session, "reader", 0, 0)
+        legacy_victim, _ = await create_user(session, "legacy-delete", args.accounts, args.payments)
+        victim, _ = await create_user(session, "delete", args.accounts, args.payments)
+
+    counter = FetchCounter(engine)
+    scenarios = {
+        "auth": (lambda session: legacy_user_by_email(session, email),
+                 lambda session: get_principal_by_email(session, email)),
+        "login": (lambda session: legacy_user_by_email(session, email),
+                  lambda session: get_user_credentials(session, email)),
+        "user_me": (lambda session: session.execute(select(User).where(User.id == user_id)),
+                    lambda session: get_user_by_id(session, user_id)),
+        "update": (lambda session: legacy_update(session, user_id, {"full_name": "Bench Reader"}),
+                   lambda session: update_user(session, user_id, {"full_name": "Bench Reader"})),
+        "delete": (lambda session: legacy_delete(session, legacy_victim),
+                   lambda session: delete_user(session, victim)),
+    }
+    report = {}
+    for name, (before, after) in scenarios.items():
+        report[name] = {"before": await measure(counter, before), "after": await measure(counter, after)}
+
+    async with async_session() as session:
+        await session.execute(delete(User).where(User.email.like(f"{EMAIL_PREFIX}%")))
+        await session.commit()
+    await engine.dispose()
+    print_report({"accounts": args.accounts, "payments_per_account": args.payments, "scenarios": report})
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
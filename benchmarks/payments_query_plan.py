@@ -0,0 +1,112 @@
+"""
+Проверка планов запросов истории платежей: запросы `/user/me/payments` должны читать `payments` и `accounts`
+по индексам, а не последовательным сканированием.
+
+С флагом `--seed` в базу добавляются служебный пользователь и `--payments` платежей, распределенных по
+`--accounts` счетам, из которых нашему пользователю принадлежат `--own-accounts`, после чего выполняется
+ANALYZE. Для каждого варианта фильтров печатается план, а при найденном Seq Scan по этим таблицам скрипт
+завершается с кодом 1. Это ручная проверка на своих данных; та же проверка на сгенерированных данных
+выполняется тестом `tests/test_payments_query_plan.py` при заданной `TEST_DATABASE_URL`.
+
+    python -m benchmarks.payments_query_plan --seed
+"""
+import argparse
+import asyncio
+import json
+import sys
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql
+
+from database.crud import user_payments_query
+from database.postgre_db import async_session
+from database.schemas import PaymentFilters
+
+EMAIL = "bench-payments-plan@example.com"
+CHECKED_TABLES = {"payments", "accounts"}
+
+
+async def seed(session, accounts: int, own_accounts: int, payments: int, first_account_id: int):
+    await session.execute(text(
+        "INSERT INTO users (email, hashed_password, full_name, role) VALUES (:email, 'x', 'Bench User', 'user') "
+        "ON CONFLICT (email) DO NOTHING"
+    ), {"email": EMAIL})
+    user_id = (await session.execute(text("SELECT id FROM users WHERE email = :email"), {"email": EMAIL})).scalar_one()
+    await session.execute(text(
+        "INSERT INTO accounts (id, owner_id, balance) "
+        "SELECT :first + g, CASE WHEN g < :own THEN :user_id ELSE 1 END, 0 FROM generate_series(0, :count - 1) AS g "
+        "ON CONFLICT (id) DO NOTHING"
+    ), {"first": first_account_id, "own": own_accounts, "user_id": user_id, "count": accounts})
+    await session.execute(text(
+        "INSERT INTO payments (transaction_id, account_id, amount, created_at) "
+        "SELECT 'bench-plan-' || g, :first + g % :count, (g % 100000) + 50, now() - (g % 365) * interval '1 day' "
+        "FROM generate_series(1, :payments) AS g ON CONFLICT (transaction_id) DO NOTHING"
+    ), {"first": first_account_id, "count": accounts, "payments": payments})
+    await session.commit()
+    await session.execute(text("ANALYZE users"))
+    await session.execute(text("ANALYZE accounts"))
+    await session.execute(text("ANALYZE payments"))
+    return user_id
+
+
+def scans(plan: dict):
+    if "Relation Name" in plan:
+        yield plan["Node Type"], plan["Relation Name"]
+    for child in plan.get("Plans", []):
+        yield from scans(child)
+
+
+def seq_scans(plan_scans) -> list:
+    return [relation for node, relation in plan_scans if node == "Seq Scan" and relation in CHECKED_TABLES]
+
+
+def plan_variants(user_id: int, payments: int, first_account_id: int) -> dict:
+    month_ago = datetime.now(timezone.utc) - timedelta(days=30)
+    return {
+        "first_page": user_payments_query(user_id, limit=100),
+        "next_page": user_payments_query(user_id, after_id=payments // 2, limit=100),
+        "by_account": user_payments_query(user_id, PaymentFilters(account_id=first_account_id), limit=100),
+        "by_amount": user_payments_query(user_id, PaymentFilters(min_amount=10, max_amount=20), limit=100),
+        "by_date": user_payments_query(user_id, PaymentFilters(created_from=month_ago), limit=100),
+    }
+
+
+async def explain(session, query) -> dict:
+    sql = query.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True})
+    result = await session.execute(text(f"EXPLAIN (FORMAT JSON) {sql}"))
+    plan = result.scalar_one()
+    return (json.loads(plan) if isinstance(plan, str) else plan)[0]["Plan"]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seed", action="store_true")
+    parser.add_argument("--user-id", type=int, help="проверять планы для этого пользователя вместо служебного")
+    parser.add_argument("--accounts", type=int, default=10_000)
+    parser.add_argument("--own-accounts", type=int, default=3)
+    parser.add_argument("--payments", type=int, default=1_000_000)
+    parser.add_argument("--first-account-id", type=int, default=400_000)
+    args = parser.parse_args()
+
+    async with async_session() as session:
+        user_id = args.user_id
+        if args.seed:
+            user_id = await seed(session, args.accounts, args.own_accounts, args.payments, args.first_account_id)
+        if user_id is None:
+            user_id = (await session.execute(text("SELECT id FROM users WHERE email = :email"),
+                                             {"email": EMAIL})).scalar_one()
+
+        failures = []
+        report = {}
+        for name, query in plan_variants(user_id, args.payments, args.first_account_id).items():
+            plan_scans = sorted(set(scans(await explain(session, query))))
+            report[name] = [f"{node} on {relation}" for node, relation in plan_scans]
+            failures += [f"{name}: Seq Scan on {relation}" for relation in seq_scans(plan_scans)]
+
+    print(json.dumps({"user_id": user_id, "plans": report, "failures": failures}, indent=2, ensure_ascii=False))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,59 @@
+"""
+Пропускная способность типового чтения в зависимости от размера пула соединений.
+
+Для каждого размера пула создается отдельный движок с настройками из `config.py`, и `--concurrency`
+конкурентных задач в течение `--seconds` секунд выполняют `get_user_accounts`. В отчете запросы в секунду,
+перцентили задержки и среднее время ожидания соединения из пула.
+
+    python -m benchmarks.pool_throughput --pool-sizes 1 5 10 20 --concurrency 50
+"""
+import argparse
+import asyncio
+import time
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from benchmarks.common import latency_report, print_report
+from config import DATABASE_URL
+from database.crud import get_user_accounts
+from database.postgre_db import create_engine, pool_checkout_wait
+
+
+async def worker(sessionmaker, user_id: int, deadline: float, samples: list):
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        async with sessionmaker() as session:
+            await get_user_accounts(session, user_id)
+        samples.append(time.perf_counter() - started)
+
+
+async def run(pool_size: int, concurrency: int, seconds: float, user_id: int) -> dict:
+    name = f"bench-{pool_size}"
+    engine = create_engine(DATABASE_URL, name, pool_size=pool_size, max_overflow=0)
+    sessionmaker = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    samples = []
+    deadline = time.perf_counter() + seconds
+    await asyncio.gather(*[worker(sessionmaker, user_id, deadline, samples) for _ in range(concurrency)])
+    await engine.dispose()
+    wait = pool_checkout_wait.labels(name)
+    return {
+        "pool_size": pool_size,
+        "requests_per_sec": round(len(samples) / seconds, 1),
+        "latency": latency_report(samples),
+        "mean_checkout_wait_ms": round(wait.sum / max(wait.count, 1) * 1000, 3),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pool-sizes", type=int, nargs="+", default=[1, 5, 10, 20, 40])
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--user-id", type=int, default=2)
+    args = parser.parse_args()
+
+    print_report([await run(size, args.concurrency, args.seconds, args.user_id) for size in args.pool_sizes])
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,101 @@
+"""
+Накладные расходы ограничения частоты и числа одновременных запросов.
+
+Сначала замеряется стоимость одной проверки `AdmissionControl.admit` (корзина токенов в памяти и лимит
+одновременных запросов) при `--keys` разных ключах в хранилище: время на проверку не должно расти с числом
+ключей. Затем через ASGI вызываются три одинаковых пустых маршрута без базы, `--rounds` раз вперемешку
+по `--requests` запросов: без зависимостей (`plain`), с пустой зависимостью того же вида, что и ограничение
+(`noop`, ключ по IP и `yield`), и с самим ограничением (`limited`). Разница медиан средней задержки `limited`
+и `noop` - собственные накладные расходы ограничения на запрос, а `noop` и `plain` - стоимость разрешения
+зависимостей в FastAPI. Если собственные расходы больше `--max-overhead-us` микросекунд, скрипт завершается
+с кодом 1.
+
+    python -m benchmarks.rate_limit_overhead --keys 1 10000 1000000
+"""
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+
+from fastapi import Depends, FastAPI
+
+from benchmarks.common import asgi_client, print_report
+from rate_limit import AdmissionControl, Limit, MemoryTokenBucketStore, client_ip
+
+# Limits high enough that the benchmark never hits them.
+LIMITS = {"bench": Limit(rate=1e9, burst=1e9)}
+CAPS = {"bench": 1_000_000}
+
+
+async def admit_cost(keys: int, operations: int) -> dict:
+    control = AdmissionControl(LIMITS, CAPS, MemoryTokenBucketStore(max_keys=keys))
+    for key in range(keys):
+        await control.admit("bench", key)
+    started = time.perf_counter()
+    for number in range(operations):
+        await control.admit("bench", number % keys)
+    elapsed = time.perf_counter() - started
+    return {"keys": keys, "ns_per_check": round(elapsed / operations * 1e9, 1)}
+
+
+def create_app(control: AdmissionControl) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/plain")
+    async def plain():
+        return {"ok": True}
+
+    # Same shape as the limiter dependency: a key sub-dependency and a yield, but no admission logic.
+    async def noop_dependency(key=Depends(client_ip)):
+        yield
+
+    @app.get("/noop", dependencies=[Depends(noop_dependency)])
+    async def noop():
+        return {"ok": True}
+
+    @app.get("/limited", dependencies=[control.limit("bench", client_ip)])
+    async def limited():
+        return {"ok": True}
+
+    return app
+
+
+async def mean_latency(client, url: str, requests: int) -> float:
+    started = time.perf_counter()
+    for _ in range(requests):
+        response = await client.get(url)
+        response.raise_for_status()
+    return (time.perf_counter() - started) / requests
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--keys", type=int, nargs="+", default=[1, 10_000, 1_000_000])
+    parser.add_argument("--operations", type=int, default=1_000_000)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--max-overhead-us", type=float, default=20.0,
+                        help="допустимые накладные расходы на запрос, мкс")
+    args = parser.parse_args()
+
+    checks = [await admit_cost(keys, args.operations) for keys in args.keys]
+
+    control = AdmissionControl(LIMITS, CAPS, MemoryTokenBucketStore(max_keys=100_000))
+    latencies = {"plain": [], "noop": [], "limited": []}
+    async with asgi_client(create_app(control), rate_limits=True) as client:
+        for name in latencies:
+            await mean_latency(client, f"/{name}", 200)
+        for _ in range(args.rounds):
+            for name in latencies:
+                latencies[name].append(await mean_latency(client, f"/{name}", args.requests))
+    mean_us = {name: round(statistics.median(samples) * 1e6, 2) for name, samples in latencies.items()}
+    overhead_us = round(mean_us["limited"] - mean_us["noop"], 2)
+    print_report({"admit": checks, "request_mean_us": mean_us,
+                  "dependency_us_per_request": round(mean_us["noop"] - mean_us["plain"], 2),
+                  "overhead_us_per_request": overhead_us})
+    sys.exit(1 if overhead_us > args.max_overhead_us else 0)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
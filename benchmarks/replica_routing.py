@@ -0,0 +1,64 @@
+"""
+Проверка маршрутизации чтения по репликам из `DATABASE_REPLICA_URLS`.
+
+`--sessions` сессий только для чтения выполняют `get_user_accounts` для `--user-id`, и для каждой базы
+печатается число сессий и перцентили задержки. Затем для того же пользователя имитируется запись, и
+проверяется, что его чтения в течение `DB_READ_YOUR_WRITES_SECONDS` идут на основную базу. Код выхода 1,
+если чтение после записи ушло на реплику. Для локальной проверки репликами могут быть файлы SQLite
+с той же схемой, например `DATABASE_REPLICA_URLS=sqlite+aiosqlite:///r1.db,sqlite+aiosqlite:///r2.db`.
+
+    python -m benchmarks.replica_routing --sessions 1000
+"""
+import argparse
+import asyncio
+import sys
+import time
+
+from benchmarks.common import latency_report, print_report
+from database.crud import get_user_accounts
+from database.postgre_db import async_session, current_user_id, engine, mark_recent_write, replica_router
+
+
+def engine_name(read_engine) -> str:
+    if read_engine is engine:
+        return "primary"
+    return next(name for name, replica in replica_router.replicas if replica is read_engine)
+
+
+async def read(user_id: int):
+    started = time.perf_counter()
+    async with async_session() as session:
+        session.info["read_only"] = True
+        await get_user_accounts(session, user_id)
+        return engine_name(session.info["read_engine"]), time.perf_counter() - started
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=1000)
+    parser.add_argument("--user-id", type=int, default=2)
+    args = parser.parse_args()
+
+    samples = {}
+    for _ in range(args.sessions):
+        name, elapsed = await read(args.user_id)
+        samples.setdefault(name, []).append(elapsed)
+
+    current_user_id.set(args.user_id)
+    mark_recent_write(args.user_id)
+    read_your_writes, _ = await read(args.user_id)
+
+    print_report({
+        "replicas": [name for name, _ in replica_router.replicas],
+        "selection": replica_router.selection,
+        "routed": {name: latency_report(times) for name, times in samples.items()},
+        "read_after_write": read_your_writes,
+    })
+    await engine.dispose()
+    for _, replica in replica_router.replicas:
+        await replica.dispose()
+    sys.exit(0 if read_your_writes == "primary" else 1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,62 @@
+"""
+Микробенчмарк проверки подписи вебхука: проверок в секунду для прежней схемы (f-строка с `SECRET_KEY`,
+SHA-256 и сравнение через `==`), для `WebhookSigner.verify` и для пакетной `WebhookSigner.verify_many`.
+База данных не нужна.
+
+    python -m benchmarks.signature_verify --payloads 100000
+"""
+import argparse
+import hashlib
+import time
+
+from benchmarks.common import print_report
+from config import SECRET_KEY
+from database.schemas import WebhookPayload
+from money import parse_amount, to_units
+from signing import WebhookSigner
+
+
+def legacy_verify(payload: WebhookPayload) -> bool:
+    data_to_hash = f"{payload.account_id}{to_units(payload.amount)}{payload.transaction_id}{payload.user_id}{SECRET_KEY}"
+    return hashlib.sha256(data_to_hash.encode()).hexdigest() == payload.signature
+
+
+def measure(name: str, function, payloads: list) -> dict:
+    started = time.perf_counter()
+    valid = function(payloads)
+    elapsed = time.perf_counter() - started
+    assert all(valid), f"{name}: some signatures did not verify"
+    return {"implementation": name, "verifies_per_sec": round(len(payloads) / elapsed)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--payloads", type=int, default=100_000)
+    parser.add_argument("--keys", type=int, default=2, help="число активных ключей, подпись последним из них")
+    args = parser.parse_args()
+
+    keys = [f"{SECRET_KEY}-{number}" for number in range(args.keys)]
+    signer = WebhookSigner(keys)
+    # Sign with the oldest key so that verification goes through every active key: the worst case during rotation.
+    old_signer = WebhookSigner(keys[-1:])
+    payloads = []
+    legacy_payloads = []
+    for number in range(args.payloads):
+        fields = {"transaction_id": f"bench-{number}", "user_id": 2, "account_id": 300_000 + number % 100,
+                  "amount": round(1 + number % 50_000 / 100, 2)}
+        signature = old_signer.sign(**{**fields, "amount": parse_amount(fields["amount"])})
+        payloads.append(WebhookPayload(**fields, signature=signature))
+        legacy_signature = hashlib.sha256(
+            f"{fields['account_id']}{fields['amount']}{fields['transaction_id']}{fields['user_id']}{SECRET_KEY}".encode()
+        ).hexdigest()
+        legacy_payloads.append(WebhookPayload(**fields, signature=legacy_signature))
+
+    print_report([
+        measure("legacy_sha256", lambda items: [legacy_verify(payload) for payload in items], legacy_payloads),
+        measure("hmac_verify", lambda items: [signer.verify(payload) for payload in items], payloads),
+        measure("hmac_verify_many", signer.verify_many, payloads),
+    ])
+
+
+if __name__ == "__main__":
+    main()
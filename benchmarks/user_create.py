@@ -0,0 +1,85 @@
+"""
+Время создания пользователя при разном числе уже существующих пользователей.
+
+Для каждого объема таблица `users` дополняется служебными пользователями до нужного числа строк,
+после чего замеряется `--creates` вызовов `create_user`. Прежний подбор ID перебором списка всех ID
+(`legacy`) замеряется только до `--legacy-max-rows` строк, так как он квадратичен по числу
+пользователей. Служебные пользователи удаляются в конце.
+
+    python -m benchmarks.user_create --rows 10000 100000 1000000
+"""
+import argparse
+import asyncio
+import time
+
+from sqlalchemy import text
+from sqlalchemy.future import select
+
+from benchmarks.common import latency_report, print_report
+from database.crud import create_user
+from database.models import User
+from database.postgre_db import async_session
+
+EMAIL_PREFIX = "bench-user-"
+
+
+async def legacy_next_available_id(session):
+    result = await session.execute(select(User.id).order_by(User.id))
+    existing_ids = [row[0] for row in result.fetchall()]
+    next_id = 1
+    while next_id in existing_ids:
+        next_id += 1
+    return next_id
+
+
+async def seed_users(session, rows: int):
+    current = (await session.execute(text("SELECT count(*) FROM users"))).scalar_one()
+    if current < rows:
+        await session.execute(text(
+            "INSERT INTO users (email, hashed_password, full_name, role) "
+            "SELECT :prefix || g || '@example.com', 'x', 'Bench User', 'user' "
+            "FROM generate_series(:start, :stop) AS g"
+        ), {"prefix": EMAIL_PREFIX, "start": current, "stop": rows - 1})
+        await session.commit()
+
+
+async def measure(session, rows: int, creates: int, legacy: bool) -> dict:
+    samples = []
+    for i in range(creates):
+        user = User(email=f"{EMAIL_PREFIX}{rows}-{i}-{int(legacy)}@example.com",
+                    hashed_password="x", full_name="Bench User", role="user")
+        started = time.perf_counter()
+        if legacy:
+            # Only the lookup cost matters here; the ID itself still comes from the sequence so that
+            # later inserts do not collide with it.
+            await legacy_next_available_id(session)
+        await create_user(session, user)
+        samples.append(time.perf_counter() - started)
+    return latency_report(samples)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--creates", type=int, default=100)
+    parser.add_argument("--legacy-max-rows", type=int, default=10_000)
+    args = parser.parse_args()
+
+    report = []
+    async with async_session() as session:
+        try:
+            for rows in sorted(args.rows):
+                await seed_users(session, rows)
+                entry = {"existing_rows": rows, "sequence": await measure(session, rows, args.creates, False)}
+                if rows <= args.legacy_max_rows:
+                    entry["legacy"] = await measure(session, rows, args.creates, True)
+                report.append(entry)
+        finally:
+            await session.rollback()
+            await session.execute(text("DELETE FROM users WHERE email LIKE :prefix"), {"prefix": f"{EMAIL_PREFIX}%"})
+            await session.commit()
+    print_report(report)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
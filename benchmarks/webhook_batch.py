@@ -0,0 +1,52 @@
+"""
+Пропускная способность `/webhook/batch` в платежах в секунду при разных размерах пакета.
+
+Для каждого размера пакета отправляется `--payments` новых платежей, распределенных по `--accounts` счетам.
+
+    python -m benchmarks.webhook_batch --sizes 1 100 10000 --payments 20000
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from benchmarks.common import asgi_client, print_report, signed_webhook_payload
+from main import app
+
+
+async def run(batch_size: int, payments: int, user_id: int, accounts: list) -> dict:
+    batches = max(1, payments // batch_size)
+    processed = 0
+    elapsed = 0.0
+    async with asgi_client(app) as client:
+        for _ in range(batches):
+            body = [signed_webhook_payload(user_id, random.choice(accounts), round(random.uniform(1, 500), 2))
+                    for _ in range(batch_size)]
+            started = time.perf_counter()
+            response = await client.post("/webhook/batch", json=body, timeout=None)
+            elapsed += time.perf_counter() - started
+            response.raise_for_status()
+            processed += response.json()["processed"]
+    return {
+        "batch_size": batch_size,
+        "payments": processed,
+        "seconds": round(elapsed, 3),
+        "payments_per_sec": round(processed / elapsed, 1),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 100, 10_000])
+    parser.add_argument("--payments", type=int, default=20_000)
+    parser.add_argument("--user-id", type=int, default=2)
+    parser.add_argument("--accounts", type=int, default=100)
+    parser.add_argument("--first-account-id", type=int, default=200_000)
+    args = parser.parse_args()
+
+    accounts = list(range(args.first_account_id, args.first_account_id + args.accounts))
+    print_report([await run(size, args.payments, args.user_id, accounts) for size in args.sizes])
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,72 @@
+"""
+Сравнение задержки `/webhook` до и после перехода на однозапросную запись платежа.
+
+Прежний обработчик (шесть обращений к БД и три коммита) воспроизводится на служебном маршруте
+`/bench/webhook_legacy`, новый путь - это сам `/webhook`. Оба маршрута вызываются через ASGI
+против базы из `config.DATABASE_URL`, к которой уже применены миграции.
+
+    python -m benchmarks.webhook_latency --requests 1000
+"""
+import argparse
+import asyncio
+import random
+
+from fastapi import Depends, HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from benchmarks.common import asgi_client, latency_report, print_report, signed_webhook_payload, timed_request
+from database.crud import (get_payment_by_transaction_id,
+                           get_account_by_id,
+                           create_account,
+                           create_payment,
+                           update_account_balance)
+from database.models import Account, Payment
+from database.postgre_db import get_session
+from database.schemas import WebhookPayload
+from main import app
+from routers.webhook import verify_signature
+
+
+@app.post("/bench/webhook_legacy", include_in_schema=False)
+async def legacy_process_webhook(payload: WebhookPayload, session: AsyncSession = Depends(get_session)):
+    if not await verify_signature(payload):
+        raise HTTPException(status_code=400, detail="Invalid signature")
+    if await get_payment_by_transaction_id(session, payload.transaction_id):
+        raise HTTPException(status_code=400, detail="Transaction already processed")
+    if not await get_account_by_id(session, payload.account_id):
+        await create_account(session, Account(id=payload.account_id, owner_id=payload.user_id, balance=0))
+    await create_payment(session, Payment(transaction_id=payload.transaction_id,
+                                          account_id=payload.account_id,
+                                          amount=payload.amount))
+    await update_account_balance(session, payload.account_id, payload.amount)
+    return {"detail": "Payment processed successfully"}
+
+
+async def run(url: str, requests: int, user_id: int, accounts: list) -> dict:
+    samples = []
+    async with asgi_client(app) as client:
+        for _ in range(requests):
+            payload = signed_webhook_payload(user_id, random.choice(accounts), round(random.uniform(1, 500), 2))
+            elapsed, response = await timed_request(client, "POST", url, json=payload)
+            response.raise_for_status()
+            samples.append(elapsed)
+    return latency_report(samples)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--user-id", type=int, default=2)
+    parser.add_argument("--accounts", type=int, default=10, help="число счетов, по которым распределяются платежи")
+    parser.add_argument("--first-account-id", type=int, default=100_000)
+    args = parser.parse_args()
+
+    accounts = list(range(args.first_account_id, args.first_account_id + args.accounts))
+    print_report({
+        "before": await run("/bench/webhook_legacy", args.requests, args.user_id, accounts),
+        "after": await run("/webhook", args.requests, args.user_id, accounts),
+    })
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,124 @@
+"""
+Воспроизведение записанного шторма повторов вебхуков.
+
+`record` записывает шторм в файл NDJSON: `--transactions` платежей, каждый из которых доставляется
+в среднем `1 + --retries` раз. Часть повторов приходит одновременно с исходным запросом, а доля
+`--conflicts` повторов несет другую сумму. У каждого события есть смещение от начала шторма в секундах.
+
+`replay` отправляет события файла в `/webhook` с записанными смещениями, ускоренными в `--speed` раз, и печатает
+коды ответов, задержки исходных запросов и повторов, число запросов к базе на `/webhook` и результаты поиска
+в кэше идемпотентности. Флаг `--no-cache` отключает кэш и ожидание обрабатываемых повторов для замера "до".
+
+    python -m benchmarks.webhook_retry_storm record storm.ndjson --transactions 2000 --retries 3
+    python -m benchmarks.webhook_retry_storm replay storm.ndjson
+    python -m benchmarks.webhook_retry_storm replay storm.ndjson --no-cache
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+
+from benchmarks.common import latency_report, print_report, signed_webhook_payload
+
+
+def record(path: str, transactions: int, retries: float, conflicts: float, duration: float, user_id: int,
+           first_account_id: int, accounts: int):
+    events = []
+    run_id = uuid.uuid4().hex[:8]
+    for number in range(transactions):
+        offset = random.uniform(0, duration)
+        account_id = first_account_id + number % accounts
+        amount = round(random.uniform(1, 500), 2)
+        payload = signed_webhook_payload(user_id, account_id, amount, f"storm-{run_id}-{number}")
+        events.append({"offset": offset, "payload": payload})
+        for _ in range(int(random.expovariate(1 / retries)) if retries > 0 else 0):
+            # Providers retry both immediately (a timed-out request still in flight) and with backoff.
+            retry_offset = offset + (0 if random.random() < 0.3 else random.expovariate(1 / 2))
+            retry = payload
+            if random.random() < conflicts:
+                retry = signed_webhook_payload(user_id, account_id, amount + 1, payload["transaction_id"])
+            events.append({"offset": retry_offset, "payload": retry})
+    events.sort(key=lambda event: event["offset"])
+    with open(path, "w") as storm:
+        for event in events:
+            storm.write(json.dumps(event) + "\n")
+    print_report({"events": len(events), "transactions": transactions})
+
+
+async def replay(path: str, speed: float, no_cache: bool):
+    from benchmarks.common import asgi_client
+    from idempotency import webhook_idempotency, lookups_total
+    from main import app
+    from request_metrics import request_queries_histogram
+
+    if no_cache:
+        async def miss(transaction_id):
+            return None
+
+        webhook_idempotency.get = miss
+
+    with open(path) as storm:
+        events = [json.loads(line) for line in storm if line.strip()]
+
+    seen = set()
+    samples = {"first": [], "retry": []}
+    statuses = {}
+
+    async def send(client, event, started):
+        await asyncio.sleep(max(0.0, event["offset"] / speed - (time.perf_counter() - started)))
+        kind = "retry" if event["payload"]["transaction_id"] in seen else "first"
+        seen.add(event["payload"]["transaction_id"])
+        request_started = time.perf_counter()
+        response = await client.post("/webhook", json=event["payload"])
+        samples[kind].append(time.perf_counter() - request_started)
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    queries = request_queries_histogram.labels("POST", "/webhook")
+    lookups = {result: child.value for (result,), child in lookups_total._children.items()}
+    async with asgi_client(app) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*[send(client, event, started) for event in events])
+        elapsed = time.perf_counter() - started
+
+    print_report({
+        "mode": "no_cache" if no_cache else "cache",
+        "events": len(events),
+        "seconds": round(elapsed, 2),
+        "statuses": statuses,
+        "first_delivery": latency_report(samples["first"]),
+        "retry": latency_report(samples["retry"]),
+        "db_queries": queries.sum,
+        "idempotency_lookups": {result: child.value - lookups.get(result, 0)
+                                for (result,), child in lookups_total._children.items()},
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    record_parser = commands.add_parser("record")
+    record_parser.add_argument("path")
+    record_parser.add_argument("--transactions", type=int, default=2000)
+    record_parser.add_argument("--retries", type=float, default=3)
+    record_parser.add_argument("--conflicts", type=float, default=0.01)
+    record_parser.add_argument("--duration", type=float, default=30, help="длительность шторма, с")
+    record_parser.add_argument("--user-id", type=int, default=2)
+    record_parser.add_argument("--first-account-id", type=int, default=500_000)
+    record_parser.add_argument("--accounts", type=int, default=100)
+    replay_parser = commands.add_parser("replay")
+    replay_parser.add_argument("path")
+    replay_parser.add_argument("--speed", type=float, default=1.0)
+    replay_parser.add_argument("--no-cache", action="store_true")
+    args = parser.parse_args()
+
+    if args.command == "record":
+        record(args.path, args.transactions, args.retries, args.conflicts, args.duration, args.user_id,
+               args.first_account_id, args.accounts)
+    else:
+        asyncio.run(replay(args.path, args.speed, args.no_cache))
+
+
+if __name__ == "__main__":
+    main()
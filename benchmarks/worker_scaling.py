@@ -0,0 +1,168 @@
+"""
+Масштабирование пропускной способности по числу рабочих процессов gunicorn на `/user/me` и `/webhook`.
+
+Для каждого значения из `--workers` (по умолчанию 1, 2, 4 и так далее до числа ядер) сервер запускается
+командой `gunicorn -c python:serving main:app` с `WEB_CONCURRENCY` процессами на порту `--port`, без ограничения
+частоты запросов. Затем каждый сценарий `--duration` секунд нагружают `--client-processes` процессов клиента
+по `--connections` одновременных запросов в каждом:
+
+- `user_me` - `GET /user/me` от случайных пользователей;
+- `webhook` - `POST /webhook` с новыми платежами на случайные счета.
+
+Перед замером каждого сценария сервер `--warmup` секунд прогревается той же нагрузкой. В отчете для каждого
+числа процессов запросы в секунду, перцентили задержки, ошибки и ускорение относительно первого значения
+`--workers`. Клиент работает на той же машине и отнимает у сервера часть ядер, поэтому ускорение занижено;
+для точных замеров клиенту нужны отдельные ядра. Пользователи и счета берутся из данных
+`benchmarks.load_test --seed`, нужен Postgres с примененными миграциями.
+
+    python -m benchmarks.load_test --seed --duration 1 --workloads polling
+    python -m benchmarks.worker_scaling --workers 1,2,4,8 --duration 15
+"""
+import argparse
+import asyncio
+import os
+import random
+import signal
+import subprocess
+import sys
+import time
+from multiprocessing import Pool
+
+import httpx
+
+from benchmarks.common import latency_report, print_report, signed_webhook_payload
+from benchmarks.load_test import bearer, load_users
+from config import BASE_DIR
+from database.postgre_db import async_session, engine
+
+SCENARIOS = ("user_me", "webhook")
+
+
+def default_workers() -> str:
+    counts = [1]
+    while counts[-1] * 2 <= (os.cpu_count() or 1):
+        counts.append(counts[-1] * 2)
+    return ",".join(map(str, counts))
+
+
+def start_server(workers: int, port: int) -> subprocess.Popen:
+    env = {**os.environ, "WEB_CONCURRENCY": str(workers), "SERVER_HOST": "127.0.0.1", "SERVER_PORT": str(port),
+           "RATE_LIMIT_ENABLED": "false", "LOG_LEVEL": "WARNING"}
+    return subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "python:serving", "main:app"],
+                            cwd=BASE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def wait_ready(url: str, workers: int, timeout: float = 60):
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            httpx.get(f"{url}/", timeout=1)
+            return
+        except httpx.HTTPError:
+            if time.perf_counter() > deadline:
+                raise SystemExit(f"Server with {workers} workers did not start within {timeout} seconds")
+            time.sleep(0.2)
+
+
+def stop_server(server: subprocess.Popen):
+    server.send_signal(signal.SIGTERM)
+    try:
+        server.wait(timeout=60)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+
+
+async def drive(url: str, scenario: str, targets: list, connections: int, duration: float) -> tuple:
+    samples = []
+    errors = 0
+
+    def request_kwargs():
+        user_id, account_ids, headers = random.choice(targets)
+        if scenario == "user_me":
+            return {"method": "GET", "url": "/user/me", "headers": headers}
+        payload = signed_webhook_payload(user_id, random.choice(account_ids), round(random.uniform(1, 500), 2))
+        return {"method": "POST", "url": "/webhook", "json": payload}
+
+    async def connection(client, deadline: float):
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                response = await client.request(**request_kwargs())
+                failed = response.status_code >= 400
+            except httpx.HTTPError:
+                failed = True
+            samples.append(time.perf_counter() - started)
+            errors += failed
+
+    limits = httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=30) as client:
+        deadline = time.perf_counter() + duration
+        await asyncio.gather(*(connection(client, deadline) for _ in range(connections)))
+    return samples, errors
+
+
+def client_process(url: str, scenario: str, targets: list, connections: int, duration: float) -> tuple:
+    return asyncio.run(drive(url, scenario, targets, connections, duration))
+
+
+def measure(pool: Pool, url: str, scenario: str, targets: list, args) -> dict:
+    results = pool.starmap(client_process, [(url, scenario, targets, args.connections, args.duration)]
+                           * args.client_processes)
+    samples = [sample for process_samples, _ in results for sample in process_samples]
+    return {
+        **latency_report(samples),
+        "rps": round(len(samples) / args.duration, 1),
+        "errors": sum(errors for _, errors in results),
+    }
+
+
+async def load_targets() -> list:
+    async with async_session() as session:
+        _, users, accounts = await load_users(session)
+    await engine.dispose()
+    return [(user.id, accounts[user.id], bearer(user)) for user in users]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", default=default_workers(), help="числа рабочих процессов через запятую")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--warmup", type=float, default=2, help="нагрузка перед замером, не учитывается")
+    parser.add_argument("--client-processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--connections", type=int, default=32, help="одновременных запросов на процесс клиента")
+    parser.add_argument("--port", type=int, default=8100)
+    args = parser.parse_args()
+    worker_counts = [int(count) for count in args.workers.split(",")]
+    scenarios = args.scenarios.split(",")
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    targets = asyncio.run(load_targets())
+    url = f"http://127.0.0.1:{args.port}"
+    report = {"cpu_count": os.cpu_count(), "client_processes": args.client_processes,
+              "connections": args.connections, "results": {scenario: [] for scenario in scenarios}}
+    with Pool(args.client_processes) as pool:
+        for workers in worker_counts:
+            server = start_server(workers, args.port)
+            try:
+                wait_ready(url, workers)
+                for scenario in scenarios:
+                    if args.warmup:
+                        pool.starmap(client_process, [(url, scenario, targets, args.connections, args.warmup)]
+                                     * args.client_processes)
+                    report["results"][scenario].append({"workers": workers,
+                                                        **measure(pool, url, scenario, targets, args)})
+            finally:
+                stop_server(server)
+    for results in report["results"].values():
+        for result in results:
+            result["speedup"] = round(result["rps"] / results[0]["rps"], 2) if results[0]["rps"] else None
+    print_report(report)
+
+
+if __name__ == "__main__":
+    main()
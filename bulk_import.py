@@ -0,0 +1,117 @@
+import codecs
+import csv
+import json
+
+JSON_CONTENT_TYPE = "application/json"
+NDJSON_CONTENT_TYPE = "application/x-ndjson"
+CSV_CONTENT_TYPE = "text/csv"
+
+MAX_RECORD_SIZE = 1024 * 1024
+
+
+class BulkImportError(ValueError):
+    pass
+
+
+async def iter_text(stream):
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    async for chunk in stream:
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+async def iter_lines(stream):
+    buffer = ""
+    async for text in iter_text(stream):
+        buffer += text
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    if buffer:
+        yield buffer.rstrip("\r")
+
+
+async def iter_json_array(stream):
+    """
+    Разбирает JSON-массив по мере поступления данных и отдает его элементы по одному,
+    не загружая тело запроса целиком.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    opened = closed = False
+    async for text in iter_text(stream):
+        buffer += text
+        position = 0
+        while True:
+            while position < len(buffer) and (buffer[position].isspace() or (opened and buffer[position] == ",")):
+                position += 1
+            if position == len(buffer):
+                break
+            if closed:
+                raise BulkImportError("Unexpected data after the end of the JSON array")
+            if not opened:
+                if buffer[position] != "[":
+                    raise BulkImportError("Request body must be a JSON array")
+                opened = True
+                position += 1
+                continue
+            if buffer[position] == "]":
+                closed = True
+                position += 1
+                continue
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if len(buffer) - position > MAX_RECORD_SIZE:
+                    raise BulkImportError("Malformed JSON array element")
+                # The element is incomplete, wait for the next chunk.
+                break
+            yield item
+        buffer = buffer[position:]
+    if buffer.strip() or not closed:
+        raise BulkImportError("Malformed or truncated JSON array")
+
+
+async def iter_records(stream, content_type: str):
+    """
+    Отдает тройки `(номер строки, запись, ошибка)` из тела в формате JSON-массива, NDJSON или CSV
+    с заголовком. Строки NDJSON и CSV, которые не удалось разобрать, отдаются с текстом ошибки,
+    а нарушение структуры JSON-массива прерывает разбор исключением `BulkImportError`.
+    Поля CSV не могут содержать переводы строк.
+    """
+    if content_type == JSON_CONTENT_TYPE:
+        row = 0
+        async for item in iter_json_array(stream):
+            row += 1
+            yield row, item, None
+    elif content_type == NDJSON_CONTENT_TYPE:
+        row = 0
+        async for line in iter_lines(stream):
+            if not line.strip():
+                continue
+            row += 1
+            try:
+                yield row, json.loads(line), None
+            except json.JSONDecodeError as e:
+                yield row, None, f"Invalid JSON: {e}"
+    elif content_type == CSV_CONTENT_TYPE:
+        header = None
+        row = 0
+        async for line in iter_lines(stream):
+            if not line.strip():
+                continue
+            values = next(csv.reader([line]))
+            if header is None:
+                header = [name.strip() for name in values]
+                continue
+            row += 1
+            if len(values) != len(header):
+                yield row, None, f"Expected {len(header)} columns, got {len(values)}"
+            else:
+                yield row, dict(zip(header, values)), None
+    else:
+        raise BulkImportError(f"Unsupported content type: {content_type}")
@@ -0,0 +1,49 @@
+import time
+from collections import OrderedDict
+
+from config import AUTH_CACHE_MAX_SIZE, AUTH_CACHE_TTL_SECONDS
+
+
+class TTLCache:
+    """
+    Ограниченный LRU-кэш в памяти процесса, записи которого устаревают через `ttl` секунд.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        item = self._data.get(key)
+        if item is None:
+            return default
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        item = self._data.pop(key, None)
+        return default if item is None else item[1]
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+# Resolved principals of authenticated users keyed by user ID. Entries are dropped by the user
+# write paths in database.crud; the TTL bounds staleness for changes made by other processes.
+principal_cache = TTLCache(maxsize=AUTH_CACHE_MAX_SIZE, ttl=AUTH_CACHE_TTL_SECONDS)
@@ -1,4 +1,4 @@
-from os import getenv, path
+from os import cpu_count, getenv, path
 
 from dotenv import load_dotenv, find_dotenv
 
@@ -31,3 +31,135 @@ SECRET_KEY = getenv('SECRET_KEY', 'secret-key')
 ALGORITHM = getenv('ALGORITHM', 'HS256')
 ACCESS_TOKEN_EXPIRE_MINUTES = int(getenv('ACCESS_TOKEN_EXPIRE_MINUTES', '15'))
 REFRESH_TOKEN_EXPIRE_MINUTES = int(getenv('REFRESH_TOKEN_EXPIRE_MINUTES', '10080'))
+
+# HMAC keys for webhook signatures, comma-separated. The first key signs, all of them verify, so a new key
+# is rolled out by putting it first and the old one is removed once providers have switched.
+WEBHOOK_SIGNING_KEYS = [key.strip() for key in getenv('WEBHOOK_SIGNING_KEYS', SECRET_KEY).split(',') if key.strip()]
+# Also accept the original sha256(fields + SECRET_KEY) signatures.
+WEBHOOK_LEGACY_SIGNATURES = getenv('WEBHOOK_LEGACY_SIGNATURES', 'true').lower() == 'true'
+
+WEBHOOK_BATCH_MAX_SIZE = int(getenv('WEBHOOK_BATCH_MAX_SIZE', '10000'))
+
+WEBHOOK_QUEUE_ENABLED = getenv('WEBHOOK_QUEUE_ENABLED', 'false').lower() == 'true'
+WEBHOOK_QUEUE_MAX_SIZE = int(getenv('WEBHOOK_QUEUE_MAX_SIZE', '10000'))
+WEBHOOK_QUEUE_BATCH_SIZE = int(getenv('WEBHOOK_QUEUE_BATCH_SIZE', '500'))
+WEBHOOK_QUEUE_FLUSH_INTERVAL_MS = int(getenv('WEBHOOK_QUEUE_FLUSH_INTERVAL_MS', '50'))
+WEBHOOK_QUEUE_FLUSH_RETRIES = int(getenv('WEBHOOK_QUEUE_FLUSH_RETRIES', '3'))
+WEBHOOK_QUEUE_RETRY_AFTER_SECONDS = int(getenv('WEBHOOK_QUEUE_RETRY_AFTER_SECONDS', '1'))
+
+AUTH_CACHE_MAX_SIZE = int(getenv('AUTH_CACHE_MAX_SIZE', '10000'))
+AUTH_CACHE_TTL_SECONDS = int(getenv('AUTH_CACHE_TTL_SECONDS', '60'))
+AUTH_STATELESS = getenv('AUTH_STATELESS', 'false').lower() == 'true'
+
+BCRYPT_ROUNDS = int(getenv('BCRYPT_ROUNDS', '12'))
+PASSWORD_HASH_EXECUTOR = getenv('PASSWORD_HASH_EXECUTOR', 'thread')
+PASSWORD_HASH_WORKERS = int(getenv('PASSWORD_HASH_WORKERS', '4'))
+PASSWORD_HASH_MAX_PENDING = int(getenv('PASSWORD_HASH_MAX_PENDING', '32'))
+PASSWORD_HASH_QUEUE_TIMEOUT_SECONDS = float(getenv('PASSWORD_HASH_QUEUE_TIMEOUT_SECONDS', '2'))
+
+USERS_BULK_CHUNK_SIZE = int(getenv('USERS_BULK_CHUNK_SIZE', '1000'))
+USERS_BULK_MAX_ERRORS = int(getenv('USERS_BULK_MAX_ERRORS', '1000'))
+
+USERS_PAGE_DEFAULT_LIMIT = int(getenv('USERS_PAGE_DEFAULT_LIMIT', '100'))
+USERS_PAGE_MAX_LIMIT = int(getenv('USERS_PAGE_MAX_LIMIT', '1000'))
+USERS_STREAM_BATCH_SIZE = int(getenv('USERS_STREAM_BATCH_SIZE', '1000'))
+
+PAYMENTS_PAGE_DEFAULT_LIMIT = int(getenv('PAYMENTS_PAGE_DEFAULT_LIMIT', '100'))
+PAYMENTS_PAGE_MAX_LIMIT = int(getenv('PAYMENTS_PAGE_MAX_LIMIT', '1000'))
+
+DB_POOL_SIZE = int(getenv('DB_POOL_SIZE', '5'))
+DB_MAX_OVERFLOW = int(getenv('DB_MAX_OVERFLOW', '10'))
+DB_POOL_TIMEOUT = float(getenv('DB_POOL_TIMEOUT', '30'))
+DB_POOL_RECYCLE = int(getenv('DB_POOL_RECYCLE', '1800'))
+DB_POOL_PRE_PING = getenv('DB_POOL_PRE_PING', 'true').lower() == 'true'
+DB_STATEMENT_CACHE_SIZE = int(getenv('DB_STATEMENT_CACHE_SIZE', '100'))
+# Transaction-mode PgBouncer: no client-side pool and no prepared statement caches.
+DB_PGBOUNCER_MODE = getenv('DB_PGBOUNCER_MODE', 'false').lower() == 'true'
+# Connections to one database server the whole application may hold when served by gunicorn: split evenly between
+# the WEB_CONCURRENCY workers, each worker's pool_size and max_overflow are capped at its share (0 disables the cap).
+# A single process keeps DB_POOL_SIZE and DB_MAX_OVERFLOW as they are.
+DB_MAX_CONNECTIONS = int(getenv('DB_MAX_CONNECTIONS', '80'))
+
+# Comma-separated read replica URLs; empty means every query goes to DATABASE_URL.
+DATABASE_REPLICA_URLS = [url.strip() for url in getenv('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+DB_REPLICA_SELECTION = getenv('DB_REPLICA_SELECTION', 'round_robin')
+DB_REPLICA_HEALTH_CHECK_SECONDS = float(getenv('DB_REPLICA_HEALTH_CHECK_SECONDS', '5'))
+DB_REPLICA_MAX_LAG_SECONDS = float(getenv('DB_REPLICA_MAX_LAG_SECONDS', '10'))
+DB_READ_YOUR_WRITES_SECONDS = float(getenv('DB_READ_YOUR_WRITES_SECONDS', '5'))
+DB_READ_YOUR_WRITES_MAX_USERS = int(getenv('DB_READ_YOUR_WRITES_MAX_USERS', '100000'))
+
+LOG_LEVEL = getenv('LOG_LEVEL', 'INFO')
+# Per-module overrides, e.g. "database.crud=WARNING,routers.webhook=DEBUG". The longest matching prefix wins.
+LOG_LEVELS = getenv('LOG_LEVELS', '')
+LOG_JSON = getenv('LOG_JSON', 'false').lower() == 'true'
+LOG_ENQUEUE = getenv('LOG_ENQUEUE', 'true').lower() == 'true'
+# Share of INFO and lower records that are kept, and the per-module cap on them per second (0 disables the cap).
+# Both are off by default; warnings and errors are never dropped.
+LOG_SAMPLE_RATE = float(getenv('LOG_SAMPLE_RATE', '1.0'))
+LOG_RATE_LIMIT_PER_SECOND = float(getenv('LOG_RATE_LIMIT_PER_SECOND', '0'))
+
+# Per-route request metrics middleware and SQLAlchemy query timing.
+REQUEST_METRICS_ENABLED = getenv('REQUEST_METRICS_ENABLED', 'true').lower() == 'true'
+
+# Recently seen webhook transaction IDs with their responses, for replaying provider retries.
+IDEMPOTENCY_CACHE_SIZE = int(getenv('IDEMPOTENCY_CACHE_SIZE', '100000'))
+IDEMPOTENCY_TTL_SECONDS = int(getenv('IDEMPOTENCY_TTL_SECONDS', '86400'))
+# Optional store shared between processes: "memory://" (in-process stand-in) or "redis://host:port/db".
+IDEMPOTENCY_BACKEND_URL = getenv('IDEMPOTENCY_BACKEND_URL', '')
+
+# JSON encoder for API responses: "auto" uses orjson when it is installed, "orjson" requires it, "json" is the stdlib.
+JSON_BACKEND = getenv('JSON_BACKEND', 'auto')
+
+# Responses of /user/me and /user/me/accounts cached per user and data version. The TTL bounds how long
+# a write made by another process can go unnoticed; RESPONSE_CACHE_MAX_SIZE=0 disables the cache.
+RESPONSE_CACHE_MAX_SIZE = int(getenv('RESPONSE_CACHE_MAX_SIZE', '10000'))
+RESPONSE_CACHE_TTL_SECONDS = int(getenv('RESPONSE_CACHE_TTL_SECONDS', '30'))
+
+# Hot accounts, comma-separated IDs: their payments add to one of HOT_ACCOUNT_SHARDS pending balance rows instead of
+# updating the account row. Shards are folded into the account every BALANCE_COMPACTION_INTERVAL_SECONDS, or sooner
+# once an account has BALANCE_COMPACTION_MAX_PENDING payments pending, checked every BALANCE_COMPACTION_CHECK_SECONDS.
+HOT_ACCOUNT_IDS = {int(account_id) for account_id in getenv('HOT_ACCOUNT_IDS', '').split(',') if account_id.strip()}
+HOT_ACCOUNT_SHARDS = int(getenv('HOT_ACCOUNT_SHARDS', '16'))
+BALANCE_COMPACTION_INTERVAL_SECONDS = float(getenv('BALANCE_COMPACTION_INTERVAL_SECONDS', '10'))
+BALANCE_COMPACTION_CHECK_SECONDS = float(getenv('BALANCE_COMPACTION_CHECK_SECONDS', '1'))
+BALANCE_COMPACTION_MAX_PENDING = int(getenv('BALANCE_COMPACTION_MAX_PENDING', '1000'))
+
+# Background jobs scan the key space in chunks of JOBS_CHUNK_SIZE, JOBS_PARALLELISM chunks at a time, at most
+# JOBS_MAX_CHUNKS_PER_SECOND chunks per second (0 means no limit). They use their own pool of JOBS_PARALLELISM
+# connections and pause while the API pool has JOBS_PAUSE_POOL_USAGE of its connections or more checked out.
+JOBS_CHUNK_SIZE = int(getenv('JOBS_CHUNK_SIZE', '1000'))
+JOBS_PARALLELISM = int(getenv('JOBS_PARALLELISM', '2'))
+JOBS_MAX_CHUNKS_PER_SECOND = float(getenv('JOBS_MAX_CHUNKS_PER_SECOND', '0'))
+JOBS_PAUSE_POOL_USAGE = float(getenv('JOBS_PAUSE_POOL_USAGE', '0.8'))
+# Report-only balance reconciliation inside the application every N seconds; 0 leaves it to
+# `python -m jobs.balance_reconciliation`, which is also the only way to repair balances.
+BALANCE_RECONCILIATION_INTERVAL_SECONDS = float(getenv('BALANCE_RECONCILIATION_INTERVAL_SECONDS', '0'))
+
+# Admission control per route group (login, refresh_token, webhook, webhook_batch, user, admin). Token buckets as
+# "group=requests/seconds[/burst]", the burst defaulting to requests; buckets are kept per client IP for login,
+# refresh_token and webhook_batch, per webhook user_id for webhook and per authenticated user for user and admin.
+# The limits are for the whole application: gunicorn workers split them evenly, as their buckets are not shared.
+RATE_LIMIT_ENABLED = getenv('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+RATE_LIMITS = getenv('RATE_LIMITS', 'login=10/1/20,refresh_token=10/1/20,webhook=500/1/1000,webhook_batch=20/1/40,'
+                                    'user=50/1/100,admin=50/1/100')
+# Requests of a group processed at once by one process, as "group=count"; above the cap requests get 503.
+ROUTE_MAX_IN_FLIGHT = getenv('ROUTE_MAX_IN_FLIGHT', 'login=64,refresh_token=64,webhook=512,webhook_batch=16,'
+                                                    'user=256,admin=64')
+# Token bucket store: "memory://" keeps at most RATE_LIMIT_MAX_KEYS buckets in process memory.
+RATE_LIMIT_BACKEND_URL = getenv('RATE_LIMIT_BACKEND_URL', 'memory://')
+RATE_LIMIT_MAX_KEYS = int(getenv('RATE_LIMIT_MAX_KEYS', '100000'))
+
+# Serving with gunicorn (`gunicorn -c python:serving main:app`): WEB_CONCURRENCY worker processes, 0 means one per
+# CPU. SERVER_LOOP and SERVER_HTTP are uvicorn's loop and protocol implementations; "auto" picks uvloop when it is
+# installed. With SERVER_PRELOAD the application is imported once before the workers are forked.
+WEB_CONCURRENCY = int(getenv('WEB_CONCURRENCY', '0')) or cpu_count() or 1
+SERVER_HOST = getenv('SERVER_HOST', '0.0.0.0')
+SERVER_PORT = int(getenv('SERVER_PORT', '8000'))
+SERVER_LOOP = getenv('SERVER_LOOP', 'auto')
+SERVER_HTTP = getenv('SERVER_HTTP', 'httptools')
+SERVER_PRELOAD = getenv('SERVER_PRELOAD', 'true').lower() == 'true'
+SERVER_GRACEFUL_TIMEOUT_SECONDS = int(getenv('SERVER_GRACEFUL_TIMEOUT_SECONDS', '30'))
+SERVER_KEEPALIVE_SECONDS = int(getenv('SERVER_KEEPALIVE_SECONDS', '5'))
+# Workers are restarted after about SERVER_MAX_REQUESTS requests, plus up to SERVER_MAX_REQUESTS_JITTER (0 disables).
+SERVER_MAX_REQUESTS = int(getenv('SERVER_MAX_REQUESTS', '0'))
+SERVER_MAX_REQUESTS_JITTER = int(getenv('SERVER_MAX_REQUESTS_JITTER', '0'))
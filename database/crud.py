@@ -1,129 +1,760 @@
+import random
+from operator import itemgetter
+
 from loguru import logger
-from sqlalchemy import update, delete
+from sqlalchemy import (update, delete, literal, bindparam, case, func, tuple_, type_coerce,
+                        BigInteger, Integer, SmallInteger)
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
+from sqlalchemy.orm import aliased
+from sqlalchemy.orm.attributes import set_committed_value
 
-from database.models import User, Account, Payment
+from cache import principal_cache
+from config import HOT_ACCOUNT_IDS, HOT_ACCOUNT_SHARDS
+from database.models import (User, Account, Payment, AccountStats, AccountBalanceShard, JobCheckpoint,
+                             WebhookDeadLetter, MoneyType)
+from database.postgre_db import read_replica, mark_recent_write
+from database.schemas import PaymentFilters
+from money import Money
+from response_cache import user_versions
 
+# Exact balance of an account: the compacted balance plus the deltas still pending in its hot account shards.
+# Correlated to the accounts row of the enclosing query.
+pending_balance = (select(func.coalesce(func.sum(AccountBalanceShard.delta), 0))
+                   .where(AccountBalanceShard.account_id == Account.id)
+                   .scalar_subquery())
+exact_balance = type_coerce(Account.balance + pending_balance, MoneyType)
 
-async def get_user_by_email(session: AsyncSession, email: str):
-    logger.info(f"Fetching user by email: {email}")
-    query = select(User).where(User.email == email)
-    result = await session.execute(query)
-    return result.scalar_one_or_none()
+# Column projections for the list endpoints, in the field order of the matching response schemas.
+USER_COLUMNS = (User.id, User.email, User.full_name, User.role)
+# The principal of an authenticated request, and the same with the password hash checked at login.
+PRINCIPAL_COLUMNS = (User.id, User.email, User.role)
+CREDENTIAL_COLUMNS = (*PRINCIPAL_COLUMNS, User.hashed_password)
+ACCOUNT_COLUMNS = (Account.id, exact_balance.label("balance"), Account.owner_id)
+PAYMENT_COLUMNS = (Payment.id, Payment.transaction_id, Payment.amount, Payment.account_id, Payment.created_at)
 
 
-async def get_user_by_id(session: AsyncSession, user_id: int):
-    logger.info(f"Fetching user by ID: {user_id}")
-    query = select(User).where(User.id == user_id)
+def touch_users(*user_ids):
+    # The users' data changed: their reads stay on the primary for a while and their cached responses go stale.
+    user_ids = [user_id for user_id in user_ids if user_id is not None]
+    mark_recent_write(*user_ids)
+    user_versions.bump(*user_ids)
+
+
+async def get_principal_by_email(session: AsyncSession, email: str):
+    logger.info("Fetching principal by email: {}", email)
+    query = select(*PRINCIPAL_COLUMNS).where(User.email == email)
     result = await session.execute(query)
-    return result.scalar_one_or_none()
+    return result.one_or_none()
 
 
-async def get_all_users(session: AsyncSession):
-    logger.info("Fetching all users")
-    query = select(User)
+async def get_user_credentials(session: AsyncSession, email: str):
+    logger.info("Fetching credentials by email: {}", email)
+    query = select(*CREDENTIAL_COLUMNS).where(User.email == email)
     result = await session.execute(query)
-    return result.scalars().all()
+    return result.one_or_none()
 
 
-async def get_next_available_id(session: AsyncSession):
-    logger.info("Fetching next available user ID")
-    query = select(User.id).order_by(User.id)
+async def get_user_by_id(session: AsyncSession, user_id: int):
+    logger.info("Fetching user by ID: {}", user_id)
+    query = read_replica(select(*USER_COLUMNS).where(User.id == user_id))
     result = await session.execute(query)
-    existing_ids = [row[0] for row in result.fetchall()]
+    return result.one_or_none()
 
-    next_id = 1
-    while next_id in existing_ids:
-        next_id += 1
 
-    logger.info(f"Next available user ID: {next_id}")
-    return next_id
+async def get_all_users(session: AsyncSession, after_id: int = 0, limit: int = None):
+    logger.info("Fetching users after ID: {} with limit: {}", after_id, limit)
+    query = (select(*USER_COLUMNS)
+             .where(User.id > after_id)
+             .order_by(User.id)
+             .limit(limit))
+    result = await session.execute(read_replica(query))
+    return result.all()
+
+
+async def stream_all_users(session: AsyncSession, after_id: int = 0, batch_size: int = 1000):
+    # Reads users through a server-side cursor and yields them in lists of up to batch_size rows.
+    logger.info("Streaming users after ID: {}", after_id)
+    query = (select(*USER_COLUMNS)
+             .where(User.id > after_id)
+             .order_by(User.id)
+             .execution_options(yield_per=batch_size))
+    result = await session.stream(read_replica(query))
+    async for partition in result.partitions():
+        yield partition
 
 
 async def create_user(session: AsyncSession, user: User):
-    logger.info(f"Creating new user with email: {user.email}")
-    user.id = await get_next_available_id(session)
+    logger.info("Creating new user with email: {}", user.email)
     session.add(user)
     await session.commit()
     await session.refresh(user)
-    logger.info(f"New user created with ID: {user.id}")
+    mark_recent_write()
+    logger.info("New user created with ID: {}", user.id)
     return user
 
 
+async def create_users(session: AsyncSession, users: list):
+    # Bulk insert of user dicts in one commit. Emails that already exist (or repeat within the
+    # list) are skipped; returns the set of emails that were inserted.
+    logger.info("Creating {} new users", len(users))
+    query = (pg_insert(User.__table__)
+             .on_conflict_do_nothing(index_elements=["email"])
+             .returning(User.__table__.c.email))
+    result = await session.execute(query, users)
+    inserted = set(result.scalars().all())
+    await session.commit()
+    mark_recent_write()
+    logger.info("Created {} of {} new users", len(inserted), len(users))
+    return inserted
+
+
 async def update_user(session: AsyncSession, user_id: int, updates: dict):
-    logger.info(f"Updating user with ID: {user_id}")
-    query = update(User).where(User.id == user_id).values(**updates)
-    await session.execute(query)
+    # Returns the updated user as UserResponse columns, or None when there is no such user.
+    logger.info("Updating user with ID: {}", user_id)
+    query = update(User).where(User.id == user_id).values(**updates).returning(*USER_COLUMNS)
+    result = await session.execute(query)
+    user = result.one_or_none()
     await session.commit()
-    logger.info(f"User with ID: {user_id} updated successfully")
+    principal_cache.pop(user_id)
+    touch_users(user_id)
+    logger.info("User with ID: {} updated successfully", user_id)
+    return user
 
 
 async def delete_user(session: AsyncSession, user_id: int):
-    logger.info(f"Deleting user with ID: {user_id}")
+    # A bulk DELETE: accounts, payments and their aggregates go with ON DELETE CASCADE, none are loaded.
+    logger.info("Deleting user with ID: {}", user_id)
     query = delete(User).where(User.id == user_id)
     await session.execute(query)
     await session.commit()
-    logger.info(f"User with ID: {user_id} deleted successfully")
+    principal_cache.pop(user_id)
+    touch_users(user_id)
+    logger.info("User with ID: {} deleted successfully", user_id)
 
 
 async def get_user_accounts(session: AsyncSession, user_id: int):
-    logger.info(f"Fetching accounts for user ID: {user_id}")
-    query = select(Account).where(Account.owner_id == user_id)
+    logger.info("Fetching accounts for user ID: {}", user_id)
+    query = read_replica(select(*ACCOUNT_COLUMNS).where(Account.owner_id == user_id))
     result = await session.execute(query)
-    accounts = result.scalars().all()
-    logger.info(f"Fetched {len(accounts)} accounts for user ID: {user_id}")
+    accounts = result.all()
+    logger.info("Fetched {} accounts for user ID: {}", len(accounts), user_id)
     return accounts
 
 
-async def get_user_payments(session: AsyncSession, user_id: int):
-    logger.info(f"Fetching payments for user ID: {user_id}")
-    query = select(Payment).join(Account).where(Account.owner_id == user_id)
+def user_payments_query(user_id: int, filters: PaymentFilters = None, after_id: int = 0, limit: int = None):
+    filters = filters or PaymentFilters()
+    query = select(*PAYMENT_COLUMNS).join(Account).where(Account.owner_id == user_id, Payment.id > after_id)
+    if filters.account_id is not None:
+        query = query.where(Payment.account_id == filters.account_id)
+    if filters.min_amount is not None:
+        query = query.where(Payment.amount >= filters.min_amount)
+    if filters.max_amount is not None:
+        query = query.where(Payment.amount <= filters.max_amount)
+    if filters.created_from is not None:
+        query = query.where(Payment.created_at >= filters.created_from)
+    if filters.created_to is not None:
+        query = query.where(Payment.created_at < filters.created_to)
+    return query.order_by(Payment.id).limit(limit)
+
+
+async def get_user_payments(session: AsyncSession, user_id: int, filters: PaymentFilters = None,
+                            after_id: int = 0, limit: int = None):
+    logger.info("Fetching payments for user ID: {} after payment ID: {} with limit: {}", user_id, after_id, limit)
+    query = read_replica(user_payments_query(user_id, filters, after_id, limit))
     result = await session.execute(query)
-    payments = result.scalars().all()
-    logger.info(f"Fetched {len(payments)} payments for user ID: {user_id}")
+    payments = result.all()
+    logger.info("Fetched {} payments for user ID: {}", len(payments), user_id)
     return payments
 
 
+async def get_user_payments_summary(session: AsyncSession, user_id: int, filters: PaymentFilters = None):
+    logger.info("Fetching payments summary for user ID: {}", user_id)
+    payments = user_payments_query(user_id, filters).order_by(None).subquery()
+    query = read_replica(select(func.count(payments.c.id), func.coalesce(func.sum(payments.c.amount), 0)))
+    result = await session.execute(query)
+    count, total_amount = result.one()
+    return {"count": count, "total_amount": total_amount}
+
+
 async def create_account(session: AsyncSession, account: Account):
-    logger.info(f"Creating new account with ID: {account.id}")
+    logger.info("Creating new account with ID: {}", account.id)
     session.add(account)
     await session.commit()
     await session.refresh(account)
-    logger.info(f"New account created with ID: {account.id}")
+    touch_users(account.owner_id)
+    logger.info("New account created with ID: {}", account.id)
     return account
 
 
 async def get_account_by_id(session: AsyncSession, account_id: int):
-    logger.info(f"Fetching account by ID: {account_id}")
-    query = select(Account).where(Account.id == account_id)
+    logger.info("Fetching account by ID: {}", account_id)
+    query = select(Account, exact_balance.label("balance")).where(Account.id == account_id)
     result = await session.execute(query)
-    account = result.scalar_one_or_none()
-    logger.info(f"Account fetched successfully for ID: {account_id}")
+    row = result.one_or_none()
+    if row is None:
+        logger.info("Account fetched successfully for ID: {}", account_id)
+        return None
+    account, balance = row
+    # Loaded as the committed value, so the exact balance is never flushed back over the compacted one.
+    set_committed_value(account, "balance", balance)
+    logger.info("Account fetched successfully for ID: {}", account_id)
     return account
 
 
-async def update_account_balance(session: AsyncSession, account_id: int, amount: float):
-    logger.info(f"Updating account balance for account ID: {account_id} with amount: {amount}")
-    query = update(Account).where(Account.id == account_id).values(balance=Account.balance + amount)
-    await session.execute(query)
+def pick_shard() -> int:
+    return random.randrange(HOT_ACCOUNT_SHARDS)
+
+
+async def update_account_balance(session: AsyncSession, account_id: int, amount: int):
+    logger.info("Updating account balance for account ID: {} with amount: {}", account_id, amount)
+    if account_id in HOT_ACCOUNT_IDS:
+        await add_balance_shards(session, [{"account_id": account_id, "shard": pick_shard(), "delta": amount}])
+        owner_id = await session.scalar(select(Account.owner_id).where(Account.id == account_id))
+    else:
+        query = (update(Account)
+                 .where(Account.id == account_id)
+                 .values(balance=Account.balance + amount)
+                 .returning(Account.owner_id))
+        result = await session.execute(query)
+        owner_id = result.scalar_one_or_none()
     await session.commit()
-    logger.info(f"Account balance updated successfully for ID: {account_id}")
+    touch_users(owner_id)
+    logger.info("Account balance updated successfully for ID: {}", account_id)
+
+
+async def update_account_balances(session: AsyncSession, deltas: dict):
+    # One summed UPDATE per distinct account, sent as a single executemany. Accounts are
+    # updated in id order so concurrent batches lock rows in the same order. Does not commit.
+    logger.info("Updating account balances for {} accounts", len(deltas))
+    accounts = Account.__table__
+    query = (update(accounts)
+             .where(accounts.c.id == bindparam("account_pk"))
+             .values(balance=accounts.c.balance + bindparam("delta")))
+    await session.execute(query, [{"account_pk": account_id, "delta": deltas[account_id]}
+                                  for account_id in sorted(deltas)])
 
 
 async def create_payment(session: AsyncSession, payment: Payment):
-    logger.info(f"Creating new payment with transaction ID: {payment.transaction_id}")
+    logger.info("Creating new payment with transaction ID: {}", payment.transaction_id)
     session.add(payment)
     await session.commit()
     await session.refresh(payment)
-    logger.info(f"New payment created with transaction ID: {payment.transaction_id}")
+    owner_id = await session.scalar(select(Account.owner_id).where(Account.id == payment.account_id))
+    touch_users(owner_id)
+    logger.info("New payment created with transaction ID: {}", payment.transaction_id)
     return payment
 
 
+async def create_payments(session: AsyncSession, payments: list):
+    # Bulk insert that skips transaction IDs already present in the table and returns only the
+    # rows that were actually inserted. Does not commit.
+    logger.info("Creating {} new payments", len(payments))
+    query = (pg_insert(Payment.__table__)
+             .on_conflict_do_nothing(index_elements=["transaction_id"])
+             .returning(Payment.__table__.c.id,
+                        Payment.__table__.c.transaction_id,
+                        Payment.__table__.c.account_id,
+                        Payment.__table__.c.amount,
+                        Payment.__table__.c.created_at))
+    result = await session.execute(query, payments)
+    return result.all()
+
+
+def payment_stats_set(query, model) -> dict:
+    # ON CONFLICT SET shared by account_stats and the hot account shards: adds the new payments to the
+    # count and moves the last payment forward only when the incoming one is newer.
+    excluded = query.excluded
+    newer = excluded.last_payment_id > func.coalesce(model.last_payment_id, 0)
+    return {"payment_count": model.payment_count + excluded.payment_count,
+            "last_payment_id": case((newer, excluded.last_payment_id), else_=model.last_payment_id),
+            "last_payment_amount": case((newer, excluded.last_payment_amount), else_=model.last_payment_amount),
+            "last_payment_at": case((newer, excluded.last_payment_at), else_=model.last_payment_at)}
+
+
+def upsert_account_stats(query):
+    return query.on_conflict_do_update(index_elements=[AccountStats.account_id],
+                                       set_=payment_stats_set(query, AccountStats))
+
+
+def upsert_balance_shard(query):
+    set_ = payment_stats_set(query, AccountBalanceShard)
+    set_["delta"] = AccountBalanceShard.delta + query.excluded.delta
+    return query.on_conflict_do_update(index_elements=[AccountBalanceShard.account_id, AccountBalanceShard.shard],
+                                       set_=set_)
+
+
+def payment_stats(payments: list) -> dict:
+    # Payment count and last payment per account for a list of inserted payment rows.
+    stats = {}
+    for payment in payments:
+        account = stats.setdefault(payment.account_id, {"account_id": payment.account_id,
+                                                        "payment_count": 0,
+                                                        "last_payment_id": 0})
+        account["payment_count"] += 1
+        if payment.id > account["last_payment_id"]:
+            account.update(last_payment_id=payment.id,
+                           last_payment_amount=payment.amount,
+                           last_payment_at=payment.created_at)
+    return stats
+
+
+async def update_account_stats(session: AsyncSession, stats: dict):
+    # Folds per-account payment stats into account_stats with one upsert per account. Does not commit.
+    logger.info("Updating payment stats for {} accounts", len(stats))
+    query = upsert_account_stats(pg_insert(AccountStats))
+    await session.execute(query, [stats[account_id] for account_id in sorted(stats)])
+
+
+async def add_balance_shards(session: AsyncSession, shards: list):
+    # Adds balance deltas, and optionally payment stats, to hot account shards: dicts with account_id,
+    # shard and delta. Only the chosen shard row is locked, never the account row. Does not commit.
+    logger.info("Adding balance deltas to {} hot account shards", len(shards))
+    await session.execute(upsert_balance_shard(pg_insert(AccountBalanceShard)), shards)
+
+
+async def get_pending_balance_shards(session: AsyncSession):
+    # Accounts with pending shards and the number of payments not yet folded into them.
+    query = (select(AccountBalanceShard.account_id, func.sum(AccountBalanceShard.payment_count).label("payment_count"))
+             .group_by(AccountBalanceShard.account_id))
+    result = await session.execute(query)
+    return {row.account_id: row.payment_count for row in result}
+
+
+async def compact_account_balances(session: AsyncSession, account_ids):
+    # Folds the shards of the given accounts (a list or a select of IDs) into accounts.balance and
+    # account_stats and deletes them, in one transaction, so readers see either the shards or the folded
+    # balance. Shard rows are locked in key order; payments that hit a shard meanwhile wait and then
+    # start a new shard row. Returns the folded balance delta per account.
+    locked = (select(AccountBalanceShard.account_id, AccountBalanceShard.shard)
+              .where(AccountBalanceShard.account_id.in_(account_ids))
+              .order_by(AccountBalanceShard.account_id, AccountBalanceShard.shard)
+              .with_for_update())
+    query = (delete(AccountBalanceShard)
+             .where(tuple_(AccountBalanceShard.account_id, AccountBalanceShard.shard).in_(locked))
+             .returning(AccountBalanceShard.account_id,
+                        AccountBalanceShard.delta,
+                        AccountBalanceShard.payment_count,
+                        AccountBalanceShard.last_payment_id,
+                        AccountBalanceShard.last_payment_amount,
+                        AccountBalanceShard.last_payment_at))
+    shards = (await session.execute(query)).all()
+    deltas = {}
+    stats = {}
+    for shard in shards:
+        deltas[shard.account_id] = deltas.get(shard.account_id, 0) + shard.delta
+        if not shard.payment_count:
+            continue
+        account = stats.setdefault(shard.account_id, {"account_id": shard.account_id,
+                                                      "payment_count": 0,
+                                                      "last_payment_id": 0})
+        account["payment_count"] += shard.payment_count
+        if shard.last_payment_id > account["last_payment_id"]:
+            account.update(last_payment_id=shard.last_payment_id,
+                           last_payment_amount=shard.last_payment_amount,
+                           last_payment_at=shard.last_payment_at)
+    if deltas:
+        logger.info("Compacting {} balance shards of {} hot accounts", len(shards), len(deltas))
+        await update_account_balances(session, deltas)
+    if stats:
+        await update_account_stats(session, stats)
+    await session.commit()
+    return deltas
+
+
+async def get_user_summary(session: AsyncSession, user_id: int):
+    logger.info("Fetching summary for user ID: {}", user_id)
+    # Payments still pending in hot account shards count towards the balance, the payment count and the
+    # last payment as well; the last payment is the newer of the one in account_stats and in the shards.
+    shards = (select(AccountBalanceShard.account_id,
+                     func.sum(AccountBalanceShard.delta).label("delta"),
+                     func.sum(AccountBalanceShard.payment_count).label("payment_count"),
+                     func.max(AccountBalanceShard.last_payment_id).label("last_payment_id"))
+              .join(Account, Account.id == AccountBalanceShard.account_id)
+              .where(Account.owner_id == user_id)
+              .group_by(AccountBalanceShard.account_id)
+              .subquery())
+    shard_payment = aliased(Payment)
+    shard_newer = func.coalesce(shards.c.last_payment_id, 0) > func.coalesce(AccountStats.last_payment_id, 0)
+    query = (select(Account.id.label("account_id"),
+                    type_coerce(Account.balance + func.coalesce(shards.c.delta, 0), MoneyType).label("balance"),
+                    (func.coalesce(AccountStats.payment_count, 0)
+                     + func.coalesce(shards.c.payment_count, 0)).label("payment_count"),
+                    case((shard_newer, shard_payment.id), else_=AccountStats.last_payment_id).label("last_payment_id"),
+                    case((shard_newer, shard_payment.amount),
+                         else_=AccountStats.last_payment_amount).label("last_payment_amount"),
+                    case((shard_newer, shard_payment.created_at),
+                         else_=AccountStats.last_payment_at).label("last_payment_at"))
+             .outerjoin(AccountStats, AccountStats.account_id == Account.id)
+             .outerjoin(shards, shards.c.account_id == Account.id)
+             .outerjoin(shard_payment, shard_payment.id == shards.c.last_payment_id)
+             .where(Account.owner_id == user_id)
+             .order_by(Account.id))
+    result = await session.execute(read_replica(query))
+    accounts = [{"account_id": row.account_id,
+                 "balance": row.balance,
+                 "payment_count": row.payment_count,
+                 "last_payment": None if row.last_payment_id is None else {"id": row.last_payment_id,
+                                                                           "amount": row.last_payment_amount,
+                                                                           "created_at": row.last_payment_at}}
+                for row in result]
+    return {"user_id": user_id,
+            "total_balance": sum(account["balance"] or 0 for account in accounts),
+            "account_count": len(accounts),
+            "payment_count": sum(account["payment_count"] for account in accounts),
+            "accounts": accounts}
+
+
+def account_stats_check_query(accounts):
+    # Payment count and last payment of each account in the `accounts` subquery as stored, i.e. in
+    # account_stats plus its pending hot account shards, and as recomputed from the ledger. One statement,
+    # so one snapshot: a hot account payment adds its payment row and its shard row in the same commit.
+    ledger = (select(Payment.account_id,
+                     func.count().label("payment_count"),
+                     func.max(Payment.id).label("last_payment_id"))
+              .where(Payment.account_id.in_(select(accounts.c.id)))
+              .group_by(Payment.account_id)
+              .subquery())
+    shards = (select(AccountBalanceShard.account_id,
+                     func.sum(AccountBalanceShard.payment_count).label("payment_count"),
+                     func.max(AccountBalanceShard.last_payment_id).label("last_payment_id"))
+              .where(AccountBalanceShard.account_id.in_(select(accounts.c.id)))
+              .group_by(AccountBalanceShard.account_id)
+              .subquery())
+    shard_newer = func.coalesce(shards.c.last_payment_id, 0) > func.coalesce(AccountStats.last_payment_id, 0)
+    return (select(accounts.c.id.label("account_id"),
+                   (func.coalesce(AccountStats.payment_count, 0)
+                    + func.coalesce(shards.c.payment_count, 0)).label("stored_payment_count"),
+                   func.coalesce(ledger.c.payment_count, 0).label("ledger_payment_count"),
+                   case((shard_newer, shards.c.last_payment_id),
+                        else_=AccountStats.last_payment_id).label("stored_last_payment_id"),
+                   ledger.c.last_payment_id.label("ledger_last_payment_id"))
+            .outerjoin(AccountStats, AccountStats.account_id == accounts.c.id)
+            .outerjoin(shards, shards.c.account_id == accounts.c.id)
+            .outerjoin(ledger, ledger.c.account_id == accounts.c.id)
+            .order_by(accounts.c.id))
+
+
+def account_stats_drift(rows) -> list:
+    return [dict(row) for row in rows
+            if row["stored_payment_count"] != row["ledger_payment_count"]
+            or row["stored_last_payment_id"] != row["ledger_last_payment_id"]]
+
+
+async def rebuild_account_stats(session: AsyncSession, account_ids: list):
+    # Sets account_stats of the given accounts to the ledger less the payments pending in their shards,
+    # both read by one statement. Does not commit.
+    logger.warning("Rebuilding account stats for {} accounts", len(account_ids))
+    await session.execute(delete(AccountStats).where(AccountStats.account_id.in_(account_ids)))
+    last_payment = aliased(Payment)
+    counts = (select(Payment.account_id,
+                     func.count().label("payment_count"),
+                     func.max(Payment.id).label("last_payment_id"))
+              .where(Payment.account_id.in_(account_ids))
+              .group_by(Payment.account_id)
+              .subquery())
+    shards = (select(AccountBalanceShard.account_id,
+                     func.sum(AccountBalanceShard.payment_count).label("payment_count"))
+              .where(AccountBalanceShard.account_id.in_(account_ids))
+              .group_by(AccountBalanceShard.account_id)
+              .subquery())
+    await session.execute(pg_insert(AccountStats).from_select(
+        [AccountStats.account_id, AccountStats.payment_count, AccountStats.last_payment_id,
+         AccountStats.last_payment_amount, AccountStats.last_payment_at],
+        select(counts.c.account_id, counts.c.payment_count - func.coalesce(shards.c.payment_count, 0),
+               last_payment.id, last_payment.amount, last_payment.created_at)
+        .join(last_payment, last_payment.id == counts.c.last_payment_id)
+        .outerjoin(shards, shards.c.account_id == counts.c.account_id)
+    ))
+
+
+async def check_account_stats(session: AsyncSession, after_id: int, limit: int, repair: bool = False):
+    # Recomputes payment count and last payment from the ledger for the next `limit` accounts after
+    # `after_id` and compares them with account_stats plus the pending hot account shards. With repair,
+    # drifted rows are rebuilt from the ledger less the shards, which compaction folds in later. Returns
+    # the last account ID of the chunk (None when there are no more accounts) and the drifted accounts.
+    logger.info("Checking account stats after account ID: {}", after_id)
+    accounts = select(Account.id).where(Account.id > after_id).order_by(Account.id).limit(limit).subquery()
+    rows = (await session.execute(account_stats_check_query(accounts))).mappings().all()
+    drift = account_stats_drift(rows)
+
+    if repair and drift:
+        # Lock the accounts first, so that the recheck below runs on a snapshot taken after every in-flight
+        # payment to them and every compaction of their shards has committed. Hot account payments do not
+        # take this lock, but add to the ledger and to the shards in one commit, so the ledger less the
+        # shards stays right. Only the accounts that still drift on that snapshot are rebuilt.
+        account_ids = [row["account_id"] for row in drift]
+        await session.execute(select(Account.id).where(Account.id.in_(account_ids))
+                              .order_by(Account.id).with_for_update())
+        locked = select(Account.id).where(Account.id.in_(account_ids)).subquery()
+        rechecked = (await session.execute(account_stats_check_query(locked))).mappings().all()
+        account_ids = [row["account_id"] for row in account_stats_drift(rechecked)]
+        if account_ids:
+            await rebuild_account_stats(session, account_ids)
+        await session.commit()
+    return (rows[-1]["account_id"] if rows else None), drift
+
+
+async def next_account_chunk(session: AsyncSession, after_id: int, limit: int):
+    # Keyset boundary of the next chunk: the ID of the `limit`-th account after `after_id`, or the last
+    # one when fewer remain. None when there are no more accounts.
+    ids = select(Account.id).where(Account.id > after_id).order_by(Account.id).limit(limit).subquery()
+    return await session.scalar(select(func.max(ids.c.id)))
+
+
+async def check_account_balances(session: AsyncSession, after_id: int, last_id: int, repair: dict = None):
+    # Compares the balances of the accounts in (after_id, last_id], pending hot account shards included,
+    # with the sum of their payments in one grouped query, i.e. on one snapshot. An account without any
+    # payments cannot be checked: a non-zero balance may be an opening balance that no payment backs, so
+    # it is reported as unverified and never repaired. `repair` maps account IDs to the stored and ledger
+    # balances approved in a dry-run report; drifted accounts whose balances still match it are set back
+    # to the ledger sum and marked as repaired. Returns the number of checked accounts, the drift and the
+    # unverified accounts.
+    logger.info("Checking account balances in ({}, {}]", after_id, last_id)
+    ledger = (select(Payment.account_id, func.sum(Payment.amount).label("ledger_balance"))
+              .where(Payment.account_id > after_id, Payment.account_id <= last_id)
+              .group_by(Payment.account_id)
+              .subquery())
+    query = (select(Account.id.label("account_id"),
+                    exact_balance.label("stored_balance"),
+                    ledger.c.ledger_balance)
+             .outerjoin(ledger, ledger.c.account_id == Account.id)
+             .where(Account.id > after_id, Account.id <= last_id)
+             .order_by(Account.id))
+    rows = (await session.execute(query)).all()
+    drift = []
+    unverified = []
+    for row in rows:
+        stored_balance = Money(row.stored_balance or 0)
+        if row.ledger_balance is None:
+            if stored_balance:
+                unverified.append({"account_id": row.account_id, "stored_balance": stored_balance})
+        elif stored_balance != row.ledger_balance:
+            drift.append({"account_id": row.account_id, "stored_balance": stored_balance,
+                          "ledger_balance": Money(row.ledger_balance), "repaired": False})
+
+    approved = [row for row in drift
+                if repair and repair.get(row["account_id"]) == (row["stored_balance"], row["ledger_balance"])]
+    if approved:
+        account_ids = [row["account_id"] for row in approved]
+        logger.warning("Repairing balances of {} accounts", len(account_ids))
+        # Lock the accounts first, so that the recomputation below runs on a snapshot taken after every
+        # in-flight payment to them has committed. Hot account payments do not take this lock, but add
+        # to the ledger and to the shards in one commit, so the ledger sum minus the shards stays right.
+        await session.execute(select(Account.id).where(Account.id.in_(account_ids))
+                              .order_by(Account.id).with_for_update())
+        ledger_balance = (select(func.coalesce(func.sum(Payment.amount), 0))
+                          .where(Payment.account_id == Account.id)
+                          .scalar_subquery())
+        result = await session.execute(update(Account)
+                                       .where(Account.id.in_(account_ids))
+                                       .values(balance=ledger_balance - pending_balance)
+                                       .returning(Account.owner_id))
+        owner_ids = result.scalars().all()
+        await session.commit()
+        touch_users(*owner_ids)
+        for row in approved:
+            row["repaired"] = True
+    else:
+        await session.rollback()
+    return len(rows), drift, unverified
+
+
+async def get_job_checkpoint(session: AsyncSession, name: str):
+    return await session.scalar(select(JobCheckpoint.last_id).where(JobCheckpoint.name == name))
+
+
+async def save_job_checkpoint(session: AsyncSession, name: str, last_id: int = None):
+    # last_id is the end of the scanned prefix of the key space; None marks a finished run.
+    query = pg_insert(JobCheckpoint).values(name=name, last_id=last_id, updated_at=func.now())
+    query = query.on_conflict_do_update(index_elements=[JobCheckpoint.name],
+                                        set_={"last_id": query.excluded.last_id,
+                                              "updated_at": query.excluded.updated_at})
+    await session.execute(query)
+    await session.commit()
+
+
+async def create_webhook_dead_letters(session: AsyncSession, payments: list, errors: dict):
+    # payments are ingest_payments dicts, errors maps their transaction IDs to the reason they were not
+    # written. A payment that is dead-lettered again keeps one row with the latest error.
+    logger.warning("Dead-lettering {} webhook payments", len(payments))
+    query = pg_insert(WebhookDeadLetter).values([
+        {"transaction_id": payment["transaction_id"], "user_id": payment["user_id"],
+         "account_id": payment["account_id"], "amount": payment["amount"],
+         "error": errors[payment["transaction_id"]]} for payment in payments])
+    query = query.on_conflict_do_update(index_elements=[WebhookDeadLetter.transaction_id],
+                                        set_={"error": query.excluded.error, "created_at": func.now()})
+    await session.execute(query)
+    await session.commit()
+
+
+async def get_webhook_dead_letters(session: AsyncSession, after_id: int, limit: int):
+    query = (select(WebhookDeadLetter.id, WebhookDeadLetter.transaction_id, WebhookDeadLetter.user_id,
+                    WebhookDeadLetter.account_id, WebhookDeadLetter.amount, WebhookDeadLetter.error)
+             .where(WebhookDeadLetter.id > after_id)
+             .order_by(WebhookDeadLetter.id)
+             .limit(limit))
+    return (await session.execute(query)).all()
+
+
+async def delete_webhook_dead_letters(session: AsyncSession, transaction_ids: list):
+    if transaction_ids:
+        await session.execute(delete(WebhookDeadLetter).where(WebhookDeadLetter.transaction_id.in_(transaction_ids)))
+        await session.commit()
+
+
 async def get_payment_by_transaction_id(session: AsyncSession, transaction_id: str):
-    logger.info(f"Fetching payment by transaction ID: {transaction_id}")
+    logger.info("Fetching payment by transaction ID: {}", transaction_id)
     query = select(Payment).where(Payment.transaction_id == transaction_id)
     result = await session.execute(query)
     payment = result.scalar_one_or_none()
-    logger.info(f"Payment fetched successfully for transaction ID: {transaction_id}")
+    logger.info("Payment fetched successfully for transaction ID: {}", transaction_id)
     return payment
+
+
+async def get_processed_transaction_ids(session: AsyncSession, transaction_ids: list):
+    logger.info("Fetching processed transaction IDs among {} candidates", len(transaction_ids))
+    query = select(Payment.transaction_id).where(Payment.transaction_id.in_(transaction_ids))
+    result = await session.execute(query)
+    return set(result.scalars().all())
+
+
+async def ingest_payment(session: AsyncSession, transaction_id: str, user_id: int, account_id: int, amount: int):
+    logger.info("Ingesting payment with transaction ID: {}", transaction_id)
+    # Dedup, account upsert, payment insert, balance increment and account_stats update in a single
+    # statement: the unique constraint on payments.transaction_id rejects retries, and the account
+    # rows are only touched when the payment was actually inserted. Hot accounts take the balance
+    # increment and stats update in a random shard row instead, leaving the account row unlocked.
+    new_payment = (
+        pg_insert(Payment)
+        .values(transaction_id=transaction_id, account_id=account_id, amount=amount)
+        .on_conflict_do_nothing(index_elements=[Payment.transaction_id])
+        .returning(Payment.id, Payment.account_id, Payment.amount, Payment.created_at)
+        .cte("new_payment")
+    )
+    if account_id in HOT_ACCOUNT_IDS:
+        query = hot_payment_query(new_payment, user_id)
+    else:
+        query = payment_query(new_payment, user_id)
+    result = await session.execute(query)
+    row = result.one_or_none()
+    await session.commit()
+    if row is None:
+        logger.info("Transaction ID: {} was already processed", transaction_id)
+        return None
+    # The credited account may belong to someone else than the user_id of the payload.
+    payment_id, owner_id = row
+    touch_users(owner_id)
+    logger.info("Payment ingested with ID: {} for transaction ID: {}", payment_id, transaction_id)
+    return payment_id
+
+
+def payment_query(new_payment, user_id: int):
+    stats_upsert = upsert_account_stats(pg_insert(AccountStats).from_select(
+        [AccountStats.account_id, AccountStats.payment_count, AccountStats.last_payment_id,
+         AccountStats.last_payment_amount, AccountStats.last_payment_at],
+        select(new_payment.c.account_id, literal(1, BigInteger), new_payment.c.id,
+               new_payment.c.amount, new_payment.c.created_at)
+    )).cte("stats_upsert")
+    account_upsert = pg_insert(Account).from_select(
+        [Account.id, Account.owner_id, Account.balance],
+        select(new_payment.c.account_id, literal(user_id, Integer), new_payment.c.amount)
+    )
+    return (
+        account_upsert
+        .on_conflict_do_update(index_elements=[Account.id],
+                               set_={"balance": Account.balance + account_upsert.excluded.balance})
+        .returning(select(new_payment.c.id).scalar_subquery(), Account.owner_id)
+        .add_cte(new_payment, stats_upsert)
+    )
+
+
+def hot_payment_query(new_payment, user_id: int):
+    # A missing account is still created, but ON CONFLICT DO NOTHING does not lock an existing row.
+    account_insert = pg_insert(Account).from_select(
+        [Account.id, Account.owner_id, Account.balance],
+        select(new_payment.c.account_id, literal(user_id, Integer), literal(0, BigInteger))
+    ).on_conflict_do_nothing(index_elements=[Account.id]).returning(Account.owner_id).cte("account_insert")
+    shard_upsert = pg_insert(AccountBalanceShard).from_select(
+        [AccountBalanceShard.account_id, AccountBalanceShard.shard, AccountBalanceShard.delta,
+         AccountBalanceShard.payment_count, AccountBalanceShard.last_payment_id,
+         AccountBalanceShard.last_payment_amount, AccountBalanceShard.last_payment_at],
+        select(new_payment.c.account_id, literal(pick_shard(), SmallInteger), new_payment.c.amount,
+               literal(1, BigInteger), new_payment.c.id, new_payment.c.amount, new_payment.c.created_at)
+    )
+    # The statement does not see the row its own CTE inserted, so a new account's owner comes from the CTE.
+    owner_id = func.coalesce(select(Account.owner_id).where(Account.id == new_payment.c.account_id).scalar_subquery(),
+                             select(account_insert.c.owner_id).scalar_subquery())
+    return (
+        upsert_balance_shard(shard_upsert)
+        .returning(select(new_payment.c.id).scalar_subquery(), owner_id)
+        .add_cte(new_payment, account_insert)
+    )
+
+
+async def get_unknown_owner_payments(session: AsyncSession, payments: list):
+    # Transaction IDs of the payments that cannot be recorded: their account does not exist and the
+    # user it would be created for does not exist either.
+    account_ids = {payment["account_id"] for payment in payments}
+    existing = set((await session.execute(select(Account.id).where(Account.id.in_(account_ids)))).scalars())
+    owner_ids = {payment["user_id"] for payment in payments if payment["account_id"] not in existing}
+    users = set()
+    if owner_ids:
+        users = set((await session.execute(select(User.id).where(User.id.in_(owner_ids)))).scalars())
+    return {payment["transaction_id"] for payment in payments
+            if payment["account_id"] not in existing and payment["user_id"] not in users}
+
+
+async def ingest_payments(session: AsyncSession, payments: list):
+    # Batch counterpart of ingest_payment: payments are dicts with transaction_id, user_id,
+    # account_id and amount, already deduplicated by the caller. Missing accounts are created,
+    # payments are bulk-inserted, balances credited and account_stats updated with one statement
+    # per account, all in one commit; hot accounts get one shard upsert each instead. Payments for
+    # unknown owners (see get_unknown_owner_payments) are skipped so that they do not fail the rest.
+    # Returns the set of transaction IDs that were inserted and the set of those that were skipped.
+    logger.info("Ingesting batch of {} payments", len(payments))
+    if not payments:
+        return set(), set()
+
+    unknown = await get_unknown_owner_payments(session, payments)
+    if unknown:
+        logger.warning("Skipping {} payments to accounts of unknown users", len(unknown))
+        payments = [payment for payment in payments if payment["transaction_id"] not in unknown]
+        if not payments:
+            await session.rollback()
+            return set(), unknown
+
+    owners = {}
+    for payment in payments:
+        owners.setdefault(payment["account_id"], payment["user_id"])
+    # Accounts are inserted in id order and payments in transaction_id order, like the balance updates
+    # below, so concurrent batches wait on each other's speculative inserts in the same order.
+    accounts_query = pg_insert(Account.__table__).on_conflict_do_nothing(index_elements=["id"])
+    await session.execute(accounts_query, [{"id": account_id, "owner_id": owners[account_id], "balance": 0}
+                                           for account_id in sorted(owners)])
+
+    inserted = await create_payments(session, [{"transaction_id": payment["transaction_id"],
+                                                "account_id": payment["account_id"],
+                                                "amount": payment["amount"]}
+                                               for payment in sorted(payments, key=itemgetter("transaction_id"))])
+    deltas = {}
+    for row in inserted:
+        deltas[row.account_id] = deltas.get(row.account_id, 0) + row.amount
+    stats = payment_stats(inserted)
+    hot = sorted(account_id for account_id in deltas if account_id in HOT_ACCOUNT_IDS)
+    if hot:
+        await add_balance_shards(session, [{**stats.pop(account_id), "shard": pick_shard(),
+                                            "delta": deltas.pop(account_id)} for account_id in hot])
+    credited = set(deltas) | set(hot)
+    if deltas:
+        await update_account_balances(session, deltas)
+        await update_account_stats(session, stats)
+    owner_ids = []
+    if credited:
+        # The owners of the credited accounts, which are not necessarily the user_id of the payloads.
+        owner_ids = (await session.execute(select(Account.owner_id).where(Account.id.in_(credited)))).scalars().all()
+    await session.commit()
+    touch_users(*set(owner_ids))
+    logger.info("Batch ingested: {} of {} payments inserted", len(inserted), len(payments))
+    return {row.transaction_id for row in inserted}, unknown
@@ -1,7 +1,23 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey
+from sqlalchemy import (Column, Integer, BigInteger, SmallInteger, String, DateTime, ForeignKey, Index, TypeDecorator,
+                        func)
 from sqlalchemy.orm import relationship, validates
 
 from database.postgre_db import Base
+from money import Money
+
+
+class MoneyType(TypeDecorator):
+    # BIGINT cents, read back as Money. Floats are refused so that no rounding happens on the way in.
+    impl = BigInteger
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if isinstance(value, float):
+            raise TypeError("Money columns take integer cents, not floats")
+        return value
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else Money(value)
 
 
 class User(Base):
@@ -12,7 +28,10 @@ class User(Base):
     full_name = Column(String)
     role = Column(String, default="user")
 
-    accounts = relationship("Account", back_populates="owner", cascade="all, delete-orphan")
+    # Relationships are never loaded implicitly: queries project columns or ask for selectinload explicitly,
+    # and child rows are deleted by ON DELETE CASCADE in the database rather than by the ORM.
+    accounts = relationship("Account", back_populates="owner", cascade="all, delete-orphan", passive_deletes=True,
+                            lazy="raise")
 
     @validates('role')
     def validate_role(self, key, role):
@@ -24,18 +43,76 @@ class User(Base):
 class Account(Base):
     __tablename__ = "accounts"
     id = Column(Integer, primary_key=True, index=True)
-    balance = Column(Float, default=0.0)
-    owner_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
+    balance = Column(MoneyType, default=0)
+    owner_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), index=True)
 
-    owner = relationship("User", back_populates="accounts")
-    payments = relationship("Payment", back_populates="account", cascade="all, delete-orphan")
+    owner = relationship("User", back_populates="accounts", lazy="raise")
+    payments = relationship("Payment", back_populates="account", cascade="all, delete-orphan", passive_deletes=True,
+                            lazy="raise")
+    stats = relationship("AccountStats", back_populates="account", uselist=False, cascade="all, delete-orphan",
+                         passive_deletes=True, lazy="raise")
+    balance_shards = relationship("AccountBalanceShard", back_populates="account", cascade="all, delete-orphan",
+                                  passive_deletes=True, lazy="raise")
 
 
 class Payment(Base):
     __tablename__ = "payments"
     id = Column(Integer, primary_key=True, index=True)
     transaction_id = Column(String, unique=True, index=True)
-    amount = Column(Float)
+    amount = Column(MoneyType)
     account_id = Column(Integer, ForeignKey("accounts.id", ondelete="CASCADE"))
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+    account = relationship("Account", back_populates="payments", lazy="raise")
+
+    __table_args__ = (Index("ix_payments_account_id_id", "account_id", "id"),)
+
+
+# Per-account payment aggregates, maintained by the payment ingestion path in the same transaction
+# as the payment itself and checked against the ledger by jobs.summary_consistency.
+class AccountStats(Base):
+    __tablename__ = "account_stats"
+    account_id = Column(Integer, ForeignKey("accounts.id", ondelete="CASCADE"), primary_key=True)
+    payment_count = Column(BigInteger, nullable=False, default=0)
+    last_payment_id = Column(Integer)
+    last_payment_amount = Column(MoneyType)
+    last_payment_at = Column(DateTime(timezone=True))
+
+    account = relationship("Account", back_populates="stats", lazy="raise")
+
+
+# Pending balance and payment aggregates of hot accounts, spread over several rows per account so that concurrent
+# payments do not queue on one row lock. The balance of an account is accounts.balance plus the deltas of its
+# shards; crud.compact_account_balances folds the shards into accounts and account_stats and deletes them.
+class AccountBalanceShard(Base):
+    __tablename__ = "account_balance_shards"
+    account_id = Column(Integer, ForeignKey("accounts.id", ondelete="CASCADE"), primary_key=True)
+    shard = Column(SmallInteger, primary_key=True)
+    delta = Column(MoneyType, nullable=False, default=0)
+    payment_count = Column(BigInteger, nullable=False, default=0)
+    last_payment_id = Column(Integer)
+    last_payment_amount = Column(MoneyType)
+    last_payment_at = Column(DateTime(timezone=True))
+
+    account = relationship("Account", back_populates="balance_shards", lazy="raise")
+
+
+# Progress of resumable background jobs: the last key of the prefix a job has fully processed.
+class JobCheckpoint(Base):
+    __tablename__ = "job_checkpoints"
+    name = Column(String, primary_key=True)
+    last_id = Column(Integer)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
 
-    account = relationship("Account", back_populates="payments")
+# Queued webhook payments that could not be written after they had been acknowledged with 202, e.g. to an
+# account of a user that does not exist. jobs.webhook_dead_letters replays them once the cause is fixed.
+class WebhookDeadLetter(Base):
+    __tablename__ = "webhook_dead_letters"
+    id = Column(Integer, primary_key=True)
+    transaction_id = Column(String, unique=True, nullable=False)
+    user_id = Column(Integer, nullable=False)
+    account_id = Column(Integer, nullable=False)
+    amount = Column(MoneyType, nullable=False)
+    error = Column(String, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
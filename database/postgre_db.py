@@ -1,15 +1,310 @@
+import asyncio
+import itertools
+import time
+from contextvars import ContextVar
+
+from loguru import logger
+from sqlalchemy import event, exc, text, Select
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.asyncio import (AsyncSession,
                                     async_sessionmaker,
                                     create_async_engine)
-from sqlalchemy.orm import declarative_base
+from sqlalchemy.orm import Session, declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool
 import asyncpg
 
 
-from config import DATABASE_URL
+from cache import TTLCache
+from config import (DATABASE_URL,
+                    DATABASE_REPLICA_URLS,
+                    DB_REPLICA_SELECTION,
+                    DB_REPLICA_HEALTH_CHECK_SECONDS,
+                    DB_REPLICA_MAX_LAG_SECONDS,
+                    DB_READ_YOUR_WRITES_SECONDS,
+                    DB_READ_YOUR_WRITES_MAX_USERS,
+                    DB_POOL_SIZE,
+                    DB_MAX_OVERFLOW,
+                    DB_POOL_TIMEOUT,
+                    DB_POOL_RECYCLE,
+                    DB_POOL_PRE_PING,
+                    DB_STATEMENT_CACHE_SIZE,
+                    DB_PGBOUNCER_MODE,
+                    DB_MAX_CONNECTIONS,
+                    JOBS_PARALLELISM,
+                    BALANCE_RECONCILIATION_INTERVAL_SECONDS,
+                    REQUEST_METRICS_ENABLED)
+from metrics import Counter, Gauge, Histogram
+
+pool_checkout_wait = Histogram("db_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection",
+                               ("pool",), buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0))
+pool_checkout_timeouts = Counter("db_pool_checkout_timeouts_total", "Connection checkouts that hit the pool timeout",
+                                 ("pool",))
+pool_checked_out = Gauge("db_pool_checked_out", "Connections currently checked out of the pool", ("pool",))
+pool_size_gauge = Gauge("db_pool_size", "Configured size of the connection pool", ("pool",))
+replica_healthy = Gauge("db_replica_healthy", "Whether the read replica passed its last health check", ("pool",))
+query_seconds = Histogram("db_query_duration_seconds", "Duration of one statement execution on the driver cursor",
+                          ("pool",), buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0))
+reads_routed = Counter("db_reads_routed_total", "Read-only sessions by the engine they were routed to", ("pool",))
+
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """
+    Пул соединений, который публикует время ожидания свободного соединения.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics_name = "primary"
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            pool_checkout_timeouts.labels(self.metrics_name).inc()
+            raise
+        finally:
+            pool_checkout_wait.labels(self.metrics_name).observe(time.perf_counter() - started)
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.metrics_name = self.metrics_name
+        return pool
+
+
+class QueryStats:
+    __slots__ = ("count", "seconds")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+
+# Statement counter of the current HTTP request, set by request_metrics.RequestMetricsMiddleware.
+request_queries = ContextVar("request_queries", default=None)
+
+
+def instrument_engine(engine, name: str):
+    # Times every cursor execution (an executemany counts as one) and adds it to the request's QueryStats.
+    duration = query_seconds.labels(name)
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        context.query_started = time.perf_counter()
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context.query_started
+        duration.observe(elapsed)
+        stats = request_queries.get()
+        if stats is not None:
+            stats.count += 1
+            stats.seconds += elapsed
+
+    event.listen(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine.sync_engine, "after_cursor_execute", after_cursor_execute)
+
+
+def create_engine(url: str, name: str, pool_size: int = DB_POOL_SIZE, max_overflow: int = DB_MAX_OVERFLOW):
+    # Statement cache settings are asyncpg arguments; other drivers (e.g. SQLite stand-ins for
+    # replicas in local runs) get none.
+    asyncpg_driver = make_url(url).get_driver_name() == "asyncpg"
+    if DB_PGBOUNCER_MODE:
+        engine = create_async_engine(url, echo=False, poolclass=NullPool,
+                                     connect_args={"statement_cache_size": 0,
+                                                   "prepared_statement_cache_size": 0} if asyncpg_driver else {})
+        if REQUEST_METRICS_ENABLED:
+            instrument_engine(engine, name)
+        return engine
+
+    engine = create_async_engine(url, echo=False,
+                                 poolclass=InstrumentedQueuePool,
+                                 pool_size=pool_size,
+                                 max_overflow=max_overflow,
+                                 pool_timeout=DB_POOL_TIMEOUT,
+                                 pool_recycle=DB_POOL_RECYCLE,
+                                 pool_pre_ping=DB_POOL_PRE_PING,
+                                 connect_args={"prepared_statement_cache_size": DB_STATEMENT_CACHE_SIZE}
+                                 if asyncpg_driver else {})
+    engine.pool.metrics_name = name
+    pool_checkout_wait.labels(name)
+    pool_checkout_timeouts.labels(name)
+    pool_size_gauge.labels(name).set(pool_size)
+    pool_checked_out.labels(name).set_function(lambda: engine.pool.checkedout())
+    if REQUEST_METRICS_ENABLED:
+        instrument_engine(engine, name)
+    return engine
+
+
+def worker_pool_limits(workers: int, pool_size: int = DB_POOL_SIZE, max_overflow: int = DB_MAX_OVERFLOW) -> tuple:
+    # Each of `workers` processes gets an equal share of DB_MAX_CONNECTIONS, less the connections of the
+    # reconciliation job when it runs inside the application (in one process at a time); the pool and then
+    # its overflow are capped at it. A budget too small for the workers leaves one connection to each.
+    if not DB_MAX_CONNECTIONS:
+        return pool_size, max_overflow
+    reserved = JOBS_PARALLELISM + 2 if BALANCE_RECONCILIATION_INTERVAL_SECONDS > 0 else 0
+    share = (DB_MAX_CONNECTIONS - reserved) // workers
+    if share < 1:
+        logger.warning("DB_MAX_CONNECTIONS={} leaves no connections for each of {} workers, using one per worker",
+                       DB_MAX_CONNECTIONS, workers)
+        share = 1
+    pool_size = min(pool_size, share)
+    return pool_size, min(max_overflow, share - pool_size)
+
+
+# A single process (`python main.py`, uvicorn, jobs, benchmarks) uses the configured pool as is; gunicorn
+# workers resize it to their share with configure_worker_pools.
+engine = create_engine(DATABASE_URL, "primary")
+
+# ID of the authenticated user of the current request, set by security.get_current_user.
+current_user_id = ContextVar("current_user_id", default=None)
+
+# Users who wrote (or whose data was written) within the last DB_READ_YOUR_WRITES_SECONDS. Their
+# reads stay on the primary so that they never see a replica that has not caught up yet.
+recent_writes = TTLCache(maxsize=DB_READ_YOUR_WRITES_MAX_USERS, ttl=DB_READ_YOUR_WRITES_SECONDS)
+
+REPLICA_LAG_QUERY = text(
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+)
 
-engine = create_async_engine(DATABASE_URL, echo=False)
 
-async_session = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+class ReplicaRouter:
+    """
+    Выбирает реплику для чтения по кругу (`round_robin`) или с наименьшим числом занятых соединений
+    (`least_connections`). Реплики, которые недоступны или отстают больше чем на `DB_REPLICA_MAX_LAG_SECONDS`,
+    пропускаются до следующей успешной проверки.
+    """
+
+    def __init__(self, urls: list, selection: str):
+        if selection not in ("round_robin", "least_connections"):
+            raise ValueError(f"Unknown replica selection: {selection}")
+        self.selection = selection
+        self.urls = urls
+        self.healthy = {}
+        self._counter = itertools.count()
+        self.replicas = self._create_engines(DB_POOL_SIZE, DB_MAX_OVERFLOW)
+        for name, _ in self.replicas:
+            self.mark(name, True)
+            reads_routed.labels(name)
+        reads_routed.labels("primary")
+
+    def _create_engines(self, pool_size: int, max_overflow: int) -> list:
+        replicas = []
+        for number, url in enumerate(self.urls, start=1):
+            name = f"replica-{number}"
+            replica = create_engine(url, name, pool_size, max_overflow)
+            event.listen(replica.sync_engine, "handle_error", self._error_listener(name))
+            replicas.append((name, replica))
+        return replicas
+
+    def resize(self, pool_size: int, max_overflow: int):
+        # Replaces the replica engines with ones of the given pool limits, see configure_worker_pools.
+        for _, replica in self.replicas:
+            replica.sync_engine.dispose(close=False)
+        self.replicas = self._create_engines(pool_size, max_overflow)
+
+    def _error_listener(self, name: str):
+        def on_error(context):
+            # A failed connect or a dropped connection takes the replica out until the next health check.
+            if context.connection is None or context.is_disconnect:
+                self.mark(name, False)
+        return on_error
+
+    def mark(self, name: str, healthy: bool):
+        if self.healthy.get(name) != healthy and name in self.healthy:
+            logger.warning("Replica {} is now {}", name, "healthy" if healthy else "unhealthy")
+        self.healthy[name] = healthy
+        replica_healthy.labels(name).set(int(healthy))
+
+    def choose(self):
+        candidates = [(name, replica) for name, replica in self.replicas if self.healthy[name]]
+        if not candidates:
+            return None
+        if self.selection == "least_connections":
+            return min(candidates, key=lambda candidate: getattr(candidate[1].pool, "checkedout", lambda: 0)())
+        return candidates[next(self._counter) % len(candidates)]
+
+    async def check(self, name: str, replica) -> bool:
+        try:
+            async with replica.connect() as connection:
+                lag = None
+                if replica.dialect.name == "postgresql":
+                    lag = (await connection.execute(REPLICA_LAG_QUERY)).scalar()
+        except Exception as e:
+            logger.warning("Health check failed for replica {}: {}", name, e)
+            return False
+        if lag is not None and lag > DB_REPLICA_MAX_LAG_SECONDS:
+            logger.warning("Replica {} lags behind the primary by {:.1f} seconds", name, lag)
+            return False
+        return True
+
+    async def run_health_checks(self, interval: float = DB_REPLICA_HEALTH_CHECK_SECONDS):
+        while True:
+            for name, replica in self.replicas:
+                try:
+                    healthy = await asyncio.wait_for(self.check(name, replica), timeout=interval)
+                except asyncio.TimeoutError:
+                    healthy = False
+                self.mark(name, healthy)
+            await asyncio.sleep(interval)
+
+
+replica_router = ReplicaRouter(DATABASE_REPLICA_URLS, DB_REPLICA_SELECTION)
+
+
+def configure_worker_pools(workers: int):
+    # Called in every gunicorn worker right after the fork. The pools inherited from the arbiter are dropped
+    # without closing their connections, as the arbiter still owns the sockets, and replaced by pools sized
+    # to this worker's share of DB_MAX_CONNECTIONS.
+    global engine
+    pool_size, max_overflow = worker_pool_limits(workers)
+    logger.info("Worker database pools: pool size {}, max overflow {} for {} workers", pool_size, max_overflow, workers)
+    engine.sync_engine.dispose(close=False)
+    engine = create_engine(DATABASE_URL, "primary", pool_size, max_overflow)
+    async_session.configure(bind=engine)
+    replica_router.resize(pool_size, max_overflow)
+
+
+def mark_recent_write(*user_ids):
+    # Called by the CRUD write paths with the owners of the written rows; the acting user is added too.
+    for user_id in (*user_ids, current_user_id.get()):
+        if user_id is not None:
+            recent_writes.set(user_id, True)
+
+
+def read_replica(query):
+    # Marks a SELECT as safe to serve from a replica when it runs in a read-only session.
+    return query.execution_options(replica=True)
+
+
+class RoutingSession(Session):
+    """
+    Сессия, которая выполняет помеченные `read_replica` запросы в сессиях только для чтения на реплике,
+    а все остальные запросы на основной базе. Реплика выбирается один раз на сессию, поэтому все чтения
+    запроса видят один и тот же снимок.
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if (self.info.get("read_only")
+                and isinstance(clause, Select)
+                and clause.get_execution_options().get("replica")):
+            if "read_engine" not in self.info:
+                self.info["read_engine"] = self._choose_read_engine()
+            return self.info["read_engine"].sync_engine
+        return engine.sync_engine
+
+    @staticmethod
+    def _choose_read_engine():
+        user_id = current_user_id.get()
+        replica = None
+        if user_id is None or recent_writes.get(user_id) is None:
+            replica = replica_router.choose()
+        name, read_engine = replica or ("primary", engine)
+        reads_routed.labels(name).inc()
+        return read_engine
+
+
+async_session = async_sessionmaker(engine, class_=AsyncSession, sync_session_class=RoutingSession,
+                                   expire_on_commit=False)
 
 Base = declarative_base()
 
@@ -17,3 +312,10 @@ Base = declarative_base()
 async def get_session() -> AsyncSession:
     async with async_session() as session:
         yield session
+
+
+async def get_read_session() -> AsyncSession:
+    # Session for read-only endpoints: queries marked with read_replica may go to a replica.
+    async with async_session() as session:
+        session.info["read_only"] = True
+        yield session
@@ -1,5 +1,8 @@
-from pydantic import BaseModel, EmailStr, field_validator
-from typing import Optional
+from pydantic import BaseModel, ConfigDict, EmailStr, field_validator
+from datetime import datetime
+from typing import List, Optional
+
+from money import Amount, Cents
 
 
 class UserLogin(BaseModel):
@@ -13,6 +16,12 @@ class UserCreate(BaseModel):
     full_name: str
     role: str
 
+    @field_validator('role')
+    def validate_role(cls, role):
+        if role not in ['user', 'admin']:
+            raise ValueError("Role must be 'user' or 'admin'")
+        return role
+
 
 class UserUpdate(BaseModel):
     email: Optional[EmailStr] = None
@@ -33,9 +42,89 @@ class UserResponse(BaseModel):
     role: str
 
 
+class Principal(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
+    id: int
+    email: str
+    role: str
+    full_name: Optional[str] = None
+
+
+class AccountResponse(BaseModel):
+    id: int
+    balance: Cents
+    owner_id: int
+
+
+class PaymentResponse(BaseModel):
+    id: int
+    transaction_id: str
+    amount: Cents
+    account_id: int
+    created_at: datetime
+
+
+class PaymentFilters(BaseModel):
+    account_id: Optional[int] = None
+    min_amount: Optional[Amount] = None
+    max_amount: Optional[Amount] = None
+    created_from: Optional[datetime] = None
+    created_to: Optional[datetime] = None
+
+
+class PaymentSummary(BaseModel):
+    count: int
+    total_amount: Cents
+
+
+class LastPayment(BaseModel):
+    id: int
+    amount: Cents
+    created_at: datetime
+
+
+class AccountSummary(BaseModel):
+    account_id: int
+    balance: Cents
+    payment_count: int
+    last_payment: Optional[LastPayment] = None
+
+
+class UserSummary(BaseModel):
+    user_id: int
+    total_balance: Cents
+    account_count: int
+    payment_count: int
+    accounts: List[AccountSummary]
+
+
 class WebhookPayload(BaseModel):
     transaction_id: str
     user_id: int
     account_id: int
-    amount: float
+    amount: Amount
     signature: str
+
+
+class WebhookBatchItemResult(BaseModel):
+    transaction_id: str
+    status: str
+
+
+class WebhookBatchResponse(BaseModel):
+    processed: int
+    results: List[WebhookBatchItemResult]
+
+
+class BulkUserError(BaseModel):
+    index: int
+    row: int
+    email: Optional[str] = None
+    error: str
+
+
+class BulkUserResponse(BaseModel):
+    created: int
+    failed: int
+    errors: List[BulkUserError]
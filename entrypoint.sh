@@ -12,4 +12,4 @@ wait_for_db
 
 alembic upgrade head
 
-uvicorn main:app --host 0.0.0.0 --port 8000
\ No newline at end of file
+exec gunicorn -c python:serving main:app
\ No newline at end of file
@@ -0,0 +1,184 @@
+import asyncio
+import json
+from typing import NamedTuple, Optional
+
+from loguru import logger
+
+from cache import TTLCache
+from config import IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_TTL_SECONDS, IDEMPOTENCY_BACKEND_URL
+from database.schemas import WebhookPayload
+from metrics import Counter
+from money import to_units
+
+lookups_total = Counter("webhook_idempotency_lookups_total", "Webhook transaction ID lookups by where they were resolved",
+                        ("result",))
+for result in ("local_hit", "shared_hit", "in_flight", "miss"):
+    lookups_total.labels(result)
+conflicts_total = Counter("webhook_idempotency_conflicts_total",
+                          "Webhook retries rejected because the payload differs from the recorded one")
+
+
+class IdempotencyRecord(NamedTuple):
+    fingerprint: str
+    signature: str
+    status_code: int
+    detail: str
+
+
+def fingerprint(payload: WebhookPayload) -> str:
+    # The amount is written in currency units, as before amounts moved to cents, so records stored by
+    # earlier versions still match their retries.
+    return repr((payload.user_id, payload.account_id, to_units(payload.amount)))
+
+
+class IdempotencyBackend:
+    """
+    Общее для нескольких процессов хранилище ответов на вебхуки по `transaction_id`.
+    """
+
+    async def get(self, key: str) -> Optional[IdempotencyRecord]:
+        raise NotImplementedError
+
+    async def set(self, key: str, record: IdempotencyRecord):
+        raise NotImplementedError
+
+    async def delete(self, key: str):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class MemoryIdempotencyBackend(IdempotencyBackend):
+    """
+    Хранилище в памяти процесса. Заменяет общее хранилище в тестах и бенчмарках.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self._records = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    async def get(self, key: str) -> Optional[IdempotencyRecord]:
+        return self._records.get(key)
+
+    async def set(self, key: str, record: IdempotencyRecord):
+        self._records.set(key, record)
+
+    async def delete(self, key: str):
+        self._records.pop(key)
+
+
+class RedisIdempotencyBackend(IdempotencyBackend):
+    """
+    Хранилище в Redis. Требует установленного пакета `redis`.
+    """
+
+    def __init__(self, url: str, ttl: int):
+        try:
+            from redis import asyncio as redis
+        except ImportError:
+            raise RuntimeError("The redis package is required for a redis:// idempotency backend")
+        self._client = redis.from_url(url)
+        self.ttl = ttl
+
+    async def get(self, key: str) -> Optional[IdempotencyRecord]:
+        value = await self._client.get(f"webhook:{key}")
+        return None if value is None else IdempotencyRecord(*json.loads(value))
+
+    async def set(self, key: str, record: IdempotencyRecord):
+        await self._client.set(f"webhook:{key}", json.dumps(record), ex=self.ttl)
+
+    async def delete(self, key: str):
+        await self._client.delete(f"webhook:{key}")
+
+    async def close(self):
+        await self._client.aclose()
+
+
+def create_backend(url: str) -> Optional[IdempotencyBackend]:
+    if not url:
+        return None
+    if url.startswith("memory://"):
+        return MemoryIdempotencyBackend(IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_TTL_SECONDS)
+    if url.startswith(("redis://", "rediss://")):
+        return RedisIdempotencyBackend(url, IDEMPOTENCY_TTL_SECONDS)
+    raise ValueError(f"Unsupported idempotency backend: {url}")
+
+
+class WebhookIdempotency:
+    """
+    Ответы на недавно обработанные вебхуки по `transaction_id`: ограниченный LRU-кэш в памяти процесса
+    и необязательное общее хранилище. Пока вебхук с некоторым `transaction_id` обрабатывается, повторы
+    с тем же `transaction_id` ждут его результата, а не обращаются к базе.
+    """
+
+    def __init__(self, cache_size: int, ttl: float, backend: Optional[IdempotencyBackend] = None):
+        self.records = TTLCache(maxsize=cache_size, ttl=ttl)
+        self.backend = backend
+        self._in_flight = {}
+
+    async def get(self, transaction_id: str) -> Optional[IdempotencyRecord]:
+        # Resolves a transaction ID from the local cache, the shared backend or a request that is
+        # processing it right now. None means the caller should process the webhook itself.
+        record = self.records.get(transaction_id)
+        if record is not None:
+            lookups_total.labels("local_hit").inc()
+            return record
+        if self.backend is not None:
+            try:
+                record = await self.backend.get(transaction_id)
+            except Exception as e:
+                logger.warning("Idempotency backend lookup failed: {}", e)
+            if record is not None:
+                lookups_total.labels("shared_hit").inc()
+                self.records.set(transaction_id, record)
+                return record
+        pending = self._in_flight.get(transaction_id)
+        if pending is not None:
+            lookups_total.labels("in_flight").inc()
+            record = await asyncio.shield(pending)
+            if record is not None:
+                return record
+        lookups_total.labels("miss").inc()
+        return None
+
+    def start(self, transaction_id: str):
+        # Registers the caller as the one processing the transaction ID; duplicates that arrive
+        # before finish() wait for its result.
+        if transaction_id not in self._in_flight:
+            self._in_flight[transaction_id] = asyncio.get_running_loop().create_future()
+
+    def finish(self, transaction_id: str, record: Optional[IdempotencyRecord]):
+        # Wakes up waiting duplicates with the recorded response. Without one (invalid signature,
+        # errors) they process their own requests.
+        pending = self._in_flight.pop(transaction_id, None)
+        if pending is not None and not pending.done():
+            pending.set_result(record)
+
+    async def remember(self, payload: WebhookPayload, status_code: int, detail: str) -> IdempotencyRecord:
+        # Only for final outcomes: a recorded response is replayed to every retry until it expires.
+        record = IdempotencyRecord(fingerprint(payload), payload.signature, status_code, detail)
+        self.records.set(payload.transaction_id, record)
+        if self.backend is not None:
+            try:
+                await self.backend.set(payload.transaction_id, record)
+            except Exception as e:
+                logger.warning("Idempotency backend update failed: {}", e)
+        return record
+
+    async def forget(self, transaction_id: str):
+        # Called when a payment is given up on, so that the provider's retries are processed again.
+        self.records.pop(transaction_id)
+        if self.backend is not None:
+            try:
+                await self.backend.delete(transaction_id)
+            except Exception as e:
+                logger.warning("Idempotency backend delete failed: {}", e)
+
+    async def close(self):
+        if self.backend is not None:
+            await self.backend.close()
+
+
+webhook_idempotency = WebhookIdempotency(cache_size=IDEMPOTENCY_CACHE_SIZE,
+                                         ttl=IDEMPOTENCY_TTL_SECONDS,
+                                         backend=create_backend(IDEMPOTENCY_BACKEND_URL))
@@ -0,0 +1,74 @@
+"""
+Сверка балансов счетов с суммой их платежей.
+
+Баланс счета вместе с еще не свернутыми шардами горячего счета должен быть равен сумме его платежей в `payments`.
+Счета обходятся пачками по ключу: для каждой пачки суммы пересчитываются одним сгруппированным запросом
+и сравниваются с балансами. Счета без платежей с ненулевым балансом (например, с начальным балансом) сверить
+не с чем: они попадают в отчет как `unverified` и никогда не исправляются. Отчет печатается в формате JSON
+и с `--output` сохраняется в файл.
+
+Исправление возможно только по сохраненному отчету: `--repair ФАЙЛ` приводит к сумме платежей балансы только тех
+счетов из отчета, у которых сохраненный баланс и сумма платежей с тех пор не изменились, и обходит все счета
+заново. Прерванный запуск продолжается с сохраненной позиции, `--restart` начинает обход заново. Код выхода 1,
+если остались неисправленные расхождения или часть пачек не проверена.
+
+    python -m jobs.balance_reconciliation --output drift.json
+    python -m jobs.balance_reconciliation --repair drift.json --parallelism 4 --max-chunks-per-second 20
+"""
+import argparse
+import asyncio
+import json
+import sys
+
+from config import JOBS_CHUNK_SIZE, JOBS_PARALLELISM, JOBS_MAX_CHUNKS_PER_SECOND, JOBS_PAUSE_POOL_USAGE
+from database.crud import check_account_balances
+from jobs.runner import ChunkedJob
+from money import parse_amount, to_units
+
+JOB_NAME = "balance_reconciliation"
+
+balance_reconciliation = ChunkedJob(JOB_NAME, check_account_balances)
+
+
+def drift_report(report: dict) -> dict:
+    # Amounts in currency units, as everywhere in the API.
+    drift = [{**row,
+              "stored_balance": to_units(row["stored_balance"]),
+              "ledger_balance": to_units(row["ledger_balance"])} for row in report["drift"]]
+    unverified = [{**row, "stored_balance": to_units(row["stored_balance"])} for row in report["unverified"]]
+    return {**report, "drift": drift, "unverified": unverified}
+
+
+def approved_repairs(path: str) -> dict:
+    # The mismatches of a dry-run report, by account ID, with the balances in cents.
+    with open(path, encoding="utf-8") as file:
+        report = json.load(file)
+    return {row["account_id"]: (parse_amount(row["stored_balance"]), parse_amount(row["ledger_balance"]))
+            for row in report["drift"] if not row["repaired"]}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunk-size", type=int, default=JOBS_CHUNK_SIZE)
+    parser.add_argument("--parallelism", type=int, default=JOBS_PARALLELISM)
+    parser.add_argument("--max-chunks-per-second", type=float, default=JOBS_MAX_CHUNKS_PER_SECOND)
+    parser.add_argument("--output", help="сохранить отчет в файл")
+    parser.add_argument("--repair", metavar="REPORT", help="исправить расхождения из отчета проверки")
+    parser.add_argument("--restart", action="store_true", help="не продолжать с сохраненной позиции")
+    args = parser.parse_args()
+    repair = approved_repairs(args.repair) if args.repair else None
+
+    job = ChunkedJob(JOB_NAME, check_account_balances, chunk_size=args.chunk_size, parallelism=args.parallelism,
+                     max_chunks_per_second=args.max_chunks_per_second, pause_pool_usage=JOBS_PAUSE_POOL_USAGE)
+    report = drift_report(await job.run(repair=repair, resume=not (args.restart or args.repair)))
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(output)
+    print(output)
+    unrepaired = [row for row in report["drift"] if not row["repaired"]]
+    sys.exit(1 if unrepaired or report["failed_chunks"] else 0)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,214 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+from loguru import logger
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+import database.postgre_db as postgre_db
+from config import (DATABASE_URL,
+                    JOBS_CHUNK_SIZE,
+                    JOBS_PARALLELISM,
+                    JOBS_MAX_CHUNKS_PER_SECOND,
+                    JOBS_PAUSE_POOL_USAGE)
+from database.crud import get_job_checkpoint, next_account_chunk, save_job_checkpoint
+from database.postgre_db import create_engine
+from metrics import Counter, Gauge, Histogram
+
+chunks_total = Counter("job_chunks_total", "Chunks processed by background jobs", ("job", "result"))
+checked_total = Counter("job_checked_total", "Rows checked by background jobs", ("job",))
+drift_total = Counter("job_drift_total", "Mismatches found by background jobs", ("job",))
+repaired_total = Counter("job_repaired_total", "Mismatches repaired by background jobs", ("job",))
+unverified_total = Counter("job_unverified_total", "Rows background jobs had nothing to check against", ("job",))
+throttled_seconds_total = Counter("job_throttled_seconds_total", "Time background jobs waited for the rate limit "
+                                  "or for the API connection pool", ("job",))
+running = Gauge("job_running", "1 while a run of the background job is in progress", ("job",))
+checkpoint_id = Gauge("job_checkpoint_id", "End of the key range the current run has fully processed", ("job",))
+checked_per_second = Gauge("job_checked_per_second", "Rows per second checked by the current or last run", ("job",))
+chunk_seconds = Histogram("job_chunk_seconds", "Duration of one background job chunk", ("job",))
+
+# How often a job paused by a busy API pool looks at it again.
+POOL_BUSY_RETRY_SECONDS = 0.1
+# Session-level advisory lock that lets one process at a time run a job.
+TRY_LOCK = text("SELECT pg_try_advisory_lock(hashtext(:name))")
+UNLOCK = text("SELECT pg_advisory_unlock(hashtext(:name))")
+
+
+class ChunkedJob:
+    """
+    Возобновляемый обход счетов пачками по ключу.
+
+    Границы пачек по `chunk_size` счетов находятся по ключу одна за другой, а сами пачки проверяются функцией
+    `check` параллельно: не больше `parallelism` одновременно и не чаще `max_chunks_per_second` в секунду. `check`
+    возвращает число проверенных строк, расхождения и строки, которые не с чем сверить. Пока
+    в пуле соединений API занято `pause_pool_usage` его размера и больше, новые пачки не начинаются. Задание
+    работает через собственный пул, поэтому соединения API не занимает. После каждой пачки в `job_checkpoints`
+    сохраняется конец непрерывно проверенного диапазона, и прерванный или неудачный запуск продолжается с него.
+    Ход и скорость публикуются в `/metrics` с префиксом `job_`.
+    """
+
+    def __init__(self, name: str, check, chunk_size: int = JOBS_CHUNK_SIZE, parallelism: int = JOBS_PARALLELISM,
+                 max_chunks_per_second: float = JOBS_MAX_CHUNKS_PER_SECOND,
+                 pause_pool_usage: float = JOBS_PAUSE_POOL_USAGE):
+        self.name = name
+        self.check = check
+        self.chunk_size = chunk_size
+        self.parallelism = parallelism
+        self.max_chunks_per_second = max_chunks_per_second
+        self.pause_pool_usage = pause_pool_usage
+        self._next_chunk_at = 0.0
+        for result in ("ok", "failed"):
+            chunks_total.labels(name, result)
+        for metric in (checked_total, drift_total, repaired_total, unverified_total, throttled_seconds_total, running,
+                       checkpoint_id, checked_per_second, chunk_seconds):
+            metric.labels(name)
+
+    async def run(self, repair: dict = None, resume: bool = True, engine=None, exclusive: bool = False) -> dict:
+        # `repair` is passed to `check` as is: the mismatches approved for repair, None for a dry run. An
+        # exclusive run is skipped, returning None, while another process runs the job.
+        # One connection per parallel chunk plus one for chunk boundaries and checkpoints, and one for the lock.
+        own_engine = engine is None
+        if own_engine:
+            engine = create_engine(DATABASE_URL, "jobs", pool_size=self.parallelism + 1 + exclusive, max_overflow=0)
+        try:
+            async with self._lock(engine, exclusive) as locked:
+                if not locked:
+                    logger.info("Job {} is running in another process, skipping this run", self.name)
+                    return None
+                running.labels(self.name).set(1)
+                try:
+                    return await self._run(async_sessionmaker(engine, expire_on_commit=False), repair, resume)
+                finally:
+                    running.labels(self.name).set(0)
+        finally:
+            if own_engine:
+                await engine.dispose()
+
+    async def run_every(self, interval: float):
+        # Periodic dry runs inside the application; cancelled on shutdown, the checkpoint lets the next run resume.
+        # Every worker process schedules them, but only one at a time runs. Repairs need a reviewed report and
+        # are only made from the command line.
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.run(exclusive=True)
+            except Exception as e:
+                logger.error("Job {} failed: {}", self.name, e)
+
+    @asynccontextmanager
+    async def _lock(self, engine, exclusive: bool):
+        # Held on a connection of its own for the whole run; Postgres releases it if the process dies.
+        # Other databases have no advisory locks, every run goes ahead there.
+        if not exclusive or engine.dialect.name != "postgresql":
+            yield True
+            return
+        async with engine.connect() as connection:
+            connection = await connection.execution_options(isolation_level="AUTOCOMMIT")
+            locked = (await connection.execute(TRY_LOCK, {"name": self.name})).scalar()
+            try:
+                yield locked
+            finally:
+                if locked:
+                    await connection.execute(UNLOCK, {"name": self.name})
+
+    def api_pool_busy(self) -> bool:
+        pool = postgre_db.engine.pool
+        # NullPool, used in PgBouncer mode, has no size to compare with.
+        if self.pause_pool_usage <= 0 or not hasattr(pool, "size"):
+            return False
+        return pool.checkedout() >= self.pause_pool_usage * pool.size()
+
+    async def _throttle(self):
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        if self.max_chunks_per_second > 0:
+            delay = self._next_chunk_at - started
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._next_chunk_at = max(loop.time(), self._next_chunk_at) + 1 / self.max_chunks_per_second
+        while self.api_pool_busy():
+            await asyncio.sleep(POOL_BUSY_RETRY_SECONDS)
+        throttled_seconds_total.labels(self.name).inc(loop.time() - started)
+
+    async def _check_chunk(self, session_factory, chunk: dict, repair: dict, report: dict):
+        started = time.perf_counter()
+        try:
+            async with session_factory() as session:
+                checked, drift, unverified = await self.check(session, chunk["after_id"], chunk["last_id"], repair)
+        except Exception as e:
+            chunk["state"] = "failed"
+            chunks_total.labels(self.name, "failed").inc()
+            logger.error("Job {} failed on chunk ({}, {}]: {}", self.name, chunk["after_id"], chunk["last_id"], e)
+            return
+        chunk["state"] = "done"
+        chunk_seconds.labels(self.name).observe(time.perf_counter() - started)
+        chunks_total.labels(self.name, "ok").inc()
+        checked_total.labels(self.name).inc(checked)
+        report["checked"] += checked
+        if drift:
+            repaired = sum(row["repaired"] for row in drift)
+            logger.warning("Job {} found {} mismatches in chunk ({}, {}], repaired {}",
+                           self.name, len(drift), chunk["after_id"], chunk["last_id"], repaired)
+            drift_total.labels(self.name).inc(len(drift))
+            repaired_total.labels(self.name).inc(repaired)
+            report["repaired"] += repaired
+            report["drift"] += drift
+        if unverified:
+            unverified_total.labels(self.name).inc(len(unverified))
+            report["unverified"] += unverified
+
+    async def _run(self, session_factory, repair: dict, resume: bool) -> dict:
+        started = time.perf_counter()
+        async with session_factory() as control:
+            after_id = (await get_job_checkpoint(control, self.name) if resume else None) or 0
+            logger.info("Starting job {} after ID: {}", self.name, after_id)
+            report = {"job": self.name, "started_after_id": after_id, "repaired": 0,
+                      "checked": 0, "chunks": 0, "failed_chunks": 0, "drift": [], "unverified": []}
+            chunks = deque()
+            in_flight = set()
+            checkpoint = after_id
+            exhausted = False
+            while True:
+                while len(in_flight) < self.parallelism and not exhausted:
+                    await self._throttle()
+                    last_id = await next_account_chunk(control, after_id, self.chunk_size)
+                    if last_id is None:
+                        exhausted = True
+                        break
+                    chunk = {"after_id": after_id, "last_id": last_id, "state": "running"}
+                    chunks.append(chunk)
+                    in_flight.add(asyncio.create_task(self._check_chunk(session_factory, chunk, repair, report)))
+                    after_id = last_id
+                if not in_flight:
+                    break
+                _, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+
+                # Chunks finish out of order; the checkpoint only moves over a contiguous run of done chunks.
+                moved = False
+                while chunks and chunks[0]["state"] != "running":
+                    chunk = chunks.popleft()
+                    report["chunks"] += 1
+                    if chunk["state"] == "failed":
+                        # Later chunks still run, but the next run resumes from the failed one.
+                        report["failed_chunks"] += 1
+                        continue
+                    if not report["failed_chunks"]:
+                        checkpoint = chunk["last_id"]
+                        moved = True
+                if moved:
+                    checkpoint_id.labels(self.name).set(checkpoint)
+                    await save_job_checkpoint(control, self.name, checkpoint)
+                elapsed = time.perf_counter() - started
+                checked_per_second.labels(self.name).set(report["checked"] / elapsed if elapsed else 0)
+
+            # A complete run clears the checkpoint, so that the next one starts from the beginning.
+            await save_job_checkpoint(control, self.name, checkpoint if report["failed_chunks"] else None)
+
+        report["seconds"] = round(time.perf_counter() - started, 3)
+        report["checked_per_second"] = round(report["checked"] / report["seconds"], 1) if report["seconds"] else 0
+        logger.info("Job {} finished: {} checked, {} mismatches, {} repaired, {} unverified, {} failed chunks in {} s",
+                    self.name, report["checked"], len(report["drift"]), report["repaired"], len(report["unverified"]),
+                    report["failed_chunks"], report["seconds"])
+        return report
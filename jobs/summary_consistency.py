@@ -0,0 +1,54 @@
+"""
+Сверка агрегатов `account_stats` с таблицей платежей.
+
+Счета обходятся по возрастанию ID пачками по `--chunk-size`. Для каждой пачки агрегаты пересчитываются
+из `payments` и сравниваются с сохраненными в `account_stats` вместе с еще не свернутыми шардами горячих
+счетов, одним запросом. Расхождения печатаются в формате JSON, а с флагом `--repair` строки `account_stats`
+счетов, которые расходятся и после блокировки счетов, пересобираются из платежей за вычетом шардов.
+Код выхода 1, если расхождения найдены и не исправлены.
+
+    python -m jobs.summary_consistency
+    python -m jobs.summary_consistency --repair
+"""
+import argparse
+import asyncio
+import json
+import sys
+
+from loguru import logger
+
+from database.crud import check_account_stats
+from database.postgre_db import async_session
+
+
+async def run(chunk_size: int, repair: bool) -> dict:
+    after_id = 0
+    checked_chunks = 0
+    drift = []
+    async with async_session() as session:
+        while True:
+            last_id, chunk_drift = await check_account_stats(session, after_id, chunk_size, repair)
+            if last_id is None:
+                break
+            drift += chunk_drift
+            checked_chunks += 1
+            after_id = last_id
+            # Keep the snapshot short: every chunk runs in its own transaction.
+            await session.commit()
+    logger.info("Account stats check finished: {} drifted accounts in {} chunks", len(drift), checked_chunks)
+    return {"checked_chunks": checked_chunks, "repaired": repair, "drift": drift}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--repair", action="store_true")
+    args = parser.parse_args()
+
+    report = await run(args.chunk_size, args.repair)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    sys.exit(1 if report["drift"] and not args.repair else 0)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,68 @@
+"""
+Повторная запись платежей из `webhook_dead_letters`.
+
+Очередь вебхуков откладывает в эту таблицу платежи, которые уже подтверждены ответом `202`, но не были записаны,
+например платежи на счет несуществующего пользователя. После устранения причины задание повторяет запись
+пачками по `--chunk-size`: записанные платежи и уже обработанные транзакции удаляются из таблицы, у остальных
+обновляется ошибка. Без `--replay` таблица только выводится. Отчет печатается в формате JSON.
+Код выхода 1, если в таблице остались платежи.
+
+    python -m jobs.webhook_dead_letters
+    python -m jobs.webhook_dead_letters --replay
+"""
+import argparse
+import asyncio
+import json
+import sys
+
+from loguru import logger
+
+from database.crud import get_webhook_dead_letters, create_webhook_dead_letters, delete_webhook_dead_letters
+from database.postgre_db import async_session
+from money import to_units
+from webhook_queue import write_payments
+
+
+async def run(chunk_size: int, replay: bool) -> dict:
+    after_id = 0
+    replayed = []
+    remaining = []
+    while True:
+        async with async_session() as session:
+            rows = await get_webhook_dead_letters(session, after_id, chunk_size)
+        if not rows:
+            break
+        after_id = rows[-1].id
+        payments = [{"transaction_id": row.transaction_id, "user_id": row.user_id,
+                     "account_id": row.account_id, "amount": row.amount} for row in rows]
+        if not replay:
+            remaining += [{**payment, "error": row.error} for payment, row in zip(payments, rows)]
+            continue
+        _, failed = await write_payments(payments, retries=1, backoff=0)
+        async with async_session() as session:
+            # Inserted now or by an earlier delivery of the same transaction: either way it is done.
+            await delete_webhook_dead_letters(session, [payment["transaction_id"] for payment in payments
+                                                        if payment["transaction_id"] not in failed])
+            failed_payments = [payment for payment in payments if payment["transaction_id"] in failed]
+            if failed_payments:
+                await create_webhook_dead_letters(session, failed_payments, failed)
+        replayed += [payment["transaction_id"] for payment in payments if payment["transaction_id"] not in failed]
+        remaining += [{**payment, "error": failed[payment["transaction_id"]]} for payment in failed_payments]
+    logger.info("Webhook dead letters: {} replayed, {} remaining", len(replayed), len(remaining))
+    return {"replayed": replayed,
+            "remaining": [{**payment, "amount": to_units(payment["amount"])} for payment in remaining]}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunk-size", type=int, default=500)
+    parser.add_argument("--replay", action="store_true")
+    args = parser.parse_args()
+
+    report = await run(args.chunk_size, args.replay)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    sys.exit(1 if report["remaining"] else 0)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,112 @@
+import json
+import random
+import sys
+import time
+import traceback
+
+from loguru import logger
+
+from config import LOG_LEVEL, LOG_LEVELS, LOG_JSON, LOG_ENQUEUE, LOG_SAMPLE_RATE, LOG_RATE_LIMIT_PER_SECOND
+from metrics import Counter
+
+log_records_dropped = Counter("log_records_dropped_total", "Log records dropped by sampling or rate limiting",
+                              ("reason",))
+log_records_dropped.labels("sampled")
+log_records_dropped.labels("rate_limited")
+
+TEXT_FORMAT = ("<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | <level>{level: <8}</level> | "
+               "<cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>\n{exception}")
+
+
+def parse_levels(levels: str) -> dict:
+    overrides = {}
+    for item in levels.split(","):
+        if item.strip():
+            module, _, level = item.partition("=")
+            overrides[module.strip()] = logger.level(level.strip().upper()).no
+    return overrides
+
+
+class LogFilter:
+    """
+    Фильтр записей лога: уровень по самому длинному совпадающему префиксу имени модуля, затем для записей
+    уровня INFO и ниже - выборка доли `sample_rate` и ограничение `rate_limit` записей в секунду на модуль.
+    Предупреждения и ошибки не отбрасываются.
+    """
+
+    def __init__(self, default_level: int, overrides: dict, sample_rate: float, rate_limit: float):
+        self.default_level = default_level
+        self.overrides = overrides
+        self.sample_rate = sample_rate
+        self.rate_limit = rate_limit
+        self.warning_level = logger.level("WARNING").no
+        self._levels = {}
+        self._buckets = {}
+
+    def level_for(self, name: str) -> int:
+        level = self._levels.get(name)
+        if level is None:
+            level = self.default_level
+            matched = -1
+            for module, module_level in self.overrides.items():
+                if (name == module or name.startswith(module + ".")) and len(module) > matched:
+                    level, matched = module_level, len(module)
+            self._levels[name] = level
+        return level
+
+    def __call__(self, record) -> bool:
+        level = record["level"].no
+        if level < self.level_for(record["name"]):
+            return False
+        if level >= self.warning_level:
+            return True
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            log_records_dropped.labels("sampled").inc()
+            return False
+        if self.rate_limit > 0 and not self._take_token(record["name"]):
+            log_records_dropped.labels("rate_limited").inc()
+            return False
+        return True
+
+    def _take_token(self, name: str) -> bool:
+        # Token bucket per module, refilled at rate_limit tokens per second up to one second of burst.
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.get(name, (self.rate_limit, now))
+        tokens = min(self.rate_limit, tokens + (now - updated_at) * self.rate_limit)
+        if tokens < 1:
+            self._buckets[name] = (tokens, now)
+            return False
+        self._buckets[name] = (tokens - 1, now)
+        return True
+
+
+def json_format(record) -> str:
+    entry = {"time": record["time"].isoformat(),
+             "level": record["level"].name,
+             "module": record["name"],
+             "function": record["function"],
+             "line": record["line"],
+             "message": record["message"]}
+    entry.update((key, value) for key, value in record["extra"].items() if key != "json")
+    if record["exception"] is not None:
+        entry["exception"] = "".join(traceback.format_exception(*record["exception"]))
+    record["extra"]["json"] = json.dumps(entry, ensure_ascii=False, default=str)
+    return "{extra[json]}\n"
+
+
+def setup_logging(sink=sys.stderr, level: str = LOG_LEVEL, levels: str = LOG_LEVELS, serialize: bool = LOG_JSON,
+                  enqueue: bool = LOG_ENQUEUE, sample_rate: float = LOG_SAMPLE_RATE,
+                  rate_limit: float = LOG_RATE_LIMIT_PER_SECOND):
+    # Replaces loguru's default synchronous stderr handler. The handler level is the lowest configured
+    # level, so calls below every configured level return before a record is built; with lazy
+    # "{}" arguments their messages are never formatted.
+    default_level = logger.level(level.upper()).no
+    overrides = parse_levels(levels)
+    logger.remove()
+    return logger.add(sink,
+                      level=min([default_level, *overrides.values()]),
+                      format=json_format if serialize else TEXT_FORMAT,
+                      filter=LogFilter(default_level, overrides, sample_rate, rate_limit),
+                      enqueue=enqueue,
+                      backtrace=False,
+                      diagnose=False)
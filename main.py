@@ -1,11 +1,35 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager, suppress
+
 from fastapi import FastAPI
 from fastapi.responses import RedirectResponse
+from loguru import logger
 
+from balance_compaction import balance_compactor
+from config import (WEBHOOK_QUEUE_ENABLED,
+                    REQUEST_METRICS_ENABLED,
+                    HOT_ACCOUNT_IDS,
+                    BALANCE_RECONCILIATION_INTERVAL_SECONDS,
+                    SERVER_HOST,
+                    SERVER_PORT,
+                    SERVER_LOOP,
+                    SERVER_HTTP)
+from database.postgre_db import replica_router
+from idempotency import webhook_idempotency
+from jobs.balance_reconciliation import balance_reconciliation
+from json_response import FastJSONResponse
+from logging_config import setup_logging
+from request_metrics import RequestMetricsMiddleware
 from routers.admin import router as admin_router
 from routers.auth import router as auth_router
 from routers.login import router as login_router
+from routers.metrics import router as metrics_router
 from routers.user import router as users_router
 from routers.webhook import router as webhook_router
+from webhook_queue import webhook_queue
+
+setup_logging()
 
 description = """
 Добро пожаловать в API аутентификации и управления пользователями на FastAPI!
@@ -22,10 +46,37 @@ description = """
 
 """
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    logger.info("Worker {} started with the {} event loop", os.getpid(), type(asyncio.get_running_loop()).__module__)
+    if WEBHOOK_QUEUE_ENABLED:
+        await webhook_queue.start()
+    if HOT_ACCOUNT_IDS:
+        await balance_compactor.start()
+    health_checks = asyncio.create_task(replica_router.run_health_checks()) if replica_router.replicas else None
+    reconciliation = (asyncio.create_task(balance_reconciliation.run_every(BALANCE_RECONCILIATION_INTERVAL_SECONDS))
+                      if BALANCE_RECONCILIATION_INTERVAL_SECONDS > 0 else None)
+    yield
+    for task in (health_checks, reconciliation):
+        if task is not None:
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
+    await webhook_queue.stop()
+    # After the queue, so that its last flush of hot account payments is folded too.
+    await balance_compactor.stop()
+    await webhook_idempotency.close()
+    # Drain the enqueued log sink before the process exits.
+    await logger.complete()
+
+
 app = FastAPI(
     title="API аутентификации и управления пользователями на FastAPI",
     description=description,
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse
 )
 
 app.include_router(auth_router, tags=["Аутентификация"])
@@ -33,6 +84,10 @@ app.include_router(login_router, tags=["Вход"])
 app.include_router(admin_router, tags=["Администратор"])
 app.include_router(users_router, tags=["Пользователи"])
 app.include_router(webhook_router, tags=["Вебхуки"])
+app.include_router(metrics_router, tags=["Метрики"])
+
+if REQUEST_METRICS_ENABLED:
+    app.add_middleware(RequestMetricsMiddleware, router=app.router)
 
 
 @app.get("/", include_in_schema=False)
@@ -46,4 +101,5 @@ async def root():
 if __name__ == "__main__":
     import uvicorn
 
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # A single process, e.g. for local runs; in production the application is served by gunicorn, see serving.py.
+    uvicorn.run(app, host=SERVER_HOST, port=SERVER_PORT, loop=SERVER_LOOP, http=SERVER_HTTP)
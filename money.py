@@ -0,0 +1,54 @@
+from decimal import Decimal, InvalidOperation
+from typing import Annotated
+
+from pydantic import AfterValidator, BeforeValidator, PlainSerializer, WithJsonSchema
+
+CENTS = 100
+
+
+class Money(int):
+    """
+    Денежная сумма в копейках (минимальных единицах валюты). Хранится в базе как BIGINT, поэтому суммы и
+    агрегаты точны и считаются целочисленной арифметикой. В JSON выводится десятичным числом в рублях.
+    """
+
+    __slots__ = ()
+
+    def __str__(self):
+        units, cents = divmod(abs(self), CENTS)
+        return f"{'-' if self < 0 else ''}{units}.{cents:02d}"
+
+
+def parse_amount(value) -> Money:
+    # Decimal amounts from clients: numbers or strings with at most two decimal places. Finer amounts
+    # are rejected rather than rounded. A float is read through its shortest repr, i.e. as it was written in JSON.
+    if isinstance(value, Money):
+        return value
+    if isinstance(value, bool):
+        raise ValueError("Amount must be a number")
+    if isinstance(value, int):
+        return Money(value * CENTS)
+    try:
+        amount = Decimal(repr(value)) if isinstance(value, float) else Decimal(value)
+    except (InvalidOperation, TypeError, ValueError):
+        raise ValueError(f"Invalid amount: {value!r}")
+    if not amount.is_finite():
+        raise ValueError("Amount must be finite")
+    cents = amount * CENTS
+    if cents != cents.to_integral_value():
+        raise ValueError("Amount must not have more than two decimal places")
+    return Money(cents)
+
+
+def to_units(cents: int) -> float:
+    # Exact below 10**15 cents: the float's shortest repr is then the decimal amount itself.
+    return cents / CENTS
+
+
+_json_schema = WithJsonSchema({"type": "number"})
+_serializer = PlainSerializer(to_units, return_type=float)
+
+# Amounts received from clients, in currency units (e.g. 123.45).
+Amount = Annotated[int, BeforeValidator(parse_amount), AfterValidator(Money), _serializer, _json_schema]
+# Amounts that are already in cents, e.g. read from the database, rendered in currency units.
+Cents = Annotated[int, AfterValidator(Money), _serializer, _json_schema]
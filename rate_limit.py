@@ -0,0 +1,179 @@
+import math
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+from fastapi import Depends, HTTPException, Request, status
+from loguru import logger
+
+from config import (RATE_LIMIT_ENABLED,
+                    RATE_LIMITS,
+                    ROUTE_MAX_IN_FLIGHT,
+                    RATE_LIMIT_BACKEND_URL,
+                    RATE_LIMIT_MAX_KEYS)
+from database.schemas import WebhookPayload
+from metrics import Counter, Gauge
+from security import get_current_user, Principal
+
+decisions_total = Counter("rate_limit_decisions_total", "Requests of limited route groups by admission decision",
+                          ("route", "result"))
+in_flight_requests = Gauge("route_in_flight_requests", "Requests of a limited route group being processed",
+                           ("route",))
+
+# Retry-After for requests shed by the in-flight cap.
+OVERLOADED_RETRY_AFTER_SECONDS = 1
+
+
+class Limit(NamedTuple):
+    rate: float
+    burst: float
+
+
+def parse_limits(value: str) -> dict:
+    # "login=10/1/20,webhook=500/1": requests per seconds and an optional burst, which defaults to requests.
+    limits = {}
+    for item in filter(None, (item.strip() for item in value.split(","))):
+        route, spec = item.split("=")
+        requests, seconds, *burst = spec.split("/")
+        limits[route.strip()] = Limit(rate=float(requests) / float(seconds),
+                                      burst=float(burst[0]) if burst else float(requests))
+    return limits
+
+
+def parse_caps(value: str) -> dict:
+    caps = {}
+    for item in filter(None, (item.strip() for item in value.split(","))):
+        route, cap = item.split("=")
+        caps[route.strip()] = int(cap)
+    return caps
+
+
+class TokenBucketStore:
+    """
+    Хранилище корзин токенов по ключам.
+    """
+
+    # Whether all processes take tokens from the same buckets.
+    shared = False
+
+    async def take(self, key: str, limit: Limit) -> float:
+        # Takes a token from the bucket of the key. Returns 0 when there was one, otherwise the seconds
+        # until the next token.
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class MemoryTokenBucketStore(TokenBucketStore):
+    """
+    Корзины в памяти процесса: не больше `max_keys` ключей, давно не использованные вытесняются. Вытесненный
+    ключ снова получает полную корзину, поэтому `max_keys` должен покрывать активных клиентов.
+    """
+
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+
+    async def take(self, key: str, limit: Limit) -> float:
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            tokens = limit.burst
+        else:
+            tokens = min(limit.burst, bucket[0] + (now - bucket[1]) * limit.rate)
+            self._buckets.move_to_end(key)
+        if tokens >= 1:
+            self._buckets[key] = (tokens - 1, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return 0.0
+        self._buckets[key] = (tokens, now)
+        return (1 - tokens) / limit.rate
+
+
+def create_store(url: str) -> TokenBucketStore:
+    if url.startswith("memory://"):
+        return MemoryTokenBucketStore(RATE_LIMIT_MAX_KEYS)
+    raise ValueError(f"Unsupported rate limit backend: {url}")
+
+
+class AdmissionControl:
+    """
+    Допуск запросов по группам маршрутов. Сначала запрос берет токен из корзины своего ключа (`429` с заголовком
+    `Retry-After`, если токенов нет), затем занимает место среди одновременно обрабатываемых запросов группы
+    (`503`, если все места заняты). Обе проверки выполняются за O(1) до обращения к базе.
+    """
+
+    def __init__(self, limits: dict, caps: dict, store: TokenBucketStore, enabled: bool = True):
+        self.limits = limits
+        self.caps = caps
+        self.store = store
+        self.enabled = enabled
+        self._in_flight = {}
+        for route in set(limits) | set(caps):
+            for result in ("allowed", "rate_limited", "overloaded"):
+                decisions_total.labels(route, result)
+            self._in_flight[route] = 0
+            in_flight_requests.labels(route).set_function(lambda route=route: self._in_flight[route])
+
+    async def admit(self, route: str, key):
+        limit = self.limits.get(route)
+        if limit is not None:
+            retry_after = await self.store.take(f"{route}:{key}", limit)
+            if retry_after:
+                decisions_total.labels(route, "rate_limited").inc()
+                raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Too many requests",
+                                    headers={"Retry-After": str(math.ceil(retry_after))})
+        cap = self.caps.get(route)
+        if cap is not None and self._in_flight[route] >= cap:
+            decisions_total.labels(route, "overloaded").inc()
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Server is busy",
+                                headers={"Retry-After": str(OVERLOADED_RETRY_AFTER_SECONDS)})
+        decisions_total.labels(route, "allowed").inc()
+
+    def split(self, workers: int):
+        # Called in every gunicorn worker right after the fork. Buckets of a per-process store are not shared,
+        # so each of `workers` processes gets an equal share of the rate and the burst of every limit, the
+        # burst being one request at least.
+        if self.store.shared or workers <= 1:
+            return
+        self.limits = {route: Limit(rate=limit.rate / workers, burst=max(1.0, limit.burst / workers))
+                       for route, limit in self.limits.items()}
+        logger.info("Worker rate limits: {} for {} workers",
+                    ", ".join(f"{route}={limit.rate:g}/1/{limit.burst:g}" for route, limit in self.limits.items()),
+                    workers)
+
+    def limit(self, route: str, key):
+        # Route dependency: `key` is a dependency returning the bucket key. The in-flight slot is held until
+        # the endpoint returns.
+        async def dependency(key_value=Depends(key)):
+            if not self.enabled:
+                yield
+                return
+            await self.admit(route, key_value)
+            if route in self._in_flight:
+                self._in_flight[route] += 1
+            try:
+                yield
+            finally:
+                if route in self._in_flight:
+                    self._in_flight[route] -= 1
+
+        return Depends(dependency)
+
+
+async def client_ip(request: Request) -> str:
+    return request.client.host if request.client is not None else "unknown"
+
+
+async def authenticated_user_id(current_user: Principal = Depends(get_current_user)) -> int:
+    return current_user.id
+
+
+async def webhook_user_id(payload: WebhookPayload) -> int:
+    return payload.user_id
+
+
+admission_control = AdmissionControl(parse_limits(RATE_LIMITS), parse_caps(ROUTE_MAX_IN_FLIGHT),
+                                     create_store(RATE_LIMIT_BACKEND_URL), enabled=RATE_LIMIT_ENABLED)
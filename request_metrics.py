@@ -0,0 +1,120 @@
+import time
+
+from starlette.routing import Route
+
+from database.postgre_db import QueryStats, request_queries
+from metrics import Counter, Gauge, Histogram
+
+request_seconds = Histogram("http_request_duration_seconds", "HTTP request latency by route",
+                            ("method", "route"))
+requests_in_flight = Gauge("http_requests_in_flight", "HTTP requests currently being served", ("method", "route"))
+responses_total = Counter("http_responses_total", "HTTP responses by route and status code",
+                          ("method", "route", "status"))
+request_queries_histogram = Histogram("http_request_db_queries", "Database statements executed per HTTP request",
+                                      ("method", "route"), buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50, 100))
+request_db_seconds = Histogram("http_request_db_seconds", "Time spent in database statements per HTTP request",
+                               ("method", "route"))
+
+UNMATCHED_ROUTE = "unmatched"
+KNOWN_METHODS = ("GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS")
+# Resolved request paths remembered per method; the cache is reset when it fills up.
+PATH_CACHE_SIZE = 4096
+
+
+class RouteMetrics:
+    __slots__ = ("method", "route", "duration", "in_flight", "queries", "db_seconds", "responses")
+
+    def __init__(self, method: str, route: str):
+        self.method = method
+        self.route = route
+        self.duration = request_seconds.labels(method, route)
+        self.in_flight = requests_in_flight.labels(method, route)
+        self.queries = request_queries_histogram.labels(method, route)
+        self.db_seconds = request_db_seconds.labels(method, route)
+        self.responses = {}
+
+    def response(self, status: int):
+        counter = self.responses.get(status)
+        if counter is None:
+            counter = self.responses[status] = responses_total.labels(self.method, self.route, str(status))
+        return counter
+
+
+class RequestMetricsMiddleware:
+    """
+    ASGI-мидлварь, которая публикует для каждого маршрута время ответа, число запросов в обработке,
+    число ответов по кодам статуса, а также число запросов к базе и время в них за один HTTP-запрос.
+
+    Маршрут определяется по шаблону пути (`/users/{user_id}`), а не по фактическому пути, поэтому число
+    наборов меток ограничено. Наборы меток маршрута и кода статуса создаются при первом таком ответе,
+    а на каждый следующий запрос приходятся только поиск маршрута в кэше путей и увеличение счетчиков.
+    """
+
+    def __init__(self, app, router):
+        self.app = app
+        self.router = router
+        self._build()
+
+    def _build(self):
+        routes = {method: [] for method in KNOWN_METHODS}
+        for route in self.router.routes:
+            if isinstance(route, Route) and route.methods:
+                for method in route.methods:
+                    routes.setdefault(method, []).append((route.path_regex, route.path))
+        self._routes = routes
+        self._paths = {method: {} for method in routes}
+        self._metrics = {}
+
+    def _route_metrics(self, method: str, route: str) -> RouteMetrics:
+        # Label sets appear on the first request to a route, so /metrics only lists routes that were called.
+        route_metrics = self._metrics.get((method, route))
+        if route_metrics is None:
+            route_metrics = self._metrics[method, route] = RouteMetrics(method, route)
+        return route_metrics
+
+    def _match(self, scope) -> RouteMetrics:
+        method = scope["method"]
+        paths = self._paths.get(method)
+        if paths is None:
+            return self._route_metrics("OTHER", UNMATCHED_ROUTE)
+        path = scope["path"]
+        route_metrics = paths.get(path)
+        if route_metrics is None:
+            route = UNMATCHED_ROUTE
+            for path_regex, route_path in self._routes[method]:
+                if path_regex.match(path):
+                    route = route_path
+                    break
+            route_metrics = self._route_metrics(method, route)
+            if len(paths) >= PATH_CACHE_SIZE:
+                paths.clear()
+            paths[path] = route_metrics
+        return route_metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        route_metrics = self._match(scope)
+        stats = QueryStats()
+        token = request_queries.set(stats)
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        route_metrics.in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route_metrics.duration.observe(time.perf_counter() - started)
+            route_metrics.in_flight.dec()
+            route_metrics.response(status_code).inc()
+            route_metrics.queries.observe(stats.count)
+            route_metrics.db_seconds.observe(stats.seconds)
+            request_queries.reset(token)
@@ -0,0 +1,95 @@
+import hashlib
+import itertools
+from typing import NamedTuple
+
+from fastapi import Request, Response
+
+from cache import TTLCache
+from config import RESPONSE_CACHE_MAX_SIZE, RESPONSE_CACHE_TTL_SECONDS
+from metrics import Counter
+
+cache_lookups_total = Counter("http_response_cache_lookups_total", "User response cache lookups by result",
+                              ("result",))
+for result in ("hit", "miss"):
+    cache_lookups_total.labels(result)
+not_modified_total = Counter("http_not_modified_total", "Responses answered with 304 Not Modified")
+
+CACHE_CONTROL = "private, no-cache"
+
+
+class CachedResponse(NamedTuple):
+    etag: str
+    body: bytes
+
+
+def make_etag(body: bytes) -> str:
+    # A strong validator derived from the body, so it is the same in every process for the same data.
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    # If-None-Match uses the weak comparison, so a W/ prefix on the client's tag is ignored.
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+class UserVersions:
+    """
+    Счетчики версий данных пользователей. Запись в `database.crud` сбрасывает версию пользователя, и при
+    следующем чтении он получает новое значение из общего для процесса счетчика, поэтому версии не повторяются.
+    Версия также сменяется через `ttl` секунд, что ограничивает устаревание после записи в другом процессе.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self._versions = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._counter = itertools.count(1)
+
+    def get(self, user_id: int) -> int:
+        version = self._versions.get(user_id)
+        if version is None:
+            version = next(self._counter)
+            self._versions.set(user_id, version)
+        return version
+
+    def bump(self, *user_ids):
+        for user_id in user_ids:
+            self._versions.pop(user_id)
+
+
+class ResponseCache:
+    """
+    Ограниченный LRU-кэш JSON-ответов по ключу (пользователь, маршрут, версия данных пользователя).
+
+    Ответ содержит ETag, вычисленный по телу. Если он совпадает с `If-None-Match`, возвращается 304, и при
+    попадании в кэш запросов к базе не выполняется вовсе.
+    """
+
+    def __init__(self, versions: UserVersions, maxsize: int, ttl: float):
+        self.versions = versions
+        self._responses = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    async def respond(self, request: Request, user_id: int, render) -> Response:
+        # render is an async callable that builds the JSON body; it only runs on a cache miss. The version
+        # is read before it runs, so a write that lands meanwhile leaves the entry under a version no one asks for.
+        key = (user_id, request.scope["route"].path, self.versions.get(user_id))
+        cached = self._responses.get(key)
+        if cached is not None:
+            cache_lookups_total.labels("hit").inc()
+        else:
+            cache_lookups_total.labels("miss").inc()
+            body = await render()
+            cached = CachedResponse(make_etag(body), body)
+            self._responses.set(key, cached)
+        headers = {"ETag": cached.etag, "Cache-Control": CACHE_CONTROL}
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None and etag_matches(if_none_match, cached.etag):
+            not_modified_total.inc()
+            return Response(status_code=304, headers=headers)
+        return Response(cached.body, media_type="application/json", headers=headers)
+
+
+user_versions = UserVersions(maxsize=RESPONSE_CACHE_MAX_SIZE, ttl=RESPONSE_CACHE_TTL_SECONDS)
+response_cache = ResponseCache(user_versions, maxsize=RESPONSE_CACHE_MAX_SIZE, ttl=RESPONSE_CACHE_TTL_SECONDS)
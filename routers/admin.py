@@ -1,33 +1,83 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from operator import itemgetter
+from typing import List
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.responses import StreamingResponse
 from loguru import logger
+from pydantic import ValidationError
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from bulk_import import (iter_records,
+                         BulkImportError,
+                         JSON_CONTENT_TYPE,
+                         NDJSON_CONTENT_TYPE,
+                         CSV_CONTENT_TYPE)
+from config import (USERS_BULK_CHUNK_SIZE,
+                    USERS_BULK_MAX_ERRORS,
+                    USERS_PAGE_DEFAULT_LIMIT,
+                    USERS_PAGE_MAX_LIMIT,
+                    USERS_STREAM_BATCH_SIZE)
 from database.crud import (get_user_by_id,
                            create_user,
+                           create_users,
                            update_user,
                            delete_user,
                            get_user_accounts,
-                           get_all_users)
+                           get_all_users,
+                           stream_all_users,
+                           get_user_summary)
 from database.models import User
-from database.postgre_db import get_session
-from database.schemas import UserCreate, UserUpdate, UserResponse
+from database.postgre_db import get_session, get_read_session, async_session
+from database.schemas import (UserCreate,
+                              UserUpdate,
+                              UserResponse,
+                              Principal,
+                              BulkUserResponse,
+                              UserSummary,
+                              AccountResponse)
+from json_response import dumps, rows_response
+from rate_limit import admission_control, authenticated_user_id
 from security import get_current_user
 
-router = APIRouter()
+router = APIRouter(dependencies=[admission_control.limit("admin", authenticated_user_id)])
+
 
+async def stream_users_ndjson(after_id: int):
+    # The request session is closed before a streaming body is sent, so the stream owns its session.
+    async with async_session() as session:
+        session.info["read_only"] = True
+        async for users in stream_all_users(session, after_id, USERS_STREAM_BATCH_SIZE):
+            yield b"".join(dumps(user._asdict()) + b"\n" for user in users)
 
-@router.get("/users/all", description="""
+
+@router.get("/users/all", response_model=List[UserResponse], description=f"""
 Получить список всех пользователей. Доступно только администраторам.
+
+- **after_id**: Вернуть пользователей с ID больше указанного (по умолчанию с начала списка).
+- **limit**: Размер страницы, от 1 до {USERS_PAGE_MAX_LIMIT} (по умолчанию {USERS_PAGE_DEFAULT_LIMIT}).
+
+Пользователи упорядочены по ID. Если страница заполнена полностью, заголовок `X-Next-After-Id` содержит значение
+`after_id` для следующей страницы.
+
+С заголовком `Accept: application/x-ndjson` все пользователи после `after_id` передаются потоком, по одному
+JSON-объекту на строку, без ограничения `limit`.
 """)
-async def get_all_users_list(current_user: User = Depends(get_current_user),
-                             session: AsyncSession = Depends(get_session)):
-    logger.info(f"Admin with ID: {current_user.id} attempting to fetch all users")
+async def get_all_users_list(request: Request,
+                             after_id: int = Query(0, ge=0),
+                             limit: int = Query(USERS_PAGE_DEFAULT_LIMIT, ge=1, le=USERS_PAGE_MAX_LIMIT),
+                             current_user: Principal = Depends(get_current_user),
+                             session: AsyncSession = Depends(get_read_session)):
+    logger.info("Admin with ID: {} attempting to fetch all users", current_user.id)
     if current_user.role != "admin":
-        logger.warning(f"User with ID: {current_user.id} attempted to fetch all users without admin privileges")
+        logger.warning("User with ID: {} attempted to fetch all users without admin privileges", current_user.id)
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
-    users = await get_all_users(session)
-    logger.info(f"All users fetched successfully")
-    return [{"id": user.id, "email": user.email, "full_name": user.full_name, "role": user.role} for user in users]
+    if "application/x-ndjson" in request.headers.get("accept", ""):
+        logger.info("Streaming users after ID: {}", after_id)
+        return StreamingResponse(stream_users_ndjson(after_id), media_type="application/x-ndjson")
+    users = await get_all_users(session, after_id, limit)
+    headers = {"X-Next-After-Id": str(users[-1].id)} if len(users) == limit else None
+    logger.info("Fetched {} users after ID: {}", len(users), after_id)
+    return rows_response(users, headers)
 
 
 @router.post("/users/new", response_model=UserResponse, description="""
@@ -35,11 +85,11 @@ async def get_all_users_list(current_user: User = Depends(get_current_user),
 
 - **Тело запроса**: Данные нового пользователя в формате `UserCreate`.
 """)
-async def create_new_user(user: UserCreate, current_user: User = Depends(get_current_user),
+async def create_new_user(user: UserCreate, current_user: Principal = Depends(get_current_user),
                           session: AsyncSession = Depends(get_session)):
-    logger.info(f"Admin with ID: {current_user.id} attempting to create new user")
+    logger.info("Admin with ID: {} attempting to create new user", current_user.id)
     if current_user.role != "admin":
-        logger.warning(f"User with ID: {current_user.id} attempted to create a user without admin privileges")
+        logger.warning("User with ID: {} attempted to create a user without admin privileges", current_user.id)
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
 
     new_user = User(
@@ -49,26 +99,107 @@ async def create_new_user(user: UserCreate, current_user: User = Depends(get_cur
         role=user.role
     )
     created_user = await create_user(session, new_user)
-    logger.info(f"New user created with ID: {created_user.id}")
+    logger.info("New user created with ID: {}", created_user.id)
     return created_user
 
 
+@router.post("/users/bulk", response_model=BulkUserResponse, description=f"""
+Массово создать пользователей. Доступно только администраторам.
+
+- **Тело запроса**: Пользователи в формате `UserCreate` одним из способов, в зависимости от заголовка `Content-Type`:
+  - `application/json` - JSON-массив объектов;
+  - `application/x-ndjson` - по одному JSON-объекту на строку;
+  - `text/csv` - CSV с заголовком `email,hashed_password,full_name,role`.
+
+Тело читается потоком, строки проверяются и записываются пачками по {USERS_BULK_CHUNK_SIZE} штук, поэтому
+размер загрузки не ограничен памятью. Строки с ошибками (занятый email, недопустимая роль, неверный формат)
+пропускаются и не прерывают загрузку.
+
+**Возвращает**: Число созданных пользователей, число отклоненных строк и ошибки первых {USERS_BULK_MAX_ERRORS}
+отклоненных строк в порядке загрузки. У каждой ошибки `index` - номер записи с нуля, `row` - номер строки
+с единицы (без заголовка CSV и пустых строк).
+""", openapi_extra={"requestBody": {"required": True, "content": {
+    JSON_CONTENT_TYPE: {"schema": {"type": "array", "items": UserCreate.model_json_schema()}},
+    NDJSON_CONTENT_TYPE: {"schema": {"type": "string"}},
+    CSV_CONTENT_TYPE: {"schema": {"type": "string"}},
+}}})
+async def create_users_bulk(request: Request, current_user: Principal = Depends(get_current_user),
+                            session: AsyncSession = Depends(get_session)):
+    logger.info("Admin with ID: {} attempting to create users in bulk", current_user.id)
+    if current_user.role != "admin":
+        logger.warning("User with ID: {} attempted to create users without admin privileges", current_user.id)
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
+
+    content_type = request.headers.get("content-type", JSON_CONTENT_TYPE).split(";")[0].strip().lower()
+    if content_type not in (JSON_CONTENT_TYPE, NDJSON_CONTENT_TYPE, CSV_CONTENT_TYPE):
+        raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                            detail=f"Unsupported content type: {content_type}")
+
+    created = 0
+    errors = []
+    failed = 0
+
+    def reject(row, email, error):
+        nonlocal failed
+        failed += 1
+        errors.append({"index": row - 1, "row": row, "email": email, "error": error})
+        if len(errors) >= 2 * USERS_BULK_MAX_ERRORS:
+            # Email conflicts are only known when their chunk is written, after the validation errors of
+            # later rows, so the errors are kept in input order and trimmed to the earliest rows.
+            errors.sort(key=itemgetter("index"))
+            del errors[USERS_BULK_MAX_ERRORS:]
+
+    async def flush(chunk):
+        nonlocal created
+        inserted = await create_users(session, [user.model_dump() for _, user in chunk])
+        for row, user in chunk:
+            if user.email in inserted:
+                inserted.discard(user.email)
+                created += 1
+            else:
+                reject(row, user.email, "Email already registered")
+
+    chunk = []
+    try:
+        async for row, record, error in iter_records(request.stream(), content_type):
+            if error is None:
+                try:
+                    chunk.append((row, UserCreate.model_validate(record)))
+                except ValidationError as e:
+                    error = "; ".join(f"{'.'.join(map(str, err['loc'])) or 'row'}: {err['msg']}" for err in e.errors())
+            if error is not None:
+                reject(row, record.get("email") if isinstance(record, dict) else None, error)
+            if len(chunk) >= USERS_BULK_CHUNK_SIZE:
+                await flush(chunk)
+                chunk = []
+        if chunk:
+            await flush(chunk)
+    except (BulkImportError, UnicodeDecodeError) as e:
+        logger.warning("Bulk user upload aborted after {} users: {}", created, e)
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"Malformed upload after {created} created users: {e}")
+
+    logger.info("Bulk user upload finished: {} created, {} rejected", created, failed)
+    errors.sort(key=itemgetter("index"))
+    return {"created": created, "failed": failed, "errors": errors[:USERS_BULK_MAX_ERRORS]}
+
+
 @router.get("/users/{user_id}", response_model=UserResponse, description="""
 Получить информацию о пользователе по его ID. Доступно только администраторам.
 
 - **Параметр пути**: ID пользователя.
 """)
-async def get_user(user_id: int, current_user: User = Depends(get_current_user),
-                   session: AsyncSession = Depends(get_session)):
-    logger.info(f"Admin with ID: {current_user.id} attempting to fetch user with ID: {user_id}")
+async def get_user(user_id: int, current_user: Principal = Depends(get_current_user),
+                   session: AsyncSession = Depends(get_read_session)):
+    logger.info("Admin with ID: {} attempting to fetch user with ID: {}", current_user.id, user_id)
     if current_user.role != "admin":
-        logger.warning(f"User with ID: {current_user.id} attempted to fetch user without admin privileges")
+        logger.warning("User with ID: {} attempted to fetch user without admin privileges", current_user.id)
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
     user = await get_user_by_id(session, user_id)
     if user is None:
-        logger.warning(f"User not found for ID: {user_id}")
+        logger.warning("User not found for ID: {}", user_id)
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
-    logger.info(f"User fetched successfully for ID: {user_id}")
+    logger.info("User fetched successfully for ID: {}", user_id)
     return user
 
 
@@ -78,25 +209,20 @@ async def get_user(user_id: int, current_user: User = Depends(get_current_user),
 - **Параметр пути**: ID пользователя.
 - **Тело запроса**: Данные для обновления в формате `UserUpdate`.
 """)
-async def update_existing_user(user_id: int, updates: UserUpdate, current_user: User = Depends(get_current_user),
+async def update_existing_user(user_id: int, updates: UserUpdate, current_user: Principal = Depends(get_current_user),
                                session: AsyncSession = Depends(get_session)):
-    logger.info(f"Admin with ID: {current_user.id} attempting to update user with ID: {user_id}")
+    logger.info("Admin with ID: {} attempting to update user with ID: {}", current_user.id, user_id)
     if current_user.role != "admin":
-        logger.warning(f"User with ID: {current_user.id} attempted to update user without admin privileges")
+        logger.warning("User with ID: {} attempted to update user without admin privileges", current_user.id)
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
 
-    user = await get_user_by_id(session, user_id)
+    # Only the fields sent in the request are written; the user is not loaded beforehand.
+    changes = updates.model_dump(exclude_unset=True)
+    user = await update_user(session, user_id, changes) if changes else await get_user_by_id(session, user_id)
     if user is None:
-        logger.warning(f"User not found for ID: {user_id}")
+        logger.warning("User not found for ID: {}", user_id)
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
-
-    for field, value in updates.dict(exclude_unset=True).items():
-        setattr(user, field, value)
-
-    user_dict = {k: v for k, v in user.__dict__.items() if k != '_sa_instance_state'}
-
-    await update_user(session, user_id, user_dict)
-    logger.info(f"User updated successfully for ID: {user_id}")
+    logger.info("User updated successfully for ID: {}", user_id)
     return user
 
 
@@ -105,28 +231,45 @@ async def update_existing_user(user_id: int, updates: UserUpdate, current_user:
 
 - **Параметр пути**: ID пользователя.
 """)
-async def delete_existing_user(user_id: int, current_user: User = Depends(get_current_user),
+async def delete_existing_user(user_id: int, current_user: Principal = Depends(get_current_user),
                                session: AsyncSession = Depends(get_session)):
-    logger.info(f"Admin with ID: {current_user.id} attempting to delete user with ID: {user_id}")
+    logger.info("Admin with ID: {} attempting to delete user with ID: {}", current_user.id, user_id)
     if current_user.role != "admin":
-        logger.warning(f"User with ID: {current_user.id} attempted to delete user without admin privileges")
+        logger.warning("User with ID: {} attempted to delete user without admin privileges", current_user.id)
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
     await delete_user(session, user_id)
-    logger.info(f"User deleted successfully for ID: {user_id}")
+    logger.info("User deleted successfully for ID: {}", user_id)
     return {"detail": "User deleted"}
 
 
-@router.get("/users/{user_id}/accounts", description="""
+@router.get("/users/{user_id}/accounts", response_model=List[AccountResponse], description="""
 Получить список счетов пользователя по его ID. Доступно только администраторам.
 
 - **Параметр пути**: ID пользователя.
 """)
-async def get_user_accounts_list(user_id: int, current_user: User = Depends(get_current_user),
-                                 session: AsyncSession = Depends(get_session)):
-    logger.info(f"Admin with ID: {current_user.id} attempting to fetch accounts for user with ID: {user_id}")
+async def get_user_accounts_list(user_id: int, current_user: Principal = Depends(get_current_user),
+                                 session: AsyncSession = Depends(get_read_session)):
+    logger.info("Admin with ID: {} attempting to fetch accounts for user with ID: {}", current_user.id, user_id)
     if current_user.role != "admin":
-        logger.warning(f"User with ID: {current_user.id} attempted to fetch accounts without admin privileges")
+        logger.warning("User with ID: {} attempted to fetch accounts without admin privileges", current_user.id)
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
     accounts = await get_user_accounts(session, user_id)
-    logger.info(f"Accounts fetched successfully for user ID: {user_id}")
-    return accounts
+    logger.info("Accounts fetched successfully for user ID: {}", user_id)
+    return rows_response(accounts)
+
+
+@router.get("/users/{user_id}/summary", response_model=UserSummary, description="""
+Получить сводку по счетам пользователя по его ID: общий баланс, число счетов и платежей, а также баланс, число платежей
+и последний платеж по каждому счету. Доступно только администраторам.
+
+- **Параметр пути**: ID пользователя.
+""")
+async def get_user_summary_info(user_id: int, current_user: Principal = Depends(get_current_user),
+                                session: AsyncSession = Depends(get_read_session)):
+    logger.info("Admin with ID: {} attempting to fetch summary for user with ID: {}", current_user.id, user_id)
+    if current_user.role != "admin":
+        logger.warning("User with ID: {} attempted to fetch summary without admin privileges", current_user.id)
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
+    summary = await get_user_summary(session, user_id)
+    logger.info("Summary fetched successfully for user ID: {}", user_id)
+    return summary
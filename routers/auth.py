@@ -3,12 +3,14 @@ from loguru import logger
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from database.postgre_db import get_session
+from rate_limit import admission_control, client_ip
 from security import refresh_token
 
 router = APIRouter()
 
 
-@router.post("/refresh_token", description="""
+@router.post("/refresh_token", dependencies=[admission_control.limit("refresh_token", client_ip)],
+             description="""
 Конечная точка `/refresh_token` предназначена для обновления Access Token с использованием Refresh Token. После истечения срока действия Access Token (30 минут), используйте эту конечную точку для получения нового Access Token.
 
 - **Refresh Token**: Передайте Refresh Token в теле запроса для обновления Access Token.
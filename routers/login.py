@@ -8,6 +8,7 @@ from config import (ACCESS_TOKEN_EXPIRE_MINUTES,
                     REFRESH_TOKEN_EXPIRE_MINUTES)
 from database.postgre_db import get_session
 from database.schemas import UserLogin
+from rate_limit import admission_control, client_ip
 from security import (create_access_token,
                       create_refresh_token,
                       authenticate_user)
@@ -15,7 +16,7 @@ from security import (create_access_token,
 router = APIRouter()
 
 
-@router.post("/login", description="""
+@router.post("/login", dependencies=[admission_control.limit("login", client_ip)], description="""
 Конечная точка `/login` предназначена для аутентификации пользователя и выдачи токенов доступа и обновления. После успешной аутентификации пользователь получает:
 
 - **Access Token**: Используйте его для авторизации запросов через Swagger UI. Передайте Access Token в `Authorize`.
@@ -26,10 +27,10 @@ router = APIRouter()
 - **Пользователь**: email: user@example.com, пароль: 456
 """)
 async def login(user: UserLogin, session: AsyncSession = Depends(get_session)):
-    logger.info(f"Attempting to authenticate user with email: {user.email}")
+    logger.info("Attempting to authenticate user with email: {}", user.email)
     user_data = await authenticate_user(session, user.email, user.password)
     if not user_data:
-        logger.warning(f"Authentication failed for user with email: {user.email}")
+        logger.warning("Authentication failed for user with email: {}", user.email)
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
 
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -42,5 +43,5 @@ async def login(user: UserLogin, session: AsyncSession = Depends(get_session)):
         data={"sub": user_data.email, "id": user_data.id, "role": user_data.role},
         expires_delta=refresh_token_expires
     )
-    logger.info(f"User with email: {user_data.email} authenticated successfully")
+    logger.info("User with email: {} authenticated successfully", user_data.email)
     return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
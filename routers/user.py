@@ -1,45 +1,130 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from datetime import datetime
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
 from loguru import logger
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from database.crud import get_user_by_id, get_user_accounts, get_user_payments
-from database.models import User
-from database.postgre_db import get_session
-from database.schemas import UserResponse
+from config import PAYMENTS_PAGE_DEFAULT_LIMIT, PAYMENTS_PAGE_MAX_LIMIT
+from database.crud import (get_user_by_id,
+                           get_user_accounts,
+                           get_user_payments,
+                           get_user_payments_summary,
+                           get_user_summary)
+from database.postgre_db import get_read_session
+from database.schemas import (UserResponse,
+                              Principal,
+                              PaymentFilters,
+                              PaymentSummary,
+                              UserSummary,
+                              AccountResponse,
+                              PaymentResponse)
+from json_response import rows_json, rows_response
+from money import Amount
+from rate_limit import admission_control, authenticated_user_id
+from response_cache import response_cache
 from security import get_current_user
 
-router = APIRouter()
+router = APIRouter(dependencies=[admission_control.limit("user", authenticated_user_id)])
+
+
+def payment_filters(account_id: Optional[int] = Query(None, description="ID счета"),
+                    min_amount: Optional[Amount] = Query(None, description="Минимальная сумма платежа"),
+                    max_amount: Optional[Amount] = Query(None, description="Максимальная сумма платежа"),
+                    created_from: Optional[datetime] = Query(None, description="Начало периода (включительно)"),
+                    created_to: Optional[datetime] = Query(None, description="Конец периода (не включительно)")):
+    return PaymentFilters(account_id=account_id,
+                          min_amount=min_amount,
+                          max_amount=max_amount,
+                          created_from=created_from,
+                          created_to=created_to)
 
 
 @router.get("/user/me", response_model=UserResponse, description="""
 Конечная точка `/user/me` предназначена для получения информации о текущем аутентифицированном пользователе.
+
+Ответ содержит заголовок `ETag`. Запрос с этим значением в `If-None-Match` получает ответ 304, пока данные
+пользователя не изменились.
 """)
-async def get_current_user_info(current_user: User = Depends(get_current_user),
-                                session: AsyncSession = Depends(get_session)):
-    logger.info(f"Fetching user info for user ID: {current_user.id}")
-    user = await get_user_by_id(session, current_user.id)
-    if user is None:
-        logger.warning(f"User not found for ID: {current_user.id}")
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
-    logger.info(f"User info fetched successfully for user ID: {current_user.id}")
-    return user
-
-
-@router.get("/user/me/accounts", description="""
+async def get_current_user_info(request: Request,
+                                current_user: Principal = Depends(get_current_user),
+                                session: AsyncSession = Depends(get_read_session)):
+    logger.info("Fetching user info for user ID: {}", current_user.id)
+
+    async def render():
+        user = await get_user_by_id(session, current_user.id)
+        if user is None:
+            logger.warning("User not found for ID: {}", current_user.id)
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+        return UserResponse.model_validate(user, from_attributes=True).model_dump_json().encode()
+
+    response = await response_cache.respond(request, current_user.id, render)
+    logger.info("User info fetched successfully for user ID: {}", current_user.id)
+    return response
+
+
+@router.get("/user/me/accounts", response_model=List[AccountResponse], description="""
 Конечная точка `/user/me/accounts` предназначена для получения списка счетов текущего аутентифицированного пользователя.
+
+Ответ содержит заголовок `ETag`. Запрос с этим значением в `If-None-Match` получает ответ 304, пока счета
+пользователя не изменились.
 """)
-async def get_my_accounts(current_user: User = Depends(get_current_user), session: AsyncSession = Depends(get_session)):
-    logger.info(f"Fetching accounts for user ID: {current_user.id}")
-    accounts = await get_user_accounts(session, current_user.id)
-    logger.info(f"Accounts fetched successfully for user ID: {current_user.id}")
-    return accounts
+async def get_my_accounts(request: Request,
+                          current_user: Principal = Depends(get_current_user),
+                          session: AsyncSession = Depends(get_read_session)):
+    logger.info("Fetching accounts for user ID: {}", current_user.id)
+
+    async def render():
+        return rows_json(await get_user_accounts(session, current_user.id))
 
+    response = await response_cache.respond(request, current_user.id, render)
+    logger.info("Accounts fetched successfully for user ID: {}", current_user.id)
+    return response
 
-@router.get("/user/me/payments", description="""
+
+@router.get("/user/me/summary", response_model=UserSummary, description="""
+Конечная точка `/user/me/summary` возвращает сводку по счетам текущего аутентифицированного пользователя: общий баланс,
+число счетов и платежей, а также баланс, число платежей и последний платеж по каждому счету.
+""")
+async def get_my_summary(current_user: Principal = Depends(get_current_user),
+                         session: AsyncSession = Depends(get_read_session)):
+    logger.info("Fetching summary for user ID: {}", current_user.id)
+    summary = await get_user_summary(session, current_user.id)
+    logger.info("Summary fetched successfully for user ID: {}", current_user.id)
+    return summary
+
+
+@router.get("/user/me/payments", response_model=List[PaymentResponse], description=f"""
 Конечная точка `/user/me/payments` предназначена для получения списка платежей текущего аутентифицированного пользователя.
+
+- **after_id**: Вернуть платежи с ID больше указанного (по умолчанию с начала списка).
+- **limit**: Размер страницы, от 1 до {PAYMENTS_PAGE_MAX_LIMIT} (по умолчанию {PAYMENTS_PAGE_DEFAULT_LIMIT}).
+- **account_id**, **min_amount**, **max_amount**, **created_from**, **created_to**: Необязательные фильтры по счету,
+  сумме и дате платежа.
+
+Платежи упорядочены по ID. Если страница заполнена полностью, заголовок `X-Next-After-Id` содержит значение
+`after_id` для следующей страницы.
+""")
+async def get_my_payments(after_id: int = Query(0, ge=0),
+                          limit: int = Query(PAYMENTS_PAGE_DEFAULT_LIMIT, ge=1, le=PAYMENTS_PAGE_MAX_LIMIT),
+                          filters: PaymentFilters = Depends(payment_filters),
+                          current_user: Principal = Depends(get_current_user),
+                          session: AsyncSession = Depends(get_read_session)):
+    logger.info("Fetching payments for user ID: {}", current_user.id)
+    payments = await get_user_payments(session, current_user.id, filters, after_id, limit)
+    headers = {"X-Next-After-Id": str(payments[-1].id)} if len(payments) == limit else None
+    logger.info("Payments fetched successfully for user ID: {}", current_user.id)
+    return rows_response(payments, headers)
+
+
+@router.get("/user/me/payments/summary", response_model=PaymentSummary, description="""
+Конечная точка `/user/me/payments/summary` возвращает число и общую сумму платежей текущего аутентифицированного
+пользователя. Принимает те же фильтры, что и `/user/me/payments`.
 """)
-async def get_my_payments(current_user: User = Depends(get_current_user), session: AsyncSession = Depends(get_session)):
-    logger.info(f"Fetching payments for user ID: {current_user.id}")
-    payments = await get_user_payments(session, current_user.id)
-    logger.info(f"Payments fetched successfully for user ID: {current_user.id}")
-    return payments
+async def get_my_payments_summary(filters: PaymentFilters = Depends(payment_filters),
+                                  current_user: Principal = Depends(get_current_user),
+                                  session: AsyncSession = Depends(get_read_session)):
+    logger.info("Fetching payments summary for user ID: {}", current_user.id)
+    summary = await get_user_payments_summary(session, current_user.id, filters)
+    logger.info("Payments summary fetched successfully for user ID: {}", current_user.id)
+    return summary
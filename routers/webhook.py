@@ -1,69 +1,186 @@
-import hashlib
+from typing import List
 
-from fastapi import APIRouter, Depends, Query, HTTPException, status
+from fastapi import APIRouter, Depends, Query, HTTPException, Response, status
 from loguru import logger
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from config import SECRET_KEY
-from database.crud import (get_payment_by_transaction_id,
-                           get_account_by_id,
-                           create_account,
-                           create_payment,
-                           update_account_balance
-                           )
-from database.models import Payment, Account
+from config import (WEBHOOK_BATCH_MAX_SIZE,
+                    WEBHOOK_QUEUE_ENABLED,
+                    WEBHOOK_QUEUE_RETRY_AFTER_SECONDS)
+from database.crud import ingest_payment, ingest_payments, get_processed_transaction_ids
 from database.postgre_db import get_session
-from database.schemas import WebhookPayload
+from database.schemas import WebhookPayload, WebhookBatchResponse
+from idempotency import webhook_idempotency, fingerprint, conflicts_total, IdempotencyRecord
+from money import parse_amount, to_units
+from rate_limit import admission_control, client_ip, webhook_user_id
+from signing import webhook_signer
+from webhook_queue import webhook_queue, WebhookQueueFull
 
 router = APIRouter()
 
 
 async def verify_signature(payload: WebhookPayload):
     logger.info("Verifying webhook signature")
-    secret_key = SECRET_KEY
-    data_to_hash = f"{payload.account_id}{payload.amount}{payload.transaction_id}{payload.user_id}{secret_key}"
-    calculated_signature = hashlib.sha256(data_to_hash.encode()).hexdigest()
-    return calculated_signature == payload.signature
+    return webhook_signer.verify(payload)
 
 
-@router.post("/webhook", description="""
+@router.post("/webhook", dependencies=[admission_control.limit("webhook", webhook_user_id)], description="""
 Обработать вебхук для обработки платежа.
 
 - **Тело запроса**: Данные вебхука в формате `WebhookPayload`.
   - **transaction_id**: Уникальный идентификатор транзакции (строка).
   - **user_id**: Идентификатор пользователя, которому зачисляется платеж (целое число).
   - **account_id**: Идентификатор счета пользователя, на который зачисляется платеж (целое число).
-  - **amount**: Сумма платежа (число с плавающей точкой).
+  - **amount**: Сумма платежа (десятичное число, не больше двух знаков после запятой).
   - **signature**: Цифровая подпись, подтверждающая целостность данных (строка). Подпись должна быть корректной для успешной обработки.
+    Это HMAC-SHA256 в шестнадцатеричном виде от строки `transaction_id`, `user_id`, `account_id` и `amount`,
+    разделенных переводами строк, с одним из ключей `WEBHOOK_SIGNING_KEYS`.
+
+Если включена очередь отложенной записи (`WEBHOOK_QUEUE_ENABLED`), платеж после проверки подписи ставится в очередь
+и эндпоинт сразу отвечает `202 Accepted`. При переполненной очереди возвращается `503` с заголовком `Retry-After`.
+
+Ответы на обработанные `transaction_id` запоминаются. Повтор с тем же `transaction_id` и теми же данными получает
+сохраненный ответ без обращения к базе, с заголовком `Idempotent-Replayed: true`, а повтор с другими данными -
+`409 Conflict`. Повторы, пришедшие, пока исходный вебхук с корректной подписью еще обрабатывается, ждут его
+результата. Ответ `202` не запоминается: платеж из очереди запоминается с ответом `200` после записи, а до нее
+повторы снова ставятся в очередь.
+
+Частота вебхуков ограничивается по `user_id` (`429` с заголовком `Retry-After`), а число одновременно
+обрабатываемых вебхуков - на процесс (`503`).
 """)
-async def process_webhook(payload: WebhookPayload, session: AsyncSession = Depends(get_session)):
+async def process_webhook(payload: WebhookPayload, response: Response, session: AsyncSession = Depends(get_session)):
     logger.info("Processing webhook")
+    record = await webhook_idempotency.get(payload.transaction_id)
+    if record is not None:
+        return await replay_webhook(payload, record, response)
+
+    # Checked before taking the in-flight slot, so that a forged request with a real transaction_id does not
+    # make the provider's genuine retries wait for it.
     if not await verify_signature(payload):
         logger.warning("Invalid signature for webhook")
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid signature")
 
-    payment = await get_payment_by_transaction_id(session, payload.transaction_id)
-    if payment:
-        logger.warning(f"Transaction already processed for transaction ID: {payload.transaction_id}")
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Transaction already processed")
-
-    account = await get_account_by_id(session, payload.account_id)
-    if not account:
-        logger.info(f"Creating new account for account ID: {payload.account_id}")
-        new_account = Account(id=payload.account_id, owner_id=payload.user_id, balance=0.0)
-        account = await create_account(session, new_account)
-
-    logger.info(f"Creating new payment for transaction ID: {payload.transaction_id}")
-    new_payment = Payment(
-        transaction_id=payload.transaction_id,
-        account_id=payload.account_id,
-        amount=payload.amount
-    )
-    await create_payment(session, new_payment)
-    await update_account_balance(session, payload.account_id, payload.amount)
+    webhook_idempotency.start(payload.transaction_id)
+    record = None
+    try:
+        status_code, detail = await handle_webhook(payload, session)
+        if status_code == status.HTTP_202_ACCEPTED:
+            # A queued payment is not final yet: the queue records the outcome once the payment is written,
+            # and until then retries are queued again. Only duplicates waiting right now share the 202.
+            record = IdempotencyRecord(fingerprint(payload), payload.signature, status_code, detail)
+        else:
+            record = await webhook_idempotency.remember(payload, status_code, detail)
+    finally:
+        webhook_idempotency.finish(payload.transaction_id, record)
+    return webhook_response(response, status_code, detail)
+
+
+async def handle_webhook(payload: WebhookPayload, session: AsyncSession):
+    # The signature is already verified.
+    if WEBHOOK_QUEUE_ENABLED:
+        try:
+            webhook_queue.put(payload)
+        except WebhookQueueFull as e:
+            logger.warning("Webhook rejected for transaction ID: {}: {}", payload.transaction_id, e)
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e),
+                                headers={"Retry-After": str(WEBHOOK_QUEUE_RETRY_AFTER_SECONDS)})
+        logger.info("Payment queued for transaction ID: {}", payload.transaction_id)
+        return status.HTTP_202_ACCEPTED, "Payment accepted for processing"
+
+    payment_id = await ingest_payment(session,
+                                      transaction_id=payload.transaction_id,
+                                      user_id=payload.user_id,
+                                      account_id=payload.account_id,
+                                      amount=payload.amount)
+    if payment_id is None:
+        logger.warning("Transaction already processed for transaction ID: {}", payload.transaction_id)
+        return status.HTTP_400_BAD_REQUEST, "Transaction already processed"
 
     logger.info("Payment processed successfully")
-    return {"detail": "Payment processed successfully"}
+    return status.HTTP_200_OK, "Payment processed successfully"
+
+
+async def replay_webhook(payload: WebhookPayload, record, response: Response):
+    if record.signature != payload.signature or record.fingerprint != fingerprint(payload):
+        # Not an identical retry: the request has to carry a valid signature of its own.
+        if not await verify_signature(payload):
+            logger.warning("Invalid signature for webhook")
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid signature")
+        if record.fingerprint != fingerprint(payload):
+            logger.warning("Transaction ID: {} reused with a different payload", payload.transaction_id)
+            conflicts_total.inc()
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                                detail="Transaction ID was already used with a different payload")
+    logger.info("Replaying response for transaction ID: {}", payload.transaction_id)
+    return webhook_response(response, record.status_code, record.detail, {"Idempotent-Replayed": "true"})
+
+
+def webhook_response(response: Response, status_code: int, detail: str, headers: dict = None):
+    if status_code >= 400:
+        raise HTTPException(status_code=status_code, detail=detail, headers=headers)
+    response.status_code = status_code
+    response.headers.update(headers or {})
+    return {"detail": detail}
+
+
+@router.post("/webhook/batch", response_model=WebhookBatchResponse,
+             dependencies=[admission_control.limit("webhook_batch", client_ip)], description=f"""
+Обработать пакет вебхуков за один запрос (не более {WEBHOOK_BATCH_MAX_SIZE} платежей).
+
+- **Тело запроса**: Список объектов в формате `WebhookPayload`.
+
+Подпись проверяется для каждого платежа. Повторы `transaction_id` внутри пакета и уже обработанные транзакции
+пропускаются, как и платежи на несуществующий счет пользователя, которого тоже нет: такой счет нельзя создать.
+Остальные платежи записываются одной транзакцией с одним обновлением баланса на каждый счет.
+
+**Возвращает**: Число записанных платежей и статус каждого элемента пакета в исходном порядке:
+`processed`, `duplicate`, `invalid_signature` или `unknown_user`.
+""")
+async def process_webhook_batch(payloads: List[WebhookPayload], session: AsyncSession = Depends(get_session)):
+    logger.info("Processing webhook batch of {} payments", len(payloads))
+    if len(payloads) > WEBHOOK_BATCH_MAX_SIZE:
+        logger.warning("Webhook batch of {} payments exceeds the limit of {}", len(payloads), WEBHOOK_BATCH_MAX_SIZE)
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail=f"Batch size exceeds {WEBHOOK_BATCH_MAX_SIZE} payments")
+
+    statuses = []
+    candidates = {}
+    for payload, valid in zip(payloads, webhook_signer.verify_many(payloads)):
+        if not valid:
+            statuses.append("invalid_signature")
+        elif payload.transaction_id in candidates:
+            statuses.append("duplicate")
+        else:
+            candidates[payload.transaction_id] = payload
+            statuses.append(None)
+
+    inserted = unknown = set()
+    if candidates:
+        already_processed = await get_processed_transaction_ids(session, list(candidates))
+        inserted, unknown = await ingest_payments(session, [
+            {"transaction_id": payload.transaction_id,
+             "user_id": payload.user_id,
+             "account_id": payload.account_id,
+             "amount": payload.amount}
+            for transaction_id, payload in candidates.items() if transaction_id not in already_processed
+        ])
+
+    results = []
+    for payload, item_status in zip(payloads, statuses):
+        if item_status is None:
+            if payload.transaction_id in inserted:
+                item_status = "processed"
+            elif payload.transaction_id in unknown:
+                item_status = "unknown_user"
+            else:
+                item_status = "duplicate"
+        if item_status == "processed":
+            # Single-webhook retries of a payment delivered in a batch are answered from the cache.
+            await webhook_idempotency.remember(payload, status.HTTP_200_OK, "Payment processed successfully")
+        results.append({"transaction_id": payload.transaction_id, "status": item_status})
+
+    logger.info("Webhook batch processed: {} of {} payments recorded", len(inserted), len(payloads))
+    return {"processed": len(inserted), "results": results}
 
 
 @router.get("/generate_webhook_json", description="""
@@ -72,7 +189,7 @@ async def process_webhook(payload: WebhookPayload, session: AsyncSession = Depen
 - **transaction_id**: Уникальный идентификатор транзакции (строка).
 - **user_id**: Идентификатор пользователя, которому зачисляется платеж (целое число).
 - **account_id**: Идентификатор счета пользователя, на который зачисляется платеж (целое число).
-- **amount**: Сумма платежа (число с плавающей точкой).
+- **amount**: Сумма платежа (десятичное число, не больше двух знаков после запятой).
 
 **Возвращает**: JSON объект, содержащий `transaction_id`, `user_id`, `account_id`, `amount` и корректную `signature`. Этот JSON можно использовать для отправки запроса на конечную точку `/webhook` для проверки.
 """)
@@ -82,14 +199,17 @@ async def generate_webhook_json(
         account_id: int = Query(..., description="Account ID"),
         amount: float = Query(..., description="Amount")
 ):
-    data_to_hash = f"{account_id}{amount}{transaction_id}{user_id}{SECRET_KEY}"
-    signature = hashlib.sha256(data_to_hash.encode()).hexdigest()
+    try:
+        cents = parse_amount(amount)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
+    signature = webhook_signer.sign(transaction_id, user_id, account_id, cents)
 
     response_json = {
         "transaction_id": transaction_id,
         "user_id": user_id,
         "account_id": account_id,
-        "amount": amount,
+        "amount": to_units(cents),
         "signature": signature
     }
 
@@ -1,3 +1,6 @@
+import asyncio
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timedelta
 
 import jwt
@@ -7,14 +10,37 @@ from loguru import logger
 from passlib.context import CryptContext
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from cache import principal_cache
 from config import (ALGORITHM,
                     SECRET_KEY,
-                    ACCESS_TOKEN_EXPIRE_MINUTES)
-from database.crud import get_user_by_email
-from database.postgre_db import get_session
+                    ACCESS_TOKEN_EXPIRE_MINUTES,
+                    AUTH_STATELESS,
+                    BCRYPT_ROUNDS,
+                    PASSWORD_HASH_EXECUTOR,
+                    PASSWORD_HASH_WORKERS,
+                    PASSWORD_HASH_MAX_PENDING,
+                    PASSWORD_HASH_QUEUE_TIMEOUT_SECONDS)
+from database.crud import get_principal_by_email, get_user_credentials
+from database.postgre_db import get_session, current_user_id
+from database.schemas import Principal
+from metrics import Histogram
+
+auth_seconds = Histogram("auth_duration_seconds", "Time spent in authentication steps", ("step",),
+                         buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5))
+jwt_decode_seconds = auth_seconds.labels("jwt_decode")
+password_slot_wait_seconds = auth_seconds.labels("password_slot_wait")
+password_verify_seconds = auth_seconds.labels("password_verify")
+password_hash_seconds = auth_seconds.labels("password_hash")
 
 security = HTTPBearer()
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+# bcrypt runs outside the event loop. At most PASSWORD_HASH_WORKERS hashes run at once and at most
+# PASSWORD_HASH_MAX_PENDING callers wait for a slot; anything beyond that fails fast with 503.
+password_executor = (ProcessPoolExecutor if PASSWORD_HASH_EXECUTOR == "process"
+                     else ThreadPoolExecutor)(max_workers=PASSWORD_HASH_WORKERS)
+password_slots = asyncio.Semaphore(PASSWORD_HASH_WORKERS)
+password_waiters = 0
 
 
 def create_access_token(data: dict, expires_delta: timedelta):
@@ -35,28 +61,75 @@ def create_refresh_token(data: dict, expires_delta: timedelta):
     return encoded_jwt
 
 
-def verify_password(plain_password, hashed_password):
-    logger.info("Verifying password")
+def _verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
 
+def _hash_password(plain_password):
+    return pwd_context.hash(plain_password)
+
+
+async def run_password_task(function, *args):
+    global password_waiters
+    busy = HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                         detail="Too many concurrent password checks, try again later",
+                         headers={"Retry-After": "1"})
+    if password_waiters >= PASSWORD_HASH_MAX_PENDING:
+        logger.warning("Password hashing queue is full")
+        raise busy
+    password_waiters += 1
+    started = time.perf_counter()
+    try:
+        await asyncio.wait_for(password_slots.acquire(), PASSWORD_HASH_QUEUE_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        logger.warning("Timed out waiting for a password hashing slot")
+        raise busy
+    finally:
+        password_waiters -= 1
+        password_slot_wait_seconds.observe(time.perf_counter() - started)
+    try:
+        return await asyncio.get_running_loop().run_in_executor(password_executor, function, *args)
+    finally:
+        password_slots.release()
+
+
+async def verify_password(plain_password, hashed_password):
+    logger.info("Verifying password")
+    started = time.perf_counter()
+    try:
+        return await run_password_task(_verify_password, plain_password, hashed_password)
+    finally:
+        password_verify_seconds.observe(time.perf_counter() - started)
+
+
+async def hash_password(plain_password):
+    logger.info("Hashing password")
+    started = time.perf_counter()
+    try:
+        return await run_password_task(_hash_password, plain_password)
+    finally:
+        password_hash_seconds.observe(time.perf_counter() - started)
+
+
 async def authenticate_user(session: AsyncSession, email: str, password: str):
-    logger.info(f"Authenticating user with email: {email}")
-    user = await get_user_by_email(session, email)
-    if not user or not verify_password(password, user.hashed_password):
-        logger.warning(f"Authentication failed for user with email: {email}")
+    logger.info("Authenticating user with email: {}", email)
+    user = await get_user_credentials(session, email)
+    if not user or not await verify_password(password, user.hashed_password):
+        logger.warning("Authentication failed for user with email: {}", email)
         return False
     return user
 
 
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security),
-                           session: AsyncSession = Depends(get_session)):
-    logger.info("Getting current user")
+                           session: AsyncSession = Depends(get_session)) -> Principal:
+    logger.debug("Getting current user")
     try:
         token = credentials.credentials
-        logger.info(f"Token received: {token}")  # Corrected logging statement
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        logger.info(f"Token payload decoded: {payload}")
+        started = time.perf_counter()
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        finally:
+            jwt_decode_seconds.observe(time.perf_counter() - started)
         if payload.get("type") != "access":
             logger.warning("Invalid token type")
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token type")
@@ -64,15 +137,27 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         if email is None:
             logger.warning("Email not found in token payload")
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid authentication credentials")
-        logger.info(f"Fetching user by email: {email}")
-        user = await get_user_by_email(session, email)
+        user_id = payload.get("id")
+        if AUTH_STATELESS and user_id is not None and payload.get("role") is not None:
+            # Trust the signed claims: no lookup, role changes apply once the access token is reissued.
+            current_user_id.set(user_id)
+            return Principal(id=user_id, email=email, role=payload["role"])
+        principal = principal_cache.get(user_id) if user_id is not None else None
+        if principal is not None and principal.email == email:
+            current_user_id.set(principal.id)
+            return principal
+        logger.debug("Fetching user by email: {}", email)
+        user = await get_principal_by_email(session, email)
         if user is None:
-            logger.warning(f"User not found for email: {email}")
+            logger.warning("User not found for email: {}", email)
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
-        logger.info(f"User found: {user}")
-        return user
+        principal = Principal(id=user.id, email=user.email, role=user.role)
+        principal_cache.set(principal.id, principal)
+        current_user_id.set(principal.id)
+        logger.debug("User found with ID: {}", principal.id)
+        return principal
     except jwt.PyJWTError as e:
-        logger.error(f"JWT decoding error: {e}")
+        logger.error("JWT decoding error: {}", e)
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid authentication credentials")
 
 
@@ -85,7 +170,7 @@ async def refresh_token(refresh_token_str: str, session: AsyncSession = Depends(
         email: str = payload.get("sub")
         if email is None:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid authentication credentials")
-        user = await get_user_by_email(session, email)
+        user = await get_principal_by_email(session, email)
         if user is None:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
         access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -0,0 +1,60 @@
+# Gunicorn settings and worker class for the production server:
+#
+#     gunicorn -c python:serving main:app
+#
+# The arbiter forks WEB_CONCURRENCY uvicorn workers, restarts the ones that die and reloads them gracefully on HUP.
+from uvicorn_worker import UvicornWorker as BaseUvicornWorker
+
+from config import (DATABASE_REPLICA_URLS,
+                    WEB_CONCURRENCY,
+                    SERVER_HOST,
+                    SERVER_PORT,
+                    SERVER_LOOP,
+                    SERVER_HTTP,
+                    SERVER_PRELOAD,
+                    SERVER_GRACEFUL_TIMEOUT_SECONDS,
+                    SERVER_KEEPALIVE_SECONDS,
+                    SERVER_MAX_REQUESTS,
+                    SERVER_MAX_REQUESTS_JITTER)
+
+
+class UvicornWorker(BaseUvicornWorker):
+    """
+    Рабочий процесс gunicorn с uvicorn, циклом событий `SERVER_LOOP` и разбором HTTP `SERVER_HTTP`.
+    """
+
+    CONFIG_KWARGS = {"loop": SERVER_LOOP, "http": SERVER_HTTP}
+
+
+bind = f"{SERVER_HOST}:{SERVER_PORT}"
+workers = WEB_CONCURRENCY
+worker_class = "serving.UvicornWorker"
+# Imported once in the arbiter and shared copy-on-write by the workers. A HUP then restarts the workers with
+# the code already loaded; new code needs a new arbiter (USR2, or a container restart) or SERVER_PRELOAD=false.
+preload_app = SERVER_PRELOAD
+# A worker stopped by HUP, TERM or max_requests finishes its in-flight requests and runs the lifespan shutdown
+# (webhook queue flush, balance compaction) within this time before it is killed.
+graceful_timeout = SERVER_GRACEFUL_TIMEOUT_SECONDS
+timeout = SERVER_GRACEFUL_TIMEOUT_SECONDS
+keepalive = SERVER_KEEPALIVE_SECONDS
+max_requests = SERVER_MAX_REQUESTS
+max_requests_jitter = SERVER_MAX_REQUESTS_JITTER
+
+
+def when_ready(server):
+    # State that still lives in each worker's memory with several workers.
+    if server.num_workers > 1:
+        server.log.warning("Serving with %d workers: each /metrics scrape reports the counters of the one worker "
+                           "that answers it", server.num_workers)
+        if DATABASE_REPLICA_URLS:
+            server.log.warning("Serving with %d workers: read-your-writes keeps reads on the primary only in the "
+                               "worker that handled the write", server.num_workers)
+
+
+def post_fork(server, worker):
+    # Imported here: without preload_app the application is loaded only in the worker, after the fork.
+    from database.postgre_db import configure_worker_pools
+    from rate_limit import admission_control
+
+    configure_worker_pools(server.num_workers)
+    admission_control.split(server.num_workers)
@@ -0,0 +1,87 @@
+import hashlib
+import hmac
+
+from config import SECRET_KEY, WEBHOOK_SIGNING_KEYS, WEBHOOK_LEGACY_SIGNATURES
+from metrics import Counter
+from money import to_units
+
+signatures_total = Counter("webhook_signatures_total", "Verified webhook signatures by the key that matched",
+                           ("key",))
+for key_kind in ("current", "previous", "legacy", "invalid"):
+    signatures_total.labels(key_kind)
+
+
+def canonical_message(transaction_id: str, user_id: int, account_id: int, amount: int) -> bytes:
+    # Fields in a fixed order separated by newlines. Only the transaction ID is free text and it comes
+    # first, so the message can always be split back from the right without ambiguity. The amount is in
+    # cents but is written as the decimal float senders have always signed (e.g. "100.0", "123.45"), so
+    # signatures made before amounts moved to cents still verify.
+    return f"{transaction_id}\n{user_id}\n{account_id}\n{to_units(amount)!r}".encode()
+
+
+def _matches(expected: str, signature: str) -> bool:
+    try:
+        return hmac.compare_digest(expected, signature)
+    except TypeError:
+        # compare_digest only accepts ASCII strings; anything else is not a hex digest.
+        return False
+
+
+class WebhookSigner:
+    """
+    Подпись вебхуков HMAC-SHA256 от канонического представления полей платежа.
+
+    Подписывает первый ключ из `keys`, а проверка принимает подпись любым из них, что позволяет менять ключ
+    без простоя. Для каждого ключа заранее создается объект `hmac`, который копируется при каждой проверке.
+    С `legacy_keys` также принимаются подписи прежнего вида `sha256(account_id + amount + transaction_id +
+    user_id + ключ)`.
+    """
+
+    def __init__(self, keys: list, legacy_keys: list = ()):
+        if not keys:
+            raise ValueError("At least one webhook signing key is required")
+        # With OpenSSL the HMAC object wraps a C-level one in `_hmac`; copying that directly skips the
+        # pure-Python wrapper on every call. Without it `_hmac` is None and the wrapper is copied instead.
+        self._macs = [getattr(mac, "_hmac", None) or mac
+                      for mac in (hmac.new(key.encode(), digestmod=hashlib.sha256) for key in keys)]
+        self._legacy_keys = [key.encode() for key in legacy_keys]
+        self._current = signatures_total.labels("current")
+        self._previous = signatures_total.labels("previous")
+        self._legacy = signatures_total.labels("legacy")
+        self._invalid = signatures_total.labels("invalid")
+
+    def sign(self, transaction_id: str, user_id: int, account_id: int, amount: int) -> str:
+        mac = self._macs[0].copy()
+        mac.update(canonical_message(transaction_id, user_id, account_id, amount))
+        return mac.hexdigest()
+
+    def verify(self, payload) -> bool:
+        message = canonical_message(payload.transaction_id, payload.user_id, payload.account_id, payload.amount)
+        signature = payload.signature
+        for index, base in enumerate(self._macs):
+            mac = base.copy()
+            mac.update(message)
+            if _matches(mac.hexdigest(), signature):
+                (self._current if index == 0 else self._previous).inc()
+                return True
+        if self._legacy_keys and self._verify_legacy(payload):
+            self._legacy.inc()
+            return True
+        self._invalid.inc()
+        return False
+
+    def verify_many(self, payloads: list) -> list:
+        verify = self.verify
+        return [verify(payload) for payload in payloads]
+
+    def _verify_legacy(self, payload) -> bool:
+        prefix = f"{payload.account_id}{to_units(payload.amount)}{payload.transaction_id}{payload.user_id}".encode()
+        for key in self._legacy_keys:
+            digest = hashlib.sha256(prefix)
+            digest.update(key)
+            if _matches(digest.hexdigest(), payload.signature):
+                return True
+        return False
+
+
+webhook_signer = WebhookSigner(WEBHOOK_SIGNING_KEYS, [SECRET_KEY] if WEBHOOK_LEGACY_SIGNATURES else [])
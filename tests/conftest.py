@@ -0,0 +1,110 @@
+import os
+import uuid
+from datetime import timedelta
+
+import httpx
+import pytest
+from loguru import logger
+from sqlalchemy import event, insert
+from sqlalchemy.ext.asyncio import create_async_engine
+
+import main
+from cache import principal_cache
+from database import postgre_db
+from database.models import Account, User
+from idempotency import webhook_idempotency
+from money import parse_amount
+from rate_limit import admission_control
+from response_cache import user_versions
+from security import create_access_token
+from signing import webhook_signer
+
+# A disposable Postgres database for the tests marked `postgres`: its tables are dropped and recreated.
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+logger.remove()
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "postgres: needs TEST_DATABASE_URL pointing to a disposable Postgres database")
+
+
+def pytest_collection_modifyitems(config, items):
+    if TEST_DATABASE_URL:
+        return
+    skip = pytest.mark.skip(reason="TEST_DATABASE_URL is not set")
+    for item in items:
+        if "postgres" in item.keywords:
+            item.add_marker(skip)
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture(autouse=True)
+def reset_state(monkeypatch):
+    monkeypatch.setattr(admission_control, "enabled", False)
+    for cache in (principal_cache, webhook_idempotency.records, postgre_db.recent_writes, user_versions._versions):
+        cache.clear()
+    yield
+
+
+@pytest.fixture
+async def database(request, tmp_path, monkeypatch):
+    # SQLite in a temporary file, or the Postgres database of TEST_DATABASE_URL for the `postgres` tests,
+    # bound in place of the primary engine.
+    if request.node.get_closest_marker("postgres"):
+        engine = create_async_engine(TEST_DATABASE_URL)
+    else:
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'test.db'}")
+
+        @event.listens_for(engine.sync_engine, "connect")
+        def enable_foreign_keys(connection, _):
+            connection.execute("PRAGMA foreign_keys=ON")
+
+    async with engine.begin() as connection:
+        await connection.run_sync(postgre_db.Base.metadata.drop_all)
+        await connection.run_sync(postgre_db.Base.metadata.create_all)
+    primary = postgre_db.engine
+    monkeypatch.setattr(postgre_db, "engine", engine)
+    postgre_db.async_session.configure(bind=engine)
+    try:
+        yield engine
+    finally:
+        postgre_db.async_session.configure(bind=primary)
+        await engine.dispose()
+
+
+@pytest.fixture
+async def client():
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as client:
+        yield client
+
+
+async def create_user(engine, email: str = None, accounts: dict = None, role: str = "user") -> int:
+    # Creates a user with the given {account_id: balance in cents}; returns the user ID.
+    async with engine.begin() as connection:
+        user_id = (await connection.execute(insert(User).values(
+            email=email or f"{uuid.uuid4().hex}@example.com", hashed_password="", full_name="Test User",
+            role=role).returning(User.id))).scalar_one()
+        for account_id, balance in (accounts or {}).items():
+            await connection.execute(insert(Account).values(id=account_id, owner_id=user_id, balance=balance))
+    return user_id
+
+
+def bearer(user_id: int, email: str) -> dict:
+    token = create_access_token({"sub": email, "id": user_id}, timedelta(minutes=5))
+    return {"Authorization": f"Bearer {token}"}
+
+
+def webhook_payload(user_id: int, account_id: int, amount: str, transaction_id: str = None) -> dict:
+    transaction_id = transaction_id or uuid.uuid4().hex
+    return {
+        "transaction_id": transaction_id,
+        "user_id": user_id,
+        "account_id": account_id,
+        "amount": amount,
+        "signature": webhook_signer.sign(transaction_id, user_id, account_id, parse_amount(amount)),
+    }
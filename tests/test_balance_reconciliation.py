@@ -0,0 +1,46 @@
+import json
+
+import pytest
+from sqlalchemy import select, update
+
+from database.crud import check_account_balances
+from database.models import Account
+from jobs.balance_reconciliation import approved_repairs, drift_report
+from jobs.runner import ChunkedJob
+from tests.conftest import create_user, webhook_payload
+
+pytestmark = pytest.mark.anyio
+
+
+async def balances(database) -> dict:
+    async with database.connect() as connection:
+        return dict((await connection.execute(select(Account.id, Account.balance))).all())
+
+
+async def test_repairs_only_reported_drift_backed_by_payments(database, client, tmp_path):
+    # Account 1 has an opening balance without payments; 2 and 3 drift from their payments.
+    user_id = await create_user(database, accounts={1: 99999, 2: 0, 3: 0})
+    await client.post("/webhook/batch", json=[webhook_payload(user_id, 2, "5.00"), webhook_payload(user_id, 3, "1.00")])
+    async with database.begin() as connection:
+        await connection.execute(update(Account).where(Account.id == 2).values(balance=700))
+        await connection.execute(update(Account).where(Account.id == 3).values(balance=0))
+    job = ChunkedJob("test_reconciliation", check_account_balances, chunk_size=2)
+
+    report = drift_report(await job.run(resume=False, engine=database))
+
+    report["drift"].sort(key=lambda row: row["account_id"])
+    assert [(row["account_id"], row["stored_balance"], row["ledger_balance"]) for row in report["drift"]] == [
+        (2, 7.0, 5.0), (3, 0.0, 1.0)]
+    assert report["unverified"] == [{"account_id": 1, "stored_balance": 999.99}]
+    assert await balances(database) == {1: 99999, 2: 700, 3: 0}
+
+    # Account 3 is left out of the reviewed report, and account 2 is not repaired with stale balances.
+    path = tmp_path / "drift.json"
+    path.write_text(json.dumps({**report, "drift": report["drift"][:1]}))
+    stale = await job.run(repair={2: (600, 500)}, resume=False, engine=database)
+    repaired = await job.run(repair=approved_repairs(path), resume=False, engine=database)
+
+    assert stale["repaired"] == 0
+    assert repaired["repaired"] == 1
+    assert {row["account_id"]: row["repaired"] for row in repaired["drift"]} == {2: True, 3: False}
+    assert await balances(database) == {1: 99999, 2: 500, 3: 0}
@@ -0,0 +1,20 @@
+from loguru import logger
+
+from logging_config import setup_logging
+
+
+def test_warnings_and_errors_are_never_dropped():
+    records = []
+    setup_logging(sink=lambda message: records.append(message.record["level"].name), level="DEBUG",
+                  enqueue=False, sample_rate=0.0, rate_limit=1)
+    try:
+        for _ in range(10):
+            logger.info("dropped")
+            logger.warning("kept")
+            logger.error("kept")
+            logger.critical("kept")
+    finally:
+        logger.remove()
+
+    assert sorted(set(records)) == ["CRITICAL", "ERROR", "WARNING"]
+    assert len(records) == 30
@@ -0,0 +1,43 @@
+import pytest
+
+from database import crud
+from database.postgre_db import recent_writes
+from tests.conftest import bearer, create_user, webhook_payload
+
+pytestmark = pytest.mark.anyio
+
+
+async def credit_account_of_another_user(database, client, path: str, body):
+    owner_id = await create_user(database, email="owner@example.com", accounts={1: 0})
+    payer_id = await create_user(database)
+    headers = bearer(owner_id, "owner@example.com")
+    before = await client.get("/user/me/accounts", headers=headers)
+    # The payload names another user than the owner of the credited account.
+    response = await client.post(path, json=body(webhook_payload(payer_id, 1, "5.00")))
+    after = await client.get("/user/me/accounts", headers={**headers, "If-None-Match": before.headers["ETag"]})
+    return owner_id, payer_id, response, after
+
+
+async def test_batch_payment_invalidates_owner_etag(database, client):
+    owner_id, payer_id, response, after = await credit_account_of_another_user(
+        database, client, "/webhook/batch", lambda payload: [payload])
+
+    assert response.json()["processed"] == 1
+    assert after.status_code == 200
+    assert after.json()[0]["balance"] == 5.0
+    assert recent_writes.get(owner_id) is not None
+    assert recent_writes.get(payer_id) is None
+
+
+@pytest.mark.postgres
+@pytest.mark.parametrize("hot", [False, True])
+async def test_payment_invalidates_owner_etag(database, client, monkeypatch, hot):
+    monkeypatch.setattr(crud, "HOT_ACCOUNT_IDS", {1} if hot else set())
+    owner_id, payer_id, response, after = await credit_account_of_another_user(
+        database, client, "/webhook", lambda payload: payload)
+
+    assert response.status_code == 200
+    assert after.status_code == 200
+    assert after.json()[0]["balance"] == 5.0
+    assert recent_writes.get(owner_id) is not None
+    assert recent_writes.get(payer_id) is None
@@ -0,0 +1,22 @@
+import pytest
+
+from benchmarks.payments_query_plan import explain, plan_variants, scans, seed, seq_scans
+from database.postgre_db import async_session
+from tests.conftest import create_user
+
+pytestmark = [pytest.mark.anyio, pytest.mark.postgres]
+
+ACCOUNTS = 5_000
+PAYMENTS = 200_000
+FIRST_ACCOUNT_ID = 400_000
+
+
+async def test_payment_history_uses_indexes(database):
+    # The seeded accounts that are not ours belong to user 1.
+    await create_user(database)
+    async with async_session() as session:
+        user_id = await seed(session, ACCOUNTS, own_accounts=3, payments=PAYMENTS, first_account_id=FIRST_ACCOUNT_ID)
+        failures = {name: seq_scans(scans(await explain(session, query)))
+                    for name, query in plan_variants(user_id, PAYMENTS, FIRST_ACCOUNT_ID).items()}
+
+    assert failures == dict.fromkeys(failures, [])
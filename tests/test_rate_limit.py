@@ -0,0 +1,122 @@
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+import main
+import rate_limit
+from rate_limit import Limit, MemoryTokenBucketStore, admission_control
+from routers import webhook
+from tests.conftest import bearer, create_user, webhook_payload
+
+pytestmark = pytest.mark.anyio
+
+CREDENTIALS = {"email": "nobody@example.com", "password": "wrong"}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # The token buckets read the time from here; advance it with clock.now += seconds.
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(rate_limit, "time", SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+@pytest.fixture
+def limits(monkeypatch, clock):
+    # Enables admission control with fresh buckets; returns a function that sets the limits and caps.
+    def configure(limits: dict = None, caps: dict = None):
+        monkeypatch.setattr(admission_control, "limits", limits or {})
+        monkeypatch.setattr(admission_control, "caps", caps or {})
+        monkeypatch.setattr(admission_control, "_in_flight", {route: 0 for route in caps or {}})
+
+    monkeypatch.setattr(admission_control, "enabled", True)
+    monkeypatch.setattr(admission_control, "store", MemoryTokenBucketStore(max_keys=100))
+    return configure
+
+
+def client_from(ip: str) -> httpx.AsyncClient:
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app, client=(ip, 1234)), base_url="http://test")
+
+
+async def test_rate_limited_request_gets_429_with_retry_after(database, client, limits):
+    limits({"login": Limit(rate=0.5, burst=2)})
+
+    statuses = [(await client.post("/login", json=CREDENTIALS)).status_code for _ in range(2)]
+    limited = await client.post("/login", json=CREDENTIALS)
+
+    assert statuses == [401, 401]
+    assert limited.status_code == 429
+    assert limited.headers["Retry-After"] == "2"
+
+
+async def test_bucket_refills_at_the_configured_rate(database, client, limits, clock):
+    limits({"login": Limit(rate=0.5, burst=1)})
+    assert (await client.post("/login", json=CREDENTIALS)).status_code == 401
+
+    clock.now += 1
+    limited = await client.post("/login", json=CREDENTIALS)
+    assert limited.status_code == 429
+    assert limited.headers["Retry-After"] == "1"
+    clock.now += 1
+    assert (await client.post("/login", json=CREDENTIALS)).status_code == 401
+
+
+async def test_login_is_limited_per_client_ip(database, limits):
+    limits({"login": Limit(rate=1, burst=1)})
+    async with client_from("10.0.0.1") as first, client_from("10.0.0.2") as second:
+        assert (await first.post("/login", json=CREDENTIALS)).status_code == 401
+        assert (await first.post("/login", json=CREDENTIALS)).status_code == 429
+        assert (await second.post("/login", json=CREDENTIALS)).status_code == 401
+
+
+async def test_user_routes_are_limited_per_authenticated_user(database, limits):
+    limits({"user": Limit(rate=1, burst=1)})
+    first = await create_user(database, email="first@example.com")
+    second = await create_user(database, email="second@example.com")
+    # The same client IP: the bucket belongs to the user, not to the address.
+    async with client_from("10.0.0.1") as client:
+        assert (await client.get("/user/me", headers=bearer(first, "first@example.com"))).status_code == 200
+        assert (await client.get("/user/me", headers=bearer(first, "first@example.com"))).status_code == 429
+        assert (await client.get("/user/me", headers=bearer(second, "second@example.com"))).status_code == 200
+
+
+async def test_webhooks_are_limited_per_payload_user_id(database, client, limits):
+    limits({"webhook": Limit(rate=1, burst=1)})
+    forged = {"signature": "0" * 64}
+
+    assert (await client.post("/webhook", json={**webhook_payload(1, 1, "1.00"), **forged})).status_code == 400
+    assert (await client.post("/webhook", json={**webhook_payload(1, 2, "1.00"), **forged})).status_code == 429
+    assert (await client.post("/webhook", json={**webhook_payload(2, 1, "1.00"), **forged})).status_code == 400
+
+
+async def test_requests_above_the_in_flight_cap_get_503(database, client, limits, monkeypatch):
+    limits(caps={"webhook": 1})
+    started = asyncio.Event()
+    release = asyncio.Event()
+
+    async def slow_verify_signature(payload):
+        started.set()
+        await release.wait()
+        return False
+
+    monkeypatch.setattr(webhook, "verify_signature", slow_verify_signature)
+    first = asyncio.create_task(client.post("/webhook", json=webhook_payload(1, 1, "1.00")))
+    await started.wait()
+
+    shed = await client.post("/webhook", json=webhook_payload(1, 1, "2.00"))
+    release.set()
+
+    assert shed.status_code == 503
+    assert shed.headers["Retry-After"] == "1"
+    assert (await first).status_code == 400
+    assert admission_control._in_flight == {"webhook": 0}
+
+
+def test_worker_gets_an_equal_share_of_every_limit(limits):
+    limits({"login": Limit(rate=10, burst=20), "webhook": Limit(rate=500, burst=2)})
+
+    admission_control.split(4)
+
+    assert admission_control.limits == {"login": Limit(rate=2.5, burst=5), "webhook": Limit(rate=125, burst=1)}
@@ -0,0 +1,103 @@
+import pytest
+from sqlalchemy import select, update
+from sqlalchemy.exc import OperationalError
+
+from cache import TTLCache
+from database import postgre_db
+from database.models import User
+from database.postgre_db import ReplicaRouter, async_session, current_user_id, mark_recent_write, read_replica
+from tests.conftest import bearer, create_user, webhook_payload
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def replicas(database, tmp_path, monkeypatch):
+    # Two SQLite stand-ins for read replicas, each with the first user under a name of its own,
+    # so that a read tells which engine served it.
+    router = ReplicaRouter([f"sqlite+aiosqlite:///{tmp_path / f'replica-{number}.db'}" for number in (1, 2)],
+                           "round_robin")
+    for name, replica in router.replicas:
+        async with replica.begin() as connection:
+            await connection.run_sync(postgre_db.Base.metadata.create_all)
+        await create_user(replica, email="reader@example.com", accounts={1: 0})
+        async with replica.begin() as connection:
+            await connection.execute(update(User).values(full_name=name))
+    monkeypatch.setattr(postgre_db, "replica_router", router)
+    try:
+        yield router
+    finally:
+        for _, replica in router.replicas:
+            await replica.dispose()
+
+
+async def read_name(user_id: int, read_only: bool = True, marked: bool = True) -> str:
+    query = select(User.full_name).where(User.id == user_id)
+    async with async_session() as session:
+        if read_only:
+            session.info["read_only"] = True
+        return await session.scalar(read_replica(query) if marked else query)
+
+
+async def test_marked_reads_of_read_only_sessions_go_to_the_replicas(database, replicas):
+    user_id = await create_user(database, email="reader@example.com")
+
+    assert [await read_name(user_id) for _ in range(4)] == ["replica-1", "replica-2"] * 2
+    assert await read_name(user_id, read_only=False) == "Test User"
+    assert await read_name(user_id, marked=False) == "Test User"
+
+
+async def test_unhealthy_replicas_are_skipped(database, replicas):
+    user_id = await create_user(database, email="reader@example.com")
+
+    replicas.mark("replica-1", False)
+    assert {await read_name(user_id) for _ in range(3)} == {"replica-2"}
+    replicas.mark("replica-2", False)
+    assert await read_name(user_id) == "Test User"
+    replicas.mark("replica-1", True)
+    assert await read_name(user_id) == "replica-1"
+
+
+async def test_unreachable_replica_falls_back_to_the_primary(database, tmp_path, monkeypatch):
+    user_id = await create_user(database, email="reader@example.com")
+    router = ReplicaRouter([f"sqlite+aiosqlite:///{tmp_path / 'missing' / 'replica.db'}"], "round_robin")
+    monkeypatch.setattr(postgre_db, "replica_router", router)
+
+    # A failed connect, of a health check or of a read, takes the replica out until its next passed check.
+    assert not await router.check(*router.replicas[0])
+    assert router.healthy == {"replica-1": False}
+    assert await read_name(user_id) == "Test User"
+
+    router.mark("replica-1", True)
+    with pytest.raises(OperationalError):
+        await read_name(user_id)
+    assert router.healthy == {"replica-1": False}
+    assert await read_name(user_id) == "Test User"
+    await router.replicas[0][1].dispose()
+
+
+async def test_reads_stay_on_the_primary_after_a_write(database, replicas, monkeypatch):
+    user_id = await create_user(database, email="reader@example.com")
+    monkeypatch.setattr(postgre_db, "recent_writes", TTLCache(maxsize=10, ttl=60))
+
+    token = current_user_id.set(user_id)
+    try:
+        mark_recent_write()
+        assert await read_name(user_id) == "Test User"
+    finally:
+        current_user_id.reset(token)
+    postgre_db.recent_writes.clear()
+    assert await read_name(user_id) == "replica-1"
+
+
+async def test_summary_after_a_payment_is_read_from_the_primary(database, client, replicas, monkeypatch):
+    user_id = await create_user(database, email="reader@example.com", accounts={1: 0})
+    headers = bearer(user_id, "reader@example.com")
+    monkeypatch.setattr(postgre_db, "recent_writes", TTLCache(maxsize=10, ttl=60))
+
+    await client.post("/webhook/batch", json=[webhook_payload(user_id, 1, "10.00")])
+    assert (await client.get("/user/me/summary", headers=headers)).json()["total_balance"] == 10.0
+
+    # Once the window is over, reads go back to the replicas, which have not seen the payment.
+    monkeypatch.setattr(postgre_db, "recent_writes", TTLCache(maxsize=10, ttl=0))
+    assert (await client.get("/user/me/summary", headers=headers)).json()["total_balance"] == 0.0
@@ -0,0 +1,28 @@
+import pytest
+
+import main
+from metrics import render_metrics
+from request_metrics import RequestMetricsMiddleware
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_label_sets_are_created_on_first_request():
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 204, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def send(message):
+        pass
+
+    middleware = RequestMetricsMiddleware(app, main.app.router)
+    assert middleware._metrics == {}
+
+    for path in ("/metrics", "/metrics", "/no-such-route"):
+        await middleware({"type": "http", "method": "GET", "path": path}, None, send)
+
+    assert set(middleware._metrics) == {("GET", "/metrics"), ("GET", "unmatched")}
+    assert set(middleware._metrics["GET", "/metrics"].responses) == {204}
+    rendered = render_metrics()
+    assert 'http_responses_total{method="GET",route="/metrics",status="204"} 2' in rendered
+    assert 'method="PATCH",route="unmatched"' not in rendered
@@ -0,0 +1,24 @@
+import hashlib
+import hmac
+
+from signing import WebhookSigner, canonical_message
+
+
+def expected_signature(key: str, *fields) -> str:
+    return hmac.new(key.encode(), canonical_message(*fields), hashlib.sha256).hexdigest()
+
+
+def test_sign_with_openssl_hmac():
+    signer = WebhookSigner(["key"])
+
+    assert signer.sign("t1", 1, 2, 300) == expected_signature("key", "t1", 1, 2, 300)
+
+
+def test_sign_without_openssl_hmac(monkeypatch):
+    # A digest constructor that is not an OpenSSL function makes hmac fall back to its pure-Python implementation.
+    sha256 = hashlib.sha256
+    monkeypatch.setattr(hashlib, "sha256", lambda *args, **kwargs: sha256(*args, **kwargs))
+    signer = WebhookSigner(["key"])
+    monkeypatch.undo()
+
+    assert signer.sign("t1", 1, 2, 300) == expected_signature("key", "t1", 1, 2, 300)
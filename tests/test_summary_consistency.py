@@ -0,0 +1,77 @@
+import uuid
+
+import pytest
+from sqlalchemy import func, select, update
+
+from database import crud
+from database.models import AccountStats, Payment
+from database.postgre_db import async_session
+from tests.conftest import create_user
+
+pytestmark = pytest.mark.anyio
+
+
+async def pay(user_id: int, account_id: int, amount: int = 100):
+    async with async_session() as session:
+        await crud.ingest_payments(session, [{"transaction_id": uuid.uuid4().hex, "user_id": user_id,
+                                              "account_id": account_id, "amount": amount}])
+
+
+async def check(repair: bool) -> list:
+    async with async_session() as session:
+        _, drift = await crud.check_account_stats(session, 0, 100, repair)
+    return drift
+
+
+async def stored_payment_count(database, account_id: int) -> int:
+    async with database.connect() as connection:
+        return await connection.scalar(select(AccountStats.payment_count).where(AccountStats.account_id == account_id))
+
+
+async def compact(account_id: int):
+    async with async_session() as session:
+        await crud.compact_account_balances(session, [account_id])
+
+
+async def test_shard_created_between_compaction_and_check_is_not_drift(database, monkeypatch):
+    user_id = await create_user(database, accounts={1: 0})
+    await pay(user_id, 1)
+    monkeypatch.setattr(crud, "HOT_ACCOUNT_IDS", {1})
+    await pay(user_id, 1)
+    await compact(1)
+    await pay(user_id, 1)
+    compact_account_balances = crud.compact_account_balances
+
+    async def compact_then_pay(session, account_ids):
+        # Should the check compact on its own, a hot account payment commits right after that as well.
+        folded = await compact_account_balances(session, account_ids)
+        await pay(user_id, 1)
+        return folded
+
+    monkeypatch.setattr(crud, "compact_account_balances", compact_then_pay)
+    assert await check(repair=True) == []
+    monkeypatch.setattr(crud, "compact_account_balances", compact_account_balances)
+
+    await compact(1)
+    async with database.connect() as connection:
+        ledger_payment_count = await connection.scalar(select(func.count()).select_from(Payment))
+    assert await stored_payment_count(database, 1) == ledger_payment_count
+    assert await check(repair=False) == []
+
+
+async def test_repair_leaves_pending_shards_to_compaction(database, monkeypatch):
+    user_id = await create_user(database, accounts={1: 0})
+    await pay(user_id, 1)
+    await pay(user_id, 1)
+    monkeypatch.setattr(crud, "HOT_ACCOUNT_IDS", {1})
+    await pay(user_id, 1)
+    async with database.begin() as connection:
+        await connection.execute(update(AccountStats).values(payment_count=7))
+
+    drift = await check(repair=True)
+
+    assert [(row["stored_payment_count"], row["ledger_payment_count"]) for row in drift] == [(8, 3)]
+    assert await stored_payment_count(database, 1) == 2
+    await compact(1)
+    assert await stored_payment_count(database, 1) == 3
+    assert await check(repair=False) == []
@@ -0,0 +1,23 @@
+import pytest
+
+from database import crud
+from tests.conftest import bearer, create_user, webhook_payload
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_summary_includes_hot_account_shards(database, client, monkeypatch):
+    user_id = await create_user(database, email="hot@example.com", accounts={1: 1000, 2: 0})
+    await client.post("/webhook/batch", json=[webhook_payload(user_id, 1, "1.00"),
+                                              webhook_payload(user_id, 2, "2.00")])
+    monkeypatch.setattr(crud, "HOT_ACCOUNT_IDS", {1, 2})
+    await client.post("/webhook/batch", json=[webhook_payload(user_id, 1, "3.00")])
+    await client.post("/webhook/batch", json=[webhook_payload(user_id, 1, "4.00")])
+
+    response = await client.get("/user/me/summary", headers=bearer(user_id, "hot@example.com"))
+
+    summary = response.json()
+    assert (summary["total_balance"], summary["payment_count"]) == (20.0, 4)
+    first, second = summary["accounts"]
+    assert (first["balance"], first["payment_count"], first["last_payment"]["amount"]) == (18.0, 3, 4.0)
+    assert (second["balance"], second["payment_count"], second["last_payment"]["amount"]) == (2.0, 1, 2.0)
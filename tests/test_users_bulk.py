@@ -0,0 +1,44 @@
+import json
+
+import pytest
+
+from routers import admin
+from tests.conftest import bearer, create_user
+
+pytestmark = pytest.mark.anyio
+
+
+def user(email: str, role: str = "user") -> dict:
+    return {"email": email, "hashed_password": "hash", "full_name": "Bulk User", "role": role}
+
+
+async def test_bulk_errors_are_in_input_order(database, client, monkeypatch):
+    monkeypatch.setattr(admin, "USERS_BULK_CHUNK_SIZE", 2)
+    admin_id = await create_user(database, email="admin@example.com", role="admin")
+    records = [user("admin@example.com"), user("new@example.com"), user("bad@example.com", role="root"),
+               user("new@example.com"), user("other@example.com")]
+    body = "\n".join(json.dumps(record) for record in records)
+
+    response = await client.post("/users/bulk", content=body, headers={
+        **bearer(admin_id, "admin@example.com"), "Content-Type": "application/x-ndjson"})
+
+    assert response.status_code == 200
+    result = response.json()
+    assert (result["created"], result["failed"]) == (2, 3)
+    assert [(error["index"], error["row"], error["email"]) for error in result["errors"]] == [
+        (0, 1, "admin@example.com"), (2, 3, "bad@example.com"), (3, 4, "new@example.com")]
+
+
+async def test_bulk_errors_keep_the_earliest_rows(database, client, monkeypatch):
+    monkeypatch.setattr(admin, "USERS_BULK_CHUNK_SIZE", 3)
+    monkeypatch.setattr(admin, "USERS_BULK_MAX_ERRORS", 2)
+    admin_id = await create_user(database, email="admin@example.com", role="admin")
+    # The conflicts of the first chunk are found after the invalid roles in the rows that follow them.
+    records = [user("admin@example.com"), user("admin@example.com"), *(user(f"{n}@example.com", "root")
+                                                                       for n in range(5))]
+
+    response = await client.post("/users/bulk", json=records, headers=bearer(admin_id, "admin@example.com"))
+
+    result = response.json()
+    assert result["failed"] == 7
+    assert [error["index"] for error in result["errors"]] == [0, 1]
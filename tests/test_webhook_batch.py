@@ -0,0 +1,62 @@
+import pytest
+from sqlalchemy import event, select
+
+from database.crud import ingest_payments
+from database.models import Account, Payment
+from database.postgre_db import async_session
+from tests.conftest import create_user, webhook_payload
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_batch_reports_status_per_item(database, client):
+    user_id = await create_user(database, accounts={1: 0})
+    processed = webhook_payload(user_id, 1, "10.50")
+    new_account = webhook_payload(user_id, 2, "1.00")
+    unknown_user = webhook_payload(user_id + 1000, 3, "5.00")
+    invalid = {**webhook_payload(user_id, 1, "2.00"), "signature": "0" * 64}
+
+    response = await client.post("/webhook/batch", json=[processed, unknown_user, invalid, new_account, processed])
+
+    assert response.status_code == 200
+    assert response.json() == {"processed": 2, "results": [
+        {"transaction_id": processed["transaction_id"], "status": "processed"},
+        {"transaction_id": unknown_user["transaction_id"], "status": "unknown_user"},
+        {"transaction_id": invalid["transaction_id"], "status": "invalid_signature"},
+        {"transaction_id": new_account["transaction_id"], "status": "processed"},
+        {"transaction_id": processed["transaction_id"], "status": "duplicate"},
+    ]}
+    async with database.connect() as connection:
+        balances = dict((await connection.execute(select(Account.id, Account.balance))).all())
+        payments = (await connection.execute(select(Payment.transaction_id))).scalars().all()
+    assert balances == {1: 1050, 2: 100}
+    assert sorted(payments) == sorted([processed["transaction_id"], new_account["transaction_id"]])
+
+
+async def test_batch_of_unknown_users_only(database, client):
+    payload = webhook_payload(1, 1, "1.00")
+
+    response = await client.post("/webhook/batch", json=[payload])
+
+    assert response.json() == {"processed": 0,
+                               "results": [{"transaction_id": payload["transaction_id"], "status": "unknown_user"}]}
+
+
+async def test_batch_inserts_accounts_and_payments_in_key_order(database):
+    user_id = await create_user(database)
+    payments = [{"transaction_id": transaction_id, "user_id": user_id, "account_id": account_id, "amount": 100}
+                for transaction_id, account_id in (("c", 3), ("a", 1), ("b", 2), ("d", 1))]
+    inserts = {}
+
+    @event.listens_for(database.sync_engine, "before_cursor_execute")
+    def record(connection, cursor, statement, parameters, context, executemany):
+        for table in ("accounts", "payments"):
+            if statement.startswith(f"INSERT INTO {table} "):
+                inserts[table] = context.compiled_parameters
+
+    async with async_session() as session:
+        inserted, unknown = await ingest_payments(session, payments)
+
+    assert inserted == {"a", "b", "c", "d"} and not unknown
+    assert [row["id"] for row in inserts["accounts"]] == [1, 2, 3]
+    assert [row["transaction_id"] for row in inserts["payments"]] == ["a", "b", "c", "d"]
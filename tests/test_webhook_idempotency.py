@@ -0,0 +1,76 @@
+import pytest
+
+from database.schemas import WebhookPayload
+from idempotency import webhook_idempotency
+from routers import webhook
+from tests.conftest import create_user, webhook_payload
+from webhook_queue import webhook_queue
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def queue(monkeypatch):
+    monkeypatch.setattr(webhook, "WEBHOOK_QUEUE_ENABLED", True)
+    await webhook_queue.start()
+    yield webhook_queue
+    await webhook_queue.stop()
+
+
+async def test_batch_payment_is_replayed_to_single_retry(database, client):
+    user_id = await create_user(database, accounts={1: 0})
+    payload = webhook_payload(user_id, 1, "3.00")
+    await client.post("/webhook/batch", json=[payload])
+
+    response = await client.post("/webhook", json=payload)
+
+    assert response.status_code == 200
+    assert response.headers["Idempotent-Replayed"] == "true"
+
+
+async def test_queued_payment_is_replayed_only_after_it_is_written(database, client, queue):
+    user_id = await create_user(database, accounts={1: 0})
+    payload = webhook_payload(user_id, 1, "3.00")
+
+    accepted = await client.post("/webhook", json=payload)
+    retried = await client.post("/webhook", json=payload)
+    await queue.stop()
+    replayed = await client.post("/webhook", json=payload)
+
+    assert accepted.status_code == retried.status_code == 202
+    assert "Idempotent-Replayed" not in retried.headers
+    assert replayed.status_code == 200
+    assert replayed.json() == {"detail": "Payment processed successfully"}
+    assert replayed.headers["Idempotent-Replayed"] == "true"
+
+
+async def test_dead_lettered_payment_is_forgotten(database, client, queue):
+    payload = webhook_payload(1000, 1, "3.00")
+    # A 202 recorded by an earlier version would otherwise be replayed to the retries forever.
+    await webhook_idempotency.remember(WebhookPayload(**payload), 202, "Payment accepted for processing")
+    queue.put(WebhookPayload(**payload))
+    await queue.stop()
+
+    assert await webhook_idempotency.get(payload["transaction_id"]) is None
+    await queue.start()
+    response = await client.post("/webhook", json=payload)
+    assert response.status_code == 202
+    assert "Idempotent-Replayed" not in response.headers
+
+
+async def test_forged_webhook_does_not_hold_the_transaction(database, client, monkeypatch):
+    user_id = await create_user(database, accounts={1: 0})
+    payload = webhook_payload(user_id, 1, "3.00")
+    in_flight = []
+    verify_signature = webhook.verify_signature
+
+    async def observed_verify_signature(payload):
+        # Genuine retries arriving now must not find the forged request registered as in flight.
+        in_flight.append(payload.transaction_id in webhook_idempotency._in_flight)
+        return await verify_signature(payload)
+
+    monkeypatch.setattr(webhook, "verify_signature", observed_verify_signature)
+    forged = await client.post("/webhook", json={**payload, "signature": "0" * 64})
+
+    assert forged.status_code == 400
+    assert in_flight == [False]
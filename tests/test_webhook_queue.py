@@ -0,0 +1,73 @@
+import pytest
+from sqlalchemy import select
+from sqlalchemy.exc import OperationalError
+
+from database import crud
+from database.models import Account, Payment, WebhookDeadLetter
+from database.schemas import WebhookPayload
+from jobs import webhook_dead_letters
+from tests.conftest import create_user, webhook_payload
+import webhook_queue as queue_module
+from webhook_queue import WebhookQueue
+
+pytestmark = pytest.mark.anyio
+
+
+def queue_batch(*payloads) -> list:
+    return [(0, WebhookPayload(**payload)) for payload in payloads]
+
+
+async def table(database, *columns) -> list:
+    async with database.connect() as connection:
+        return (await connection.execute(select(*columns).order_by(columns[0]))).all()
+
+
+async def test_flush_dead_letters_only_refused_payments(database, monkeypatch):
+    # Without the owner pre-check the unknown user fails the accounts.owner_id foreign key in the database.
+    async def no_unknown_owners(session, payments):
+        return set()
+
+    monkeypatch.setattr(crud, "get_unknown_owner_payments", no_unknown_owners)
+    user_id = await create_user(database, accounts={1: 0})
+    valid = [webhook_payload(user_id, 1, f"{amount}.00") for amount in range(1, 6)]
+    refused = webhook_payload(user_id + 1000, 2, "7.00")
+
+    await WebhookQueue(10, 10, 10, flush_retries=2)._flush(queue_batch(*valid[:2], refused, *valid[2:]))
+
+    assert await table(database, Account.id, Account.balance) == [(1, 1500)]
+    assert len(await table(database, Payment.id)) == 5
+    dead_letters = await table(database, WebhookDeadLetter.transaction_id, WebhookDeadLetter.amount)
+    assert dead_letters == [(refused["transaction_id"], 700)]
+
+
+async def test_flush_dead_letters_unknown_users(database):
+    user_id = await create_user(database, accounts={1: 0})
+    valid = webhook_payload(user_id, 1, "1.00")
+    unknown = webhook_payload(user_id + 1000, 2, "2.00")
+
+    await WebhookQueue(10, 10, 10, flush_retries=2)._flush(queue_batch(valid, unknown))
+
+    assert await table(database, Account.id, Account.balance) == [(1, 100)]
+    assert await table(database, WebhookDeadLetter.transaction_id) == [(unknown["transaction_id"],)]
+
+
+async def test_flush_dead_letters_batch_after_retries(database, monkeypatch):
+    async def unavailable(session, payments):
+        raise OperationalError("INSERT", {}, ConnectionError("connection refused"))
+
+    user_id = await create_user(database, accounts={1: 0})
+    payloads = [webhook_payload(user_id, 1, "1.00"), webhook_payload(user_id, 1, "2.00")]
+    monkeypatch.setattr(queue_module, "ingest_payments", unavailable)
+
+    await WebhookQueue(10, 10, 1, flush_retries=3)._flush(queue_batch(*payloads))
+
+    assert {row.transaction_id for row in await table(database, WebhookDeadLetter.transaction_id)} == {
+        payload["transaction_id"] for payload in payloads}
+    monkeypatch.setattr(queue_module, "ingest_payments", crud.ingest_payments)
+
+    report = await webhook_dead_letters.run(chunk_size=1, replay=True)
+
+    assert sorted(report["replayed"]) == sorted(payload["transaction_id"] for payload in payloads)
+    assert report["remaining"] == []
+    assert await table(database, WebhookDeadLetter.id) == []
+    assert await table(database, Account.id, Account.balance) == [(1, 300)]
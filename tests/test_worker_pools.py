@@ -0,0 +1,82 @@
+from types import SimpleNamespace
+from unittest.mock import Mock
+
+import pytest
+from sqlalchemy import text
+
+from config import DB_MAX_OVERFLOW, DB_POOL_SIZE
+from database import postgre_db
+from database.crud import check_account_balances
+from jobs.runner import ChunkedJob, TRY_LOCK
+from rate_limit import admission_control
+import serving
+
+pytestmark = pytest.mark.anyio
+
+
+def test_single_process_keeps_configured_pool():
+    assert postgre_db.engine.pool.size() == DB_POOL_SIZE
+
+
+def test_worker_pool_limits(monkeypatch):
+    monkeypatch.setattr(postgre_db, "DB_MAX_CONNECTIONS", 80)
+    monkeypatch.setattr(postgre_db, "BALANCE_RECONCILIATION_INTERVAL_SECONDS", 0)
+
+    assert postgre_db.worker_pool_limits(1, 5, 10) == (5, 10)
+    assert postgre_db.worker_pool_limits(8, 5, 10) == (5, 5)
+    assert postgre_db.worker_pool_limits(16, 5, 10) == (5, 0)
+    assert postgre_db.worker_pool_limits(100, 5, 10) == (1, 0)
+    monkeypatch.setattr(postgre_db, "DB_MAX_CONNECTIONS", 0)
+    assert postgre_db.worker_pool_limits(100, 5, 10) == (5, 10)
+
+
+def test_configure_worker_pools(monkeypatch):
+    monkeypatch.setattr(postgre_db, "DB_MAX_CONNECTIONS", 80)
+    monkeypatch.setattr(postgre_db, "BALANCE_RECONCILIATION_INTERVAL_SECONDS", 0)
+    monkeypatch.setattr(postgre_db, "engine", postgre_db.engine)
+    primary = postgre_db.engine
+    try:
+        postgre_db.configure_worker_pools(8)
+        pool = postgre_db.engine.pool
+        assert postgre_db.engine is not primary
+        assert postgre_db.async_session.kw["bind"] is postgre_db.engine
+        assert (pool.size(), pool._max_overflow) == (min(DB_POOL_SIZE, 10), min(DB_MAX_OVERFLOW, 10 - pool.size()))
+    finally:
+        postgre_db.async_session.configure(bind=primary)
+
+
+@pytest.mark.postgres
+async def test_exclusive_run_is_skipped_while_another_process_runs_the_job(database):
+    job = ChunkedJob("test_exclusive", check_account_balances)
+    async with database.connect() as connection:
+        connection = await connection.execution_options(isolation_level="AUTOCOMMIT")
+        assert (await connection.execute(TRY_LOCK, {"name": job.name})).scalar()
+
+        assert await job.run(engine=database, exclusive=True) is None
+        await connection.execute(text("SELECT pg_advisory_unlock_all()"))
+
+    report = await job.run(engine=database, exclusive=True)
+    assert report["checked"] == 0
+
+
+def test_gunicorn_worker_splits_pools_and_rate_limits(monkeypatch):
+    split = []
+    monkeypatch.setattr(postgre_db, "configure_worker_pools", lambda workers: split.append(("pools", workers)))
+    monkeypatch.setattr(admission_control, "split", lambda workers: split.append(("rate_limits", workers)))
+
+    serving.post_fork(SimpleNamespace(num_workers=4), None)
+
+    assert split == [("pools", 4), ("rate_limits", 4)]
+
+
+@pytest.mark.parametrize("replicas", [[], ["postgresql+asyncpg://replica/app"]])
+def test_gunicorn_warns_about_per_worker_state(monkeypatch, replicas):
+    monkeypatch.setattr(serving, "DATABASE_REPLICA_URLS", replicas)
+    log = Mock()
+
+    serving.when_ready(SimpleNamespace(num_workers=1, log=log))
+    assert not log.warning.called
+    serving.when_ready(SimpleNamespace(num_workers=4, log=log))
+    warnings = " ".join(call.args[0] for call in log.warning.call_args_list)
+    assert "/metrics" in warnings
+    assert ("read-your-writes" in warnings) == bool(replicas)
@@ -0,0 +1,192 @@
+import asyncio
+import time
+
+from loguru import logger
+from sqlalchemy.exc import DataError, IntegrityError
+
+from config import (WEBHOOK_QUEUE_MAX_SIZE,
+                    WEBHOOK_QUEUE_BATCH_SIZE,
+                    WEBHOOK_QUEUE_FLUSH_INTERVAL_MS,
+                    WEBHOOK_QUEUE_FLUSH_RETRIES)
+from database.crud import ingest_payments, create_webhook_dead_letters
+from database.postgre_db import async_session
+from database.schemas import WebhookPayload
+from idempotency import webhook_idempotency
+from metrics import Counter, Gauge, Histogram
+
+queue_depth = Gauge("webhook_queue_depth", "Payments waiting in the webhook queue")
+enqueued_total = Counter("webhook_queue_enqueued_total", "Payments accepted into the webhook queue")
+rejected_total = Counter("webhook_queue_rejected_total", "Payments rejected because the webhook queue was full")
+flushed_total = Counter("webhook_queue_flushed_payments_total",
+                        "Payments handled by the webhook queue consumer by result", ("result",))
+flush_failures_total = Counter("webhook_queue_flush_failures_total", "Failed webhook queue flush attempts")
+batch_size_histogram = Histogram("webhook_queue_batch_size", "Payments per webhook queue flush",
+                                 buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000))
+flush_seconds = Histogram("webhook_queue_flush_seconds", "Duration of one webhook queue flush transaction")
+queue_wait_seconds = Histogram("webhook_queue_wait_seconds", "Time from enqueue until the payment is committed")
+
+
+class WebhookQueueFull(Exception):
+    pass
+
+
+class WebhookQueue:
+    """
+    Ограниченная очередь отложенной записи платежей.
+
+    `put` только кладет проверенный платеж в очередь. Фоновый потребитель собирает пакеты не больше
+    `batch_size` платежей или ждет не дольше `flush_interval_ms` с момента первого платежа в пакете
+    и записывает каждый пакет одной транзакцией через `write_payments`. Платежи, которые так и не удалось
+    записать, сохраняются в `webhook_dead_letters`. При остановке очередь перестает принимать платежи
+    и дописывает все, что в ней осталось.
+    """
+
+    def __init__(self, max_size: int, batch_size: int, flush_interval_ms: int, flush_retries: int):
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.flush_retries = flush_retries
+        self._queue = None
+        self._consumer = None
+        self._stopping = None
+
+    @property
+    def running(self):
+        return self._consumer is not None and not self._stopping.is_set()
+
+    def qsize(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def put(self, payload: WebhookPayload):
+        if not self.running:
+            rejected_total.inc()
+            raise WebhookQueueFull("Webhook queue is not accepting payments")
+        try:
+            self._queue.put_nowait((time.perf_counter(), payload))
+        except asyncio.QueueFull:
+            rejected_total.inc()
+            raise WebhookQueueFull("Webhook queue is full")
+        enqueued_total.inc()
+
+    async def start(self):
+        logger.info("Starting webhook queue: max size {}, batch size {}, flush interval {:.0f} ms",
+                    self.max_size, self.batch_size, self.flush_interval * 1000)
+        self._queue = asyncio.Queue(self.max_size)
+        self._stopping = asyncio.Event()
+        self._consumer = asyncio.create_task(self._consume())
+        queue_depth.set_function(self.qsize)
+
+    async def stop(self):
+        if self._consumer is None:
+            return
+        logger.info("Stopping webhook queue, flushing {} pending payments", self.qsize())
+        self._stopping.set()
+        await self._consumer
+        self._consumer = None
+        logger.info("Webhook queue stopped")
+
+    async def _consume(self):
+        while not (self._stopping.is_set() and self._queue.empty()):
+            batch = await self._collect()
+            if batch:
+                await self._flush(batch)
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        try:
+            first = await asyncio.wait_for(self._queue.get(), self.flush_interval)
+        except asyncio.TimeoutError:
+            return []
+        batch = [first]
+        deadline = loop.time() + self.flush_interval
+        while len(batch) < self.batch_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0 or self._stopping.is_set():
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _flush(self, batch: list):
+        payments = {}
+        for _, payload in batch:
+            payments.setdefault(payload.transaction_id, {"transaction_id": payload.transaction_id,
+                                                         "user_id": payload.user_id,
+                                                         "account_id": payload.account_id,
+                                                         "amount": payload.amount})
+        batch_size_histogram.observe(len(batch))
+
+        started = time.perf_counter()
+        inserted, failed = await write_payments(list(payments.values()), self.flush_retries, self.flush_interval)
+        finished = time.perf_counter()
+        flush_seconds.observe(finished - started)
+        for enqueued_at, _ in batch:
+            queue_wait_seconds.observe(finished - enqueued_at)
+        await self._remember({payload.transaction_id: payload for _, payload in batch
+                              if payload.transaction_id in inserted}.values())
+        if failed:
+            await self._dead_letter([payments[transaction_id] for transaction_id in failed], failed)
+        flushed_total.labels("processed").inc(len(inserted))
+        flushed_total.labels("duplicate").inc(len(batch) - len(inserted) - len(failed))
+        logger.info("Webhook queue flushed {} of {} payments", len(inserted), len(batch))
+
+    async def _remember(self, payloads):
+        # Retries of a written payment get the response of a synchronously processed one.
+        await asyncio.gather(*(webhook_idempotency.remember(payload, 200, "Payment processed successfully")
+                               for payload in payloads))
+
+    async def _dead_letter(self, payments: list, errors: dict):
+        # The provider's retries must reach the queue again rather than a recorded response.
+        await asyncio.gather(*(webhook_idempotency.forget(transaction_id) for transaction_id in errors))
+        try:
+            async with async_session() as session:
+                await create_webhook_dead_letters(session, payments, errors)
+        except Exception as e:
+            # Last resort: the payments were acknowledged, so they must at least be recoverable from the log.
+            logger.error("Failed to dead-letter {} webhook payments ({}), dropping: {}", len(payments), e,
+                         [{**payment, "amount": str(payment["amount"]), "error": errors[payment["transaction_id"]]}
+                          for payment in payments])
+            flushed_total.labels("failed").inc(len(payments))
+            return
+        logger.error("Dead-lettered {} webhook payments: {}", len(payments), errors)
+        flushed_total.labels("dead_letter").inc(len(payments))
+
+
+async def write_payments(payments: list, retries: int, backoff: float) -> tuple:
+    # Writes ingest_payments dicts in one transaction where possible. A payment the database refuses
+    # (a constraint or an invalid value) only fails its half of the batch, which is split again until
+    # the failing payments are alone, so the valid ones are still written. Other errors are retried
+    # `retries` times with a growing pause. Returns the set of inserted transaction IDs and a dict of
+    # the transaction IDs that could not be written with the reason.
+    for attempt in range(1, retries + 1):
+        try:
+            async with async_session() as session:
+                inserted, unknown = await ingest_payments(session, payments)
+            return inserted, dict.fromkeys(unknown, "Account does not exist and its user is unknown")
+        except (IntegrityError, DataError) as e:
+            flush_failures_total.inc()
+            if len(payments) == 1:
+                logger.error("Webhook payment {} refused: {}", payments[0]["transaction_id"], e.orig)
+                return set(), {payments[0]["transaction_id"]: str(e.orig)}
+            logger.warning("Webhook payment batch of {} refused, splitting it: {}", len(payments), e.orig)
+            middle = len(payments) // 2
+            inserted, failed = await write_payments(payments[:middle], retries, backoff)
+            rest_inserted, rest_failed = await write_payments(payments[middle:], retries, backoff)
+            return inserted | rest_inserted, {**failed, **rest_failed}
+        except Exception as e:
+            flush_failures_total.inc()
+            logger.error("Webhook payment write attempt {} of {} failed: {}", attempt, retries, e)
+            if attempt == retries:
+                return set(), dict.fromkeys((payment["transaction_id"] for payment in payments), str(e))
+            await asyncio.sleep(backoff * attempt)
+
+
+webhook_queue = WebhookQueue(max_size=WEBHOOK_QUEUE_MAX_SIZE,
+                             batch_size=WEBHOOK_QUEUE_BATCH_SIZE,
+                             flush_interval_ms=WEBHOOK_QUEUE_FLUSH_INTERVAL_MS,
+                             flush_retries=WEBHOOK_QUEUE_FLUSH_RETRIES)